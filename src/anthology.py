@@ -1,7 +1,95 @@
 from __future__ import annotations
-from random import choice
+import json
+from collections import deque
+from itertools import zip_longest
+from random import choice, sample
+from time import monotonic
+from typing import Any, Callable
+from pydantic import BaseModel, ConfigDict
+from decay import MemoryDecay
 from entities import Faction, Character
-from utils import generate_single_response, generate_summary, save_json, save_summary
+from logs import close_streams, path_part
+from store import AnthologyStore
+from tracing import span, traced
+from utils import (
+    MODEL_ROUTES,
+    TELEMETRY,
+    content_hash,
+    cosine_similarity,
+    estimate_similarity,
+    embed_texts,
+    embeddings_enabled,
+    generate_structured_response,
+    generate_summary,
+    log_dir,
+    TaskGraph,
+    minhash_signature,
+    save_json,
+    save_summary,
+    set_route,
+    use_log_dir,
+)
+
+# NOTE: shingle overlap is checked first since it's free, embeddings only catch the rewordings it misses.
+EVENT_SHINGLE_THRESHOLD: float = 0.6
+EVENT_SIMILARITY_THRESHOLD: float = 0.92
+# NOTE: how many end-of-era tasks (legends, summaries, suggestions) run at once.
+END_OF_ERA_WORKERS: int = 4
+# NOTE: worlds with more factions than this are split into clusters of related factions, each with its own event generation prompt.
+MAX_CLUSTER_SIZE: int = 4
+# NOTE: how many clusters (and events) the pass for events between clusters looks at.
+CROSS_CLUSTER_SAMPLE: int = 2
+CROSS_CLUSTER_EVENTS: int = 3
+EVENT_GENERATION_WORKERS: int = 4
+
+
+class Event(BaseModel):
+    """
+    A possible event for an Era, along with the names of the characters suggested to take part in it.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    description: str
+    participants: list[str]
+
+
+class PossibleEvents(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    events: list[Event]
+
+
+class SuggestedFaction(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    description: str
+
+
+class SuggestedCharacter(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    age: str
+    pronouns: str
+    personality: str
+    description: str
+    faction: str
+
+
+class NextEra(BaseModel):
+    """
+    A suggestion for the Era that follows this one: its theme, and a new generation of factions and characters.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    theme: str
+    duration: int
+    factions: list[SuggestedFaction]
+    characters: list[SuggestedCharacter]
 
 
 class Era:
@@ -16,17 +104,30 @@ class Era:
     _year
     _summary
     _events
+    _event_signatures
+    _event_embeddings
+    _conversations_saved
+    _suggestion
+    _decay
+    _prewarmed_events
+    max_events
+    max_turns
 
     Methods:
     add_faction()
     remove_faction()
     advance_time()
     generate_possible_events()
+    events_fingerprint()
+    prewarm_events()
+    faction_clusters()
+    deduplicate_events()
     add_event()
     lose_event()
     get_characters()
     have_conversation()
     generate_summary()
+    suggest_next_era()
     """
 
     def __init__(
@@ -34,15 +135,24 @@ class Era:
         name: str,
         duration: int,
         theme: str,
-        factions: dict[str, Faction] = {},
+        factions: dict[str, Faction] | None = None,
     ) -> None:
         self.name = name
         self.duration = duration
         self.theme = theme
-        self.factions = factions
+        self.factions = factions if factions is not None else {}
         self._year: int = 0
         self._summary: str = ""
-        self._events: list[str] = []
+        self._events: list[Event] = []
+        self._event_signatures: list[list[int]] = []
+        self._event_embeddings: list[list[float]] = []
+        self._conversations_saved: int = 0
+        self._suggestion: NextEra | None = None
+        self._decay = MemoryDecay()
+        self._prewarmed_events: dict[str, list[Event]] = {}
+        # NOTE: limits that a Governor can impose to keep the Era within budget. None means no limit.
+        self.max_events: int | None = None
+        self.max_turns: int | None = None
 
     def add_faction(self, faction: Faction) -> None:
         """
@@ -66,37 +176,227 @@ class Era:
         if self._year >= self.duration:
             difference = self._year - self.duration
             if difference == 0:
-                return difference
+                return inc
             self._year = self.duration
             return inc - difference
         return inc
 
-    def generate_possible_events(self) -> None:
+    def generate_possible_events(self, years: int = 1) -> None:
         """
         Use an LLM to generate events that could happen during the current Era that fits with the given theme.
+        The event budget is the same however many years are being covered, so a longer stretch of time gets fewer, more significant events per year.
+        Once there are too many factions for one prompt, each cluster of related factions (see faction_clusters) gets its own prompt and event budget, all generated concurrently,
+        followed by a small pass for events that cross between clusters.
         """
-        context = "\n".join([
-            faction.generate_summary() for faction in self.factions.values()
-        ])
+        events = self._prewarmed_events.pop(self.events_fingerprint(years), None)
+        if events is None:
+            events = self._plan_events(years)
+        else:
+            TELEMETRY.count("prewarmed_events")
+        self._prewarmed_events.clear()
+        if self.max_events is not None:
+            events = events[: self.max_events]
+        self._events.extend(self.deduplicate_events(events))
+        self.save_events()
+
+    def _plan_events(self, years: int) -> list[Event]:
+        span_of_time = (
+            ""
+            if years == 1
+            else f" These events are spread over the next {years} years, so only include the most significant ones."
+        )
+        clusters = self.faction_clusters()
+        if len(clusters) == 1:
+            summaries = [faction.generate_summary() for faction in clusters[0]]
+            return self._generate_events(clusters[0], summaries, span_of_time)
+        return self._generate_clustered_events(clusters, span_of_time)
+
+    def events_fingerprint(self, years: int = 1) -> str:
+        """
+        A hash of everything the next events are generated from, which changes whenever the Era or any of its factions are edited.
+        """
+        return content_hash(
+            json.dumps([
+                self.name,
+                self.theme,
+                years,
+                self.max_events,
+                [faction.fingerprint() for faction in self.factions.values()],
+            ])
+        )
+
+    def prewarm_events(self, years: int = 1) -> None:
+        """
+        Generate the next step's events ahead of time (say, while the user is still answering prompts). generate_possible_events uses them if nothing has changed since.
+        """
+        fingerprint = self.events_fingerprint(years)
+        self._prewarmed_events[fingerprint] = self._plan_events(years)
+
+    def faction_clusters(self, max_size: int = MAX_CLUSTER_SIZE) -> list[list[Faction]]:
+        """
+        Split the factions into clusters of at most max_size that keep allies and enemies together.
+        Each connected component of the allies/enemies graph is broken up in breadth-first order (so neighbors stay together), then small pieces are packed into shared clusters.
+        """
+        neighbors: dict[str, set[str]] = {name: set() for name in self.factions}
+        for faction in self.factions.values():
+            for other in faction._allies | faction._enemies:
+                if other.name in neighbors and other.name != faction.name:
+                    neighbors[faction.name].add(other.name)
+                    neighbors[other.name].add(faction.name)
+        pieces: list[list[str]] = []
+        seen: set[str] = set()
+        for name in self.factions:
+            if name in seen:
+                continue
+            component = []
+            queue = deque([name])
+            seen.add(name)
+            while len(queue) > 0:
+                current = queue.popleft()
+                component.append(current)
+                for neighbor in sorted(neighbors[current] - seen):
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+            pieces.extend([
+                component[index : index + max_size]
+                for index in range(0, len(component), max_size)
+            ])
+        clusters: list[list[str]] = []
+        for piece in sorted(pieces, key=len, reverse=True):
+            for cluster in clusters:
+                if len(cluster) + len(piece) <= max_size:
+                    cluster.extend(piece)
+                    break
+            else:
+                clusters.append(list(piece))
+        return [[self.factions[name] for name in cluster] for cluster in clusters]
+
+    def _generate_events(
+        self,
+        factions: list[Faction],
+        summaries: list[str],
+        span_of_time: str,
+        event_count: str = "",
+        instructions: str = "",
+    ) -> list[Event]:
+        context = "\n".join(summaries)
+        names = ", ".join([name for faction in factions for name in faction.characters])
+        if event_count == "":
+            event_count = (
+                "5 to 10" if self.max_events is None else f"1 to {self.max_events}"
+            )
         prompt = f"""
-Come up with a series of 5 to 10 events that could happen in the {self.name} era. The theme of this era is {self.theme}. Here are the following factions, their relationships, and their characters:
+Come up with a series of {event_count} events that could happen in the {self.name} era.{span_of_time} The theme of this era is {self.theme}. Here are the following factions, their relationships, and their characters:
 {context}
-Format your answer as an unordered markdown list like so:
-- event a
-- event b
-- event c
+{instructions}For each event, give a description of the event and the names of the one to four characters who take part in it. Only use names from this list: {names}
 """
-        result = generate_single_response(prompt)
-        print(f"events: {result}\n")
-        events = result.split("- ")[1:]
+        result = generate_structured_response(
+            prompt, PossibleEvents, "event-generation"
+        )
+        print(f"events: {result.events}\n")
+        for event in result.events:
+            event.description = event.description.strip()
+        return [event for event in result.events if event.description != ""]
+
+    def _generate_clustered_events(
+        self, clusters: list[list[Faction]], span_of_time: str
+    ) -> list[Event]:
+        """
+        Summarize every faction, then generate each cluster's events as soon as its summaries are ready, then a few events crossing between a sample of clusters.
+        Every prompt holds at most MAX_CLUSTER_SIZE summaries (CROSS_CLUSTER_SAMPLE clusters' worth for the crossing pass), however big the world gets.
+        """
+        graph = TaskGraph(EVENT_GENERATION_WORKERS)
+        for faction in self.factions.values():
+            graph.add(f"summary:{faction.name}", faction.generate_summary)
+
+        def cluster_task(cluster: list[Faction]) -> Callable[[], list[Event]]:
+            return lambda: self._generate_events(
+                cluster,
+                [graph.results[f"summary:{faction.name}"] for faction in cluster],
+                span_of_time,
+            )
+
+        for index, cluster in enumerate(clusters):
+            graph.add(
+                f"events:{index}",
+                cluster_task(cluster),
+                [f"summary:{faction.name}" for faction in cluster],
+            )
+        # NOTE: sampled up front, on this thread, so seeded runs pick the same clusters
+        crossing = sorted(
+            sample(range(len(clusters)), min(CROSS_CLUSTER_SAMPLE, len(clusters)))
+        )
+
+        def cross_clusters() -> list[Event]:
+            factions = [faction for index in crossing for faction in clusters[index]]
+            planned = "\n".join([
+                f"- {event.description}"
+                for index in crossing
+                for event in graph.results[f"events:{index}"]
+            ])
+            return self._generate_events(
+                factions,
+                [graph.results[f"summary:{faction.name}"] for faction in factions],
+                span_of_time,
+                f"1 to {CROSS_CLUSTER_EVENTS}",
+                f"These events are already planned:\n{planned}\nOnly come up with new events, each bringing together characters from factions that don't usually deal with each other.\n",
+            )
+
+        graph.add(
+            "events:crossing",
+            cross_clusters,
+            [f"events:{index}" for index in crossing],
+        )
+        results = graph.run()
+        # NOTE: interleaved, so a Governor's max_events cuts evenly across clusters
+        grouped = [results[f"events:{index}"] for index in range(len(clusters))]
+        grouped.append(results["events:crossing"])
+        return [
+            event
+            for batch in zip_longest(*grouped)
+            for event in batch
+            if event is not None
+        ]
+
+    def deduplicate_events(self, events: list[Event]) -> list[Event]:
+        """
+        Drop any events that are near-duplicates of each other or of an event seen earlier in the Era, since each one would kick off a full conversation.
+        Shingle overlap (via MinHash) catches the cheap cases, then a single batch of embeddings catches rewordings.
+        """
+        candidates: list[tuple[Event, list[int]]] = []
         for event in events:
-            event.strip()
-            self._events.append(event)
-        save_json(f"{self.name}_events", self._events)
+            signature = minhash_signature(event.description)
+            if any([
+                estimate_similarity(signature, seen) >= EVENT_SHINGLE_THRESHOLD
+                for seen in self._event_signatures + [other for _, other in candidates]
+            ]):
+                print(f"skipping duplicate event: {event.description}")
+                self._conversations_saved += 1
+                continue
+            candidates.append((event, signature))
+        if len(candidates) == 0:
+            return []
+        embeddings = embed_texts([event.description for event, _ in candidates])
+        res: list[Event] = []
+        for (event, signature), embedding in zip(candidates, embeddings):
+            if any([
+                cosine_similarity(embedding, seen) >= EVENT_SIMILARITY_THRESHOLD
+                for seen in self._event_embeddings
+            ]):
+                print(f"skipping duplicate event: {event.description}")
+                self._conversations_saved += 1
+                continue
+            self._event_signatures.append(signature)
+            self._event_embeddings.append(embedding)
+            res.append(event)
+        return res
 
-    def get_next_event(self) -> str:
+    def save_events(self) -> None:
+        save_json("era_events", [event.model_dump() for event in self._events])
+
+    def get_next_event(self) -> Event:
         next = self._events.pop()
-        save_json(f"{self.name}_events", self._events)
+        self.save_events()
         return next
 
     def add_event(
@@ -124,27 +424,32 @@ Format your answer as an unordered markdown list like so:
 
     def get_characters(self, names: set[str] = set()) -> set[Character]:
         """
-        Take a set of names and pull the characters from your factions. if no names are given, choose some random characters.
+        Take a set of names and pull the characters from your factions. if no names are given, or none of them match, choose some random characters.
         """
         res: set[Character] = set()
-        if len(names) == 0:
-            character_count = choice(range(1, 5))
-            while len(res) < character_count:
-                faction = choice(list(self.factions.values()))
-                res.add(faction.get_character())
-            return res
         for faction in self.factions.values():
             for name in names:
                 if name not in faction.characters:
                     continue
                 res.add(faction.characters[name])
+        if len(res) > 0:
+            return res
+        total = sum([len(faction.characters) for faction in self.factions.values()])
+        character_count = min(choice(range(1, 5)), total)
+        while len(res) < character_count:
+            faction = choice(list(self.factions.values()))
+            res.add(faction.get_character())
         return res
 
+    @traced("conversation")
     def have_conversation(
-        self, characters: set[Character], context: str
+        self,
+        characters: set[Character],
+        context: str,
+        on_turn: Callable[[dict[str, str]], None] | None = None,
     ) -> list[dict[str, str]]:
         """
-        Generate a conversation between some set of characters, returning the resulting conversation.
+        Generate a conversation between some set of characters, returning the resulting conversation. on_turn is called with each message as it's spoken.
         """
         print(
             f"starting a convo with {" ".join([character.name for character in characters])}"
@@ -170,13 +475,18 @@ Format your answer as an unordered markdown list like so:
                     "index": character.start_conversation(others),
                 }
             active_character = choice(list(characters))
-        last_message = active_character.speak(
-            participants[active_character]["others"],
-            participants[active_character]["index"],
-            context,
-        )
+        with span("turn", speaker=active_character.name):
+            last_message = active_character.speak(
+                participants[active_character]["others"],
+                participants[active_character]["index"],
+                context,
+            )
         conversation.append(last_message)
-        while "</SCENE>" not in last_message["content"]:
+        if on_turn is not None:
+            on_turn(last_message)
+        while "</SCENE>" not in last_message["content"] and (
+            self.max_turns is None or len(conversation) < self.max_turns
+        ):
             for character in participants[active_character]["others"]:
                 character.listen(
                     participants[character]["others"],
@@ -184,11 +494,16 @@ Format your answer as an unordered markdown list like so:
                     last_message,
                 )
             active_character = choice(list(characters))
-            last_message = active_character.speak(
-                participants[active_character]["others"],
-                participants[active_character]["index"],
-            )
+            with span("turn", speaker=active_character.name):
+                last_message = active_character.speak(
+                    participants[active_character]["others"],
+                    participants[active_character]["index"],
+                )
             conversation.append(last_message)
+            if on_turn is not None:
+                on_turn(last_message)
+        TELEMETRY.count("conversations")
+        TELEMETRY.count("conversation_turns", len(conversation))
         convo = "\n".join([
             message["content"] for message in conversation if len(conversation) > 0
         ])
@@ -212,16 +527,259 @@ Format your answer as an unordered markdown list like so:
             )
         return conversation
 
-    def generate_summary(self) -> str:
-        history = "\n".join([
-            faction._history.generate_summary() for faction in self.factions.values()
-        ])
+    def generate_summary(self, histories: list[str] | None = None) -> str:
+        """
+        Summarize the Era from each faction's history summary. If they haven't been generated already (see Anthology.finish_era), they're generated one after the other.
+        """
+        if histories is None:
+            histories = [
+                faction._history.generate_summary()
+                for faction in self.factions.values()
+            ]
+        history = "\n".join(histories)
         summary = generate_summary(history)
         # del history
         print(summary)
-        save_summary(f"{self.name}_summary", summary)
+        save_summary("era_summary", summary)
         return summary
 
+    def suggest_next_era(self, faction_summaries: list[str]) -> NextEra:
+        """
+        Suggest the Era that comes after this one, with a new generation of factions and characters shaped by what each faction still remembers.
+        """
+        histories = "\n".join([
+            f"{faction.name} remembers: {" ".join(faction._history._remembered_history)}"
+            for faction in self.factions.values()
+        ])
+        context = "\n".join(faction_summaries)
+        prompt = f"""
+The {self.name} era, whose theme was {self.theme}, is ending. Here are its factions, their relationships, and their characters:
+{context}
+{histories}
+Suggest the era that comes next: give it a name, a theme, and a duration in years. Then suggest a new generation of factions and characters for it.
+Factions can carry over, split, merge, or be new. Every character should belong to one of the suggested factions, and each faction should have at least two characters.
+"""
+        suggestion = generate_structured_response(prompt, NextEra, "suggestion")
+        print(f"suggested next era: {suggestion.name} ({suggestion.theme})")
+        save_json("era_suggestion", suggestion.model_dump())
+        self._suggestion = suggestion
+        return suggestion
+
+
+class TimeStep:
+    """
+    Decides how many years each step of Anthology.advance_era covers. Every step gets the same event budget (see Era.generate_possible_events),
+    so longer steps mean fewer, more significant events per year and far fewer LLM calls per simulated century.
+    The base class steps one year at a time.
+
+    Methods:
+        next_step()
+        record()
+    """
+
+    def next_step(self, era: Era, years_left: int) -> int:
+        return 1
+
+    def record(self, era: Era, years: int, events: int) -> None:
+        """
+        Called after every step with how many years it covered and how many events were played out in it.
+        """
+        pass
+
+
+class FixedStep(TimeStep):
+    def __init__(self, years: int = 5) -> None:
+        self.years = years
+
+    def next_step(self, era: Era, years_left: int) -> int:
+        return max(1, min(self.years, years_left))
+
+
+class ExponentialStep(TimeStep):
+    """
+    Steps that grow by factor every time (1, 2, 4, ... years), so the start of an Era is told in the most detail and the rest passes in broader strokes.
+    """
+
+    def __init__(
+        self, start: int = 1, factor: float = 2.0, max_years: int = 16
+    ) -> None:
+        self.start = start
+        self.factor = factor
+        self.max_years = max_years
+        self._next: float = start
+
+    def next_step(self, era: Era, years_left: int) -> int:
+        return max(1, min(round(self._next), self.max_years, years_left))
+
+    def record(self, era: Era, years: int, events: int) -> None:
+        self._next = min(self._next * self.factor, self.max_years)
+
+
+class AdaptiveStep(TimeStep):
+    """
+    Steps that double while little is happening and halve when a lot is. A step is quiet if at most quiet_events (new, non-duplicate) events were played out in it, and busy if at least busy_events were.
+    """
+
+    def __init__(
+        self,
+        quiet_events: int = 6,
+        busy_events: int = 9,
+        min_years: int = 1,
+        max_years: int = 16,
+    ) -> None:
+        self.quiet_events = quiet_events
+        self.busy_events = busy_events
+        self.min_years = min_years
+        self.max_years = max_years
+        self._years: int = min_years
+
+    def next_step(self, era: Era, years_left: int) -> int:
+        return max(1, min(self._years, years_left))
+
+    def record(self, era: Era, years: int, events: int) -> None:
+        if events <= self.quiet_events:
+            self._years = min(self._years * 2, self.max_years)
+        elif events >= self.busy_events:
+            self._years = max(self._years // 2, self.min_years)
+
+
+TIME_STEPS: dict[str, type[TimeStep]] = {
+    "fixed": FixedStep,
+    "exponential": ExponentialStep,
+    "adaptive": AdaptiveStep,
+}
+
+
+class Governor:
+    """
+    Keeps an Era within a token, cost (USD), and/or wall-clock (seconds) budget.
+    After every year it projects the Era's total spend from the telemetry gathered so far, and if any budget would be exceeded it scales the simulation back one step at a time:
+    fewer events per year, shorter conversations, skipping feelings, then a cheaper model for summaries (unless summaries already use it).
+
+    Attributes:
+        max_tokens
+        max_cost
+        max_seconds
+        cheap_model
+        _degradations
+        _level
+
+    Methods:
+        start()
+        spent()
+        check()
+        finish()
+        report()
+    """
+
+    EVENTS_PER_YEAR: int = 3
+    TURNS_PER_CONVERSATION: int = 4
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        max_cost: float | None = None,
+        max_seconds: float | None = None,
+        cheap_model: str = "gpt-4o-mini",
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+        self.cheap_model = cheap_model
+        self._degradations: list[str] = []
+        self._level: int = 0
+        self._start: dict[str, float] = {}
+        self._started_at: float = 0.0
+        self._previous_summary_route: dict[str, str] | None = None
+        self._muted: list[Character] = []
+
+    def start(self) -> None:
+        self._start = TELEMETRY.snapshot()
+        self._started_at = monotonic()
+
+    def spent(self) -> dict[str, float]:
+        """
+        How many tokens, dollars, and seconds the Era has used since the governor was started.
+        """
+        now = TELEMETRY.snapshot()
+        return {
+            "tokens": now["tokens"] - self._start["tokens"],
+            "cost": now["cost"] - self._start["cost"],
+            "seconds": monotonic() - self._started_at,
+        }
+
+    def check(self, era: Era, years_done: int) -> None:
+        """
+        Project the total spend for the Era and degrade the simulation if it won't fit the budget.
+        """
+        if years_done <= 0 or years_done >= era.duration:
+            return
+        spent = self.spent()
+        budgets = {
+            "tokens": self.max_tokens,
+            "cost": self.max_cost,
+            "seconds": self.max_seconds,
+        }
+        for key, budget in budgets.items():
+            if budget is None:
+                continue
+            projected = spent[key] / years_done * era.duration
+            if projected <= budget:
+                continue
+            self.degrade(
+                era,
+                f"year {years_done}/{era.duration}: projected {key} {projected:.2f} over budget of {budget}",
+            )
+            # NOTE: only step down once per year, so the next projection can see whether it helped
+            return
+
+    def degrade(self, era: Era, reason: str) -> None:
+        self._level += 1
+        match self._level:
+            case 1:
+                era.max_events = self.EVENTS_PER_YEAR
+                change = f"limited events to {self.EVENTS_PER_YEAR} per year"
+            case 2:
+                era.max_turns = self.TURNS_PER_CONVERSATION
+                change = f"limited conversations to {self.TURNS_PER_CONVERSATION} turns"
+            case 3:
+                for faction in era.factions.values():
+                    for character in faction.characters.values():
+                        if character._feelings_enabled:
+                            character._feelings_enabled = False
+                            self._muted.append(character)
+                change = "skipped feelings lookups"
+            case 4 if MODEL_ROUTES["summary"]["model"] != self.cheap_model:
+                self._previous_summary_route = set_route("summary", self.cheap_model)
+                change = f"switched summaries to {self.cheap_model}"
+            case _:
+                self._level -= 1
+                return
+        print(f"governor: {change} ({reason})")
+        self._degradations.append(f"{change} ({reason})")
+
+    def finish(self) -> str:
+        """
+        Undo any global changes made by the governor and return a report of what was degraded and why.
+        """
+        if self._previous_summary_route is not None:
+            set_route("summary", **self._previous_summary_route)
+            self._previous_summary_route = None
+        for character in self._muted:
+            character._feelings_enabled = True
+        self._muted.clear()
+        return self.report()
+
+    def report(self) -> str:
+        spent = self.spent()
+        report = f"spent {spent['tokens']:.0f} tokens, ${spent['cost']:.4f}, {spent['seconds']:.1f} seconds."
+        if len(self._degradations) == 0:
+            return report + " nothing was degraded."
+        degradations = "\n".join([
+            f"- {degradation}" for degradation in self._degradations
+        ])
+        return f"{report} degraded:\n{degradations}"
+
 
 class Anthology:
     # TODO: add a docstring
@@ -231,21 +789,44 @@ class Anthology:
         setting: str,
         anthology_type: str,
         year: int = 0,
-        eras: dict[str, Era] = {},
+        eras: dict[str, Era] | None = None,
     ) -> None:
         self.name = name
         self.setting = setting
         self.anthology_type = anthology_type
         self._year = year
-        self._eras = eras
+        self._eras = eras if eras is not None else {}
         self._summary = ""
+        self._year_hooks: list[Callable[[Anthology, Era], None]] = []
+        self._turn_hooks: list[Callable[[Anthology, Era, dict[str, str]], None]] = []
+        self._store: AnthologyStore | None = None
+
+    def attach_store(self, store: AnthologyStore) -> None:
+        """
+        Record everything generated from now on (events, conversations, memories, legends, and summaries) in a searchable store.
+        """
+        self._store = store
+
+    def add_year_hook(self, hook: Callable[[Anthology, Era], None]) -> None:
+        """
+        Register a callback that runs at the end of every simulated step (one year, unless advance_era is given a TimeStep), after events have been played out and forgotten.
+        """
+        self._year_hooks.append(hook)
+
+    def add_turn_hook(
+        self, hook: Callable[[Anthology, Era, dict[str, str]], None]
+    ) -> None:
+        """
+        Register a callback that runs with every message spoken in a conversation, as soon as it's spoken.
+        """
+        self._turn_hooks.append(hook)
 
     def generate_summary(self) -> str:
         history = "\n".join([era._summary for era in self._eras.values()])
         summary = generate_summary(history)
         # del history
         print(f"anthology summary: {summary}")
-        save_summary(f"{self.name}_summary", summary)
+        save_summary("anthology_summary", summary)
         return summary
 
     def create_era(self, name: str, duration: int, theme: str) -> None:
@@ -259,37 +840,199 @@ class Anthology:
                 self.add_eras(era)
         # save_json(f"{self.name}_eras", self._eras)
 
-    def advance_era(self, era: str) -> None:
+    @traced("era")
+    def advance_era(
+        self,
+        era: str,
+        governor: Governor | None = None,
+        on_suggestions: Callable[[NextEra], None] | None = None,
+        time_step: TimeStep | None = None,
+    ) -> None:
+        """
+        Play out an era year by year (or several years per step, see TimeStep), then summarize it.
+        Its logs go to <log dir>/<anthology>/<era>, with everything saved during a step under year_<first year of the step>.
+        """
         starting_year = self._year
         current_era = self._eras[era]
-        while self._year < starting_year + current_era.duration:
-            self._year += current_era.advance_time()
-            current_era.generate_possible_events()
-            while len(current_era._events) > 0:
-                next_event = current_era.get_next_event()
-                characters = current_era.get_characters()
-                current_era.have_conversation(characters, next_event)
-                for character in characters:
-                    event = character.think(
-                        "You are telling your faction about the most recent conversation you had. Generate a third person summary that your faction would add to their history. Keep the summary between one and three sentences. Only include the summary in your response."
+        era_logs = log_dir() / path_part(self.name) / path_part(era)
+        with use_log_dir(era_logs):
+            if time_step is None:
+                time_step = TimeStep()
+            if governor is not None:
+                governor.start()
+            if self._store is not None:
+                self._store.add_era(self, current_era)
+            while self._year < starting_year + current_era.duration:
+                if governor is not None:
+                    governor.check(current_era, self._year - starting_year)
+                years_done = self._year - starting_year
+                step = time_step.next_step(
+                    current_era, current_era.duration - years_done
+                )
+                year_logs = era_logs / f"year_{self._year + 1}"
+                with (
+                    span("year", era=era, year=years_done + 1, years=step),
+                    use_log_dir(year_logs),
+                ):
+                    years = current_era.advance_time(step)
+                    self._year += years
+                    current_era.generate_possible_events(years)
+                    if self._store is not None:
+                        for event in current_era._events:
+                            self._store.add_event(
+                                self, current_era, event.description, "possible"
+                            )
+                    played = 0
+                    while len(current_era._events) > 0:
+                        self.play_event(current_era, current_era.get_next_event())
+                        played += 1
+                    self.forget_events(current_era, years)
+                    time_step.record(current_era, years, played)
+                    for hook in self._year_hooks:
+                        hook(self, current_era)
+                close_streams(year_logs)
+            print(
+                f"skipped {current_era._conversations_saved} conversations about duplicate events"
+            )
+            with span("summary"):
+                results = self.finish_era(current_era, on_suggestions)
+            if self._store is not None:
+                for faction in current_era.factions.values():
+                    for legend in faction._history._legends:
+                        self._store.add_legend(
+                            self,
+                            current_era,
+                            faction.name,
+                            legend,
+                            faction._history._legend_years.get(legend),
+                        )
+                    self._store.add_summary(
+                        self,
+                        f"faction:{faction.name}",
+                        results[f"history:{faction.name}"],
+                        current_era,
                     )
-                    current_era.factions[character.faction]._history.add_event(event)
-                    for other_character in current_era.factions[
-                        character.faction
-                    ].characters:
-                        if other_character is character:
-                            continue
-                        character.add_to_memories([{"role": "user", "content": event}])
-            for faction in current_era.factions.values():
-                lost_count = (
-                    choice(range(len(faction._history._remembered_history))) // 4 + 1
+                self._store.add_summary(self, "era", current_era._summary, current_era)
+                self._store.add_summary(self, "anthology", self._summary, current_era)
+            if governor is not None:
+                report = governor.finish()
+                print(f"governor report: {report}")
+                save_summary("era_governor", report)
+            close_streams(era_logs)
+
+    def finish_era(
+        self, era: Era, on_suggestions: Callable[[NextEra], None] | None = None
+    ) -> dict[str, Any]:
+        """
+        Run the end-of-era work as a dependency graph instead of one phase after another:
+        each faction's legends -> its history summary -> the era summary -> the anthology summary,
+        while the faction summaries and the next era's suggestion (which only need the factions) run alongside them.
+        on_suggestions is called with the suggestion as soon as it's ready, without waiting for the summaries.
+        """
+        graph = TaskGraph(END_OF_ERA_WORKERS)
+        for faction in era.factions.values():
+            graph.add(f"legends:{faction.name}", faction._history.join_legends)
+            graph.add(
+                f"history:{faction.name}",
+                faction._history.generate_summary,
+                [f"legends:{faction.name}"],
+            )
+            graph.add(f"faction:{faction.name}", faction.generate_summary)
+
+        def summarize_era() -> str:
+            era._summary = era.generate_summary([
+                graph.results[f"history:{name}"] for name in era.factions
+            ])
+            return era._summary
+
+        def summarize_anthology() -> str:
+            self._summary = self.generate_summary()
+            return self._summary
+
+        def suggest() -> NextEra:
+            suggestion = era.suggest_next_era([
+                graph.results[f"faction:{name}"] for name in era.factions
+            ])
+            if on_suggestions is not None:
+                on_suggestions(suggestion)
+            return suggestion
+
+        graph.add("era", summarize_era, [f"history:{name}" for name in era.factions])
+        graph.add("anthology", summarize_anthology, ["era"])
+        graph.add("suggestion", suggest, [f"faction:{name}" for name in era.factions])
+        return graph.run()
+
+    def play_event(self, era: Era, next_event: Event) -> None:
+        """
+        Have the characters involved in an event talk it over, then tell their factions about it.
+        """
+        with span("event", description=next_event.description):
+            characters = era.get_characters(set(next_event.participants))
+
+            def on_turn(message: dict[str, str]) -> None:
+                for hook in self._turn_hooks:
+                    hook(self, era, message)
+
+            conversation = era.have_conversation(
+                characters, next_event.description, on_turn
+            )
+            if self._store is not None:
+                self._store.add_conversation(
+                    self, era, characters, next_event.description, conversation
                 )
-                for _ in range(lost_count):
-                    lost_event = choice(list(faction._history._remembered_history))
-                    faction._history.lose_event(lost_event)
-                    for character in faction.characters.values():
-                        for index, memory in enumerate(character._memories._messages):
-                            if lost_event == memory["content"]:
-                                # TODO: make a lose memory method
-                                del character._memories._messages[index]
-        self._summary = self.generate_summary()
+            for character in characters:
+                debrief = character._last_debrief
+                if debrief is None:
+                    continue
+                era._decay.add(
+                    ("character", character.name), debrief.memory, len(characters)
+                )
+                if self._store is not None:
+                    self._store.add_memory(self, era, character, debrief.memory)
+                    self._store.add_memory(
+                        self, era, character, debrief.feelings, "feeling"
+                    )
+                event = debrief.faction_entry
+                faction = era.factions[character.faction]
+                faction._history.add_event(event)
+                era._decay.add(("faction", character.faction), event, len(characters))
+                if self._store is not None:
+                    self._store.add_event(self, era, event, "actual", character.faction)
+                # NOTE: the rest of the faction hears the entry as it was told, without summarizing it again
+                for other_character in faction.characters.values():
+                    if other_character is character:
+                        continue
+                    other_character.add_memory(event)
+                    era._decay.add(("character", other_character.name), event)
+
+    @traced("forget")
+    def forget_events(self, era: Era, years: int = 1) -> None:
+        """
+        At the end of each step (of some number of years), every faction loses some of its remembered history (and the memories of it), possibly turning it into legend, and every character loses some of their memories.
+        What's lost is sampled for everything at once from era._decay, so older, less important, and long unreinforced things are the likeliest to go.
+        """
+        decay = era._decay
+        if embeddings_enabled():
+            decay.attach_vectors(embed_texts)
+        decay.advance(years)
+        characters = {
+            character.name: character
+            for faction in era.factions.values()
+            for character in faction.characters.values()
+        }
+        for (kind, name), content in decay.remove(decay.sample_losses(years)):
+            if kind == "character":
+                if name in characters:
+                    characters[name].lose_memory(content)
+                continue
+            faction = era.factions.get(name)
+            if faction is None or content not in faction._history._remembered_history:
+                continue
+            faction._history.lose_event(content, era._year)
+            if self._store is not None:
+                self._store.add_event(self, era, content, "lost", faction.name)
+            for character in faction.characters.values():
+                character.lose_memory(content)
+        decay.drift(years)
+        for faction in era.factions.values():
+            faction._history.submit_legends()
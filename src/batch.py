@@ -0,0 +1,267 @@
+from __future__ import annotations
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+from anthology import Anthology, Era, Governor
+from entities import Character, Faction
+from store import AnthologyStore
+from utils import (
+    TELEMETRY,
+    save_report,
+    set_backend_override,
+    set_rate_limit,
+    use_log_dir,
+)
+
+MAX_CONCURRENT_ANTHOLOGIES: int = 4
+
+
+class CharacterSpec(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    age: str
+    pronouns: str
+    personality: str
+    description: str
+
+
+class FactionSpec(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    description: str
+    characters: list[CharacterSpec] = Field(min_length=1)
+    allies: list[str] = []
+    enemies: list[str] = []
+
+
+class EraSpec(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    duration: int = Field(gt=0)
+    theme: str
+    factions: list[FactionSpec] = Field(min_length=1)
+
+    @model_validator(mode="after")
+    def check_relationships(self) -> EraSpec:
+        names = {faction.name for faction in self.factions}
+        for faction in self.factions:
+            unknown = set(faction.allies + faction.enemies) - names
+            if len(unknown) > 0:
+                raise ValueError(
+                    f"{faction.name} has allies or enemies that aren't in {self.name}: {", ".join(sorted(unknown))}"
+                )
+        return self
+
+
+class Scenario(BaseModel):
+    """
+    Everything needed to build an Anthology without asking for it interactively: its eras, their factions, and their characters. Eras are run in order.
+    Any budget (tokens, USD, or seconds) applies to each era on its own, and is kept by a Governor.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    setting: str
+    anthology_type: str
+    eras: list[EraSpec] = Field(min_length=1)
+    budget_tokens: int | None = Field(default=None, gt=0)
+    budget_cost: float | None = Field(default=None, gt=0)
+    budget_seconds: float | None = Field(default=None, gt=0)
+
+    def governor(self) -> Governor | None:
+        """
+        A new Governor for one era's budget, or None if the scenario doesn't have one.
+        """
+        budget = (self.budget_tokens, self.budget_cost, self.budget_seconds)
+        if all(limit is None for limit in budget):
+            return None
+        return Governor(*budget)
+
+    def build(self) -> Anthology:
+        anthology = Anthology(self.name, self.setting, self.anthology_type)
+        for era_spec in self.eras:
+            era = Era(era_spec.name, era_spec.duration, era_spec.theme)
+            for faction_spec in era_spec.factions:
+                faction = Faction(faction_spec.name, faction_spec.description)
+                faction.add_characters([
+                    Character(
+                        character.name,
+                        character.age,
+                        character.pronouns,
+                        character.personality,
+                        character.description,
+                        faction.name,
+                    )
+                    for character in faction_spec.characters
+                ])
+                era.add_faction(faction)
+            for faction_spec in era_spec.factions:
+                faction = era.factions[faction_spec.name]
+                faction.add_allies([era.factions[name] for name in faction_spec.allies])
+                faction.add_enemies([
+                    era.factions[name] for name in faction_spec.enemies
+                ])
+            anthology.add_eras(era)
+        return anthology
+
+
+def load_scenarios(directory: str | Path) -> list[Scenario]:
+    """
+    Load every *.json scenario file in a directory, raising ValueError naming each file that doesn't validate.
+    """
+    scenarios = []
+    errors = []
+    for path in sorted(Path(directory).glob("*.json")):
+        try:
+            scenarios.append(Scenario.model_validate_json(path.read_text()))
+        except ValidationError as e:
+            errors.append(f"{path}: {e}")
+    if len(errors) > 0:
+        raise ValueError("invalid scenarios:\n" + "\n".join(errors))
+    names = [scenario.name for scenario in scenarios]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if len(duplicates) > 0:
+        raise ValueError(f"scenario names must be unique: {", ".join(duplicates)}")
+    return scenarios
+
+
+def run_scenario(
+    scenario: Scenario,
+    output_dir: Path,
+    store: AnthologyStore | None = None,
+    on_build: Callable[[Anthology], None] | None = None,
+) -> dict[str, Any]:
+    """
+    Build and run every era of a scenario, with all of its logs written under output_dir/<scenario name> (see Anthology.advance_era).
+    on_build is called with the Anthology before it's run, say to add hooks.
+    """
+    start = perf_counter()
+    result: dict[str, Any] = {"name": scenario.name, "years": 0, "error": ""}
+    with use_log_dir(output_dir):
+        try:
+            anthology = scenario.build()
+            if store is not None:
+                anthology.attach_store(store)
+            if on_build is not None:
+                on_build(anthology)
+            for era in scenario.eras:
+                anthology.advance_era(era.name, scenario.governor())
+                result["years"] += era.duration
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            print(f"{scenario.name} failed: {result['error']}")
+    result["seconds"] = perf_counter() - start
+    return result
+
+
+def run_batch(
+    scenarios: list[Scenario],
+    output_dir: str | Path = "./logs/batch",
+    concurrency: int = MAX_CONCURRENT_ANTHOLOGIES,
+    store: AnthologyStore | None = None,
+) -> dict[str, Any]:
+    """
+    Run scenarios concurrently, returning each one's result along with aggregate throughput.
+    Every anthology shares this process's rate limiter and HTTP connection pool.
+    """
+    output_dir = Path(output_dir)
+    TELEMETRY.reset()
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="anthology") as pool:
+        futures = [
+            pool.submit(copy_context().run, run_scenario, scenario, output_dir, store)
+            for scenario in scenarios
+        ]
+        results = [future.result() for future in futures]
+    seconds = perf_counter() - start
+    usage = TELEMETRY.snapshot()
+    completed = [result for result in results if result["error"] == ""]
+    years = sum([result["years"] for result in results])
+    report = {
+        "anthologies": len(completed),
+        "failed": len(results) - len(completed),
+        "years": years,
+        "seconds": seconds,
+        "calls": usage["calls"],
+        "tokens": usage["tokens"],
+        "cost": usage["cost"],
+        "conversations": TELEMETRY.counter("conversations"),
+        "anthologies_per_hour": len(completed) * 3600 / seconds,
+        "years_per_minute": years * 60 / seconds,
+        "calls_per_second": usage["calls"] / seconds,
+        "tokens_per_second": usage["tokens"] / seconds,
+        "results": results,
+    }
+    with use_log_dir(output_dir):
+        save_report("batch", report)
+    return report
+
+
+def format_report(report: dict[str, Any]) -> str:
+    lines = [
+        f"{result['name']}: {result['years']} years in {result['seconds']:.1f}s"
+        + (f" (failed: {result['error']})" if result["error"] else "")
+        for result in report["results"]
+    ]
+    lines.append(
+        f"{report['anthologies']} anthologies ({report['failed']} failed), {report['years']} years, {report['conversations']} conversations in {report['seconds']:.1f}s"
+    )
+    lines.append(
+        f"{report['anthologies_per_hour']:.1f} anthologies/hour, {report['years_per_minute']:.1f} years/minute, {report['calls_per_second']:.2f} calls/s, {report['tokens_per_second']:.0f} tokens/s, ${report['cost']:.4f}"
+    )
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> None:
+    parser = ArgumentParser(description="Run every scenario in a directory.")
+    parser.add_argument("scenarios", help="a directory of scenario *.json files")
+    parser.add_argument(
+        "--output",
+        default="./logs/batch",
+        help="each anthology's logs go in a subdirectory named after it",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=MAX_CONCURRENT_ANTHOLOGIES,
+        help="how many anthologies to run at once",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="requests per second (0 for no limit), shared by every anthology",
+    )
+    parser.add_argument("--store", default="", help="record everything in a store")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="use the dry run backend instead of calling any LLM",
+    )
+    args = parser.parse_args(argv)
+    scenarios = load_scenarios(args.scenarios)
+    if args.rate_limit is not None:
+        set_rate_limit(args.rate_limit)
+    if args.dry_run:
+        set_backend_override("dryrun")
+    store = AnthologyStore(args.store) if args.store else None
+    try:
+        report = run_batch(scenarios, args.output, args.concurrency, store)
+    finally:
+        if store is not None:
+            store.close()
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import json
+import random
+from collections import deque
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, sleep
+from typing import IO, Any
+from utils import TELEMETRY, Post, Recorder, request_key, set_recorder
+
+REPLAY_LATENCIES: tuple[str, ...] = ("recorded", "zero")
+
+
+class CassetteMiss(LookupError):
+    """
+    Raised when a replayed run makes a request that wasn't recorded (or makes it more times than it was recorded), meaning the engine's behavior has drifted.
+    """
+
+
+class Cassette:
+    """
+    Records every LLM call (and how long its response took) to a JSON lines file, along with the seed the random module was given,
+    so the run can be replayed exactly: the same seed makes the same random choices (characters, speakers, lost events), and every request is answered from the file.
+    Replays can wait out each response's recorded latency or answer immediately, so engine overhead can be measured apart from time spent waiting on the API.
+    Identical requests are answered in the order they were recorded. Headers are never written, since they hold the API key.
+    It sits above the coalescing of identical in-flight requests (see utils.SingleFlight), so a call that shared another's response while recording still has an entry of its own.
+    Otherwise a replay, whose calls rarely overlap the way they happened to while recording, would miss on it.
+
+    Attributes:
+        path
+        mode
+        latency
+        seed
+
+    Methods:
+        start()
+        stop()
+        send()
+        report()
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        mode: str = "record",
+        latency: str = "recorded",
+        seed: int | None = None,
+    ) -> None:
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown cassette mode {mode}!")
+        if latency not in REPLAY_LATENCIES:
+            raise ValueError(f"unknown replay latency {latency}!")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.seed: int = seed if seed is not None else random.getrandbits(32)
+        self._responses: dict[str, deque[tuple[dict[str, Any], float, bool]]] = {}
+        self._file: IO[str] | None = None
+        self._previous: Recorder | None = None
+        self._started: bool = False
+        self._lock = Lock()
+        self._requests: int = 0
+        self._api_seconds: float = 0.0
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            self.seed = json.loads(f.readline())["seed"]
+            for line in f:
+                entry = json.loads(line)
+                self._responses.setdefault(entry["key"], deque()).append((
+                    entry["response"],
+                    entry["latency"],
+                    entry.get("leader", True),
+                ))
+
+    def start(self) -> None:
+        """
+        Seed the random module and put the cassette in front of every LLM call (or, when replaying, in place of them).
+        """
+        random.seed(self.seed)
+        if self.mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "w")
+            self._file.write(json.dumps({"seed": self.seed}) + "\n")
+            self._file.flush()
+        self._previous = set_recorder(self.send)
+        self._started = True
+
+    def stop(self) -> None:
+        if self._started:
+            set_recorder(self._previous)
+            self._previous = None
+            self._started = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def send(
+        self, url: str, body: dict[str, Any], post: Post
+    ) -> tuple[dict[str, Any], bool]:
+        """
+        A recorder for utils.set_recorder: make the call with post and write it down, or answer it from the cassette. Returns the response and whether the call was its request's leader.
+        """
+        key = request_key(url, body)
+        if self.mode == "record":
+            if self._file is None:
+                raise RuntimeError("the cassette hasn't been started!")
+            start = perf_counter()
+            response, leader = post()
+            latency = perf_counter() - start
+            with self._lock:
+                self._requests += 1
+                # NOTE: a coalesced call spent its time waiting on its leader's request, which is already counted
+                if leader:
+                    self._api_seconds += latency
+                self._file.write(
+                    json.dumps({
+                        "key": key,
+                        "url": url,
+                        "body": body,
+                        "response": response,
+                        "latency": latency,
+                        "leader": leader,
+                    })
+                    + "\n"
+                )
+                self._file.flush()
+            return response, leader
+        with self._lock:
+            responses = self._responses.get(key)
+            if responses is None or len(responses) == 0:
+                TELEMETRY.count("cassette_misses")
+                raise CassetteMiss(
+                    f"{self.path} has no recorded response for this request to {url}: {json.dumps(body)[:200]}"
+                )
+            response, latency, leader = responses.popleft()
+            self._requests += 1
+            if leader:
+                self._api_seconds += latency
+        TELEMETRY.count("cassette_hits")
+        if self.latency == "recorded":
+            sleep(latency)
+        return response, leader
+
+    def report(self) -> dict[str, Any]:
+        """
+        How many requests were recorded or replayed, the API time they took when recorded, and (when replaying) how many recorded responses were never asked for.
+        """
+        with self._lock:
+            report: dict[str, Any] = {
+                "mode": self.mode,
+                "seed": self.seed,
+                "requests": self._requests,
+                "api_seconds": self._api_seconds,
+            }
+            if self.mode == "replay":
+                report["unused"] = sum([
+                    len(responses) for responses in self._responses.values()
+                ])
+        return report
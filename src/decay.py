@@ -0,0 +1,175 @@
+from __future__ import annotations
+from random import getrandbits
+from typing import Callable
+import numpy as np
+
+# NOTE: the yearly chance of losing an item is 1 - exp(-DECAY_RATE * (age + 1) / strength), where strength grows with importance and with how recently the item was reinforced.
+DECAY_RATE: float = 0.25
+RECENCY_BONUS: float = 1.0
+# NOTE: how far (relative to the vector's length) an unimportant, year-old memory's embedding wanders each year.
+DRIFT_SCALE: float = 0.05
+# NOTE: a new item reinforces remembered items of the same owner whose embeddings are at least this similar.
+REINFORCE_SIMILARITY: float = 0.85
+
+
+class MemoryDecay:
+    """
+    Importance, age, and recency scores for everything that can be forgotten (faction history and character memories), kept as NumPy arrays so a year of forgetting is a handful of array operations.
+    Every item belongs to an owner, like ("faction", "North Islanders") or ("character", "Moreen D'Archon"), and losses for every owner are sampled together in one pass.
+    If vectors are attached, they drift a little every year (less for important items), so recall by embedding gets fuzzier with age without any LLM calls.
+    add() only queues an item; the arrays take in everything queued in one concatenation the next time any other method runs, so adding every event of a year costs one copy rather than one per item.
+
+    Attributes:
+        texts
+        owners
+        importance
+        age
+        recency
+        vectors
+
+    Methods:
+        add()
+        reinforce()
+        advance()
+        sample_losses()
+        remove()
+        attach_vectors()
+        drift()
+    """
+
+    def __init__(self) -> None:
+        self.texts: list[str] = []
+        self.owners: list[tuple[str, str]] = []
+        self.importance = np.zeros(0, dtype=np.float32)
+        self.age = np.zeros(0, dtype=np.float32)
+        self.recency = np.zeros(0, dtype=np.float32)
+        self.vectors: np.ndarray | None = None
+        self._pending: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add(self, owner: tuple[str, str], text: str, importance: float = 1.0) -> None:
+        self.texts.append(text)
+        self.owners.append(owner)
+        self._pending.append(importance)
+
+    def _flush(self) -> None:
+        if len(self._pending) == 0:
+            return
+        count = len(self._pending)
+        self.importance = np.concatenate([
+            self.importance,
+            np.asarray(self._pending, dtype=np.float32),
+        ])
+        self.age = np.concatenate([self.age, np.zeros(count, dtype=np.float32)])
+        self.recency = np.concatenate([
+            self.recency,
+            np.zeros(count, dtype=np.float32),
+        ])
+        if self.vectors is not None:
+            self.vectors = np.concatenate([
+                self.vectors,
+                np.full((count, self.vectors.shape[1]), np.nan, dtype=np.float32),
+            ])
+        self._pending.clear()
+
+    def reinforce(self, mask: np.ndarray, amount: float = 0.5) -> None:
+        """
+        Bring the selected items back to mind: they become recent again and a little more important.
+        """
+        self._flush()
+        self.recency[mask] = 0
+        self.importance[mask] += amount
+
+    def advance(self, years: int = 1) -> None:
+        self._flush()
+        self.age += years
+        self.recency += years
+
+    def loss_probabilities(self, years: int = 1) -> np.ndarray:
+        self._flush()
+        strength = self.importance * (1 + RECENCY_BONUS * np.exp(-self.recency))
+        return 1 - np.exp(
+            -DECAY_RATE * (self.age + 1) * years / np.maximum(strength, 1e-6)
+        )
+
+    def sample_losses(self, years: int = 1) -> np.ndarray:
+        """
+        Decide what's forgotten over the last few years, returning a boolean mask over every item.
+        """
+        # NOTE: seeded from the random module so a seeded run (like a planner sample) forgets the same things
+        rng = np.random.default_rng(getrandbits(64))
+        return rng.random(len(self.texts)) < self.loss_probabilities(years)
+
+    def remove(self, mask: np.ndarray) -> list[tuple[tuple[str, str], str]]:
+        """
+        Drop the selected items, returning their owners and texts.
+        """
+        self._flush()
+        removed = [
+            (owner, text)
+            for owner, text, lost in zip(self.owners, self.texts, mask)
+            if lost
+        ]
+        keep = ~mask
+        self.texts = [text for text, kept in zip(self.texts, keep) if kept]
+        self.owners = [owner for owner, kept in zip(self.owners, keep) if kept]
+        self.importance = self.importance[keep]
+        self.age = self.age[keep]
+        self.recency = self.recency[keep]
+        if self.vectors is not None:
+            self.vectors = self.vectors[keep]
+        return removed
+
+    def attach_vectors(self, embed: Callable[[list[str]], list[list[float]]]) -> None:
+        """
+        Fill in vectors for every item that doesn't have one yet, in one batch. New items reinforce any similar item their owner still remembers.
+        """
+        self._flush()
+        if len(self.texts) == 0:
+            return
+        if self.vectors is None:
+            missing = np.ones(len(self.texts), dtype=bool)
+        else:
+            missing = np.isnan(self.vectors).any(axis=1)
+        if not missing.any():
+            return
+        indices = np.flatnonzero(missing)
+        embedded = np.asarray(
+            embed([self.texts[index] for index in indices]), dtype=np.float32
+        )
+        embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-6)
+        if self.vectors is None:
+            self.vectors = np.full(
+                (len(self.texts), embedded.shape[1]), np.nan, dtype=np.float32
+            )
+        known = ~missing
+        self.vectors[indices] = embedded
+        if not known.any():
+            return
+        owners = np.array([hash(owner) for owner in self.owners])
+        similarity = embedded @ self.vectors[known].T
+        same_owner = owners[indices][:, None] == owners[known][None, :]
+        reinforced = ((similarity >= REINFORCE_SIMILARITY) & same_owner).any(axis=0)
+        mask = np.zeros(len(self.texts), dtype=bool)
+        mask[np.flatnonzero(known)[reinforced]] = True
+        self.reinforce(mask)
+
+    def drift(self, years: int = 1) -> None:
+        """
+        Nudge every vector in a random direction, further for older and less important items, keeping them unit length.
+        """
+        self._flush()
+        if self.vectors is None or len(self.texts) == 0:
+            return
+        rng = np.random.default_rng(getrandbits(64))
+        scale = (
+            DRIFT_SCALE * np.sqrt(self.age * years) / np.maximum(self.importance, 1e-6)
+        )
+        noise = rng.standard_normal(self.vectors.shape).astype(np.float32)
+        noise /= np.sqrt(self.vectors.shape[1])
+        self.vectors += scale[:, None] * noise
+        self.vectors /= np.maximum(
+            np.linalg.norm(self.vectors, axis=1, keepdims=True), 1e-6
+        )
@@ -1,15 +1,70 @@
 from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 from random import random, choice
+from pydantic import BaseModel, ConfigDict
+from tracing import annotate, traced
 from utils import (
     LLM,
     LLMFactory,
+    TELEMETRY,
+    content_hash,
     generate_summary,
     generate_single_response,
+    generate_structured_response,
+    queue_embedding,
     save_json,
     save_summary,
 )
 
 LEGEND_CHANCE: float = 0.5
+# NOTE: caps how many legend requests can be in flight at once, across every faction.
+MAX_CONCURRENT_LEGENDS: int = 4
+
+# NOTE: conversations only resend the latest turns (plus a running summary) to keep prompts from growing every turn.
+CONVERSATION_WINDOW_TURNS: int = 8
+CONVERSATION_WINDOW_TOKENS: int = 3000
+# NOTE: how many conversation memories each relationship keeps, newest last.
+RELATIONSHIP_MEMORIES: int = 3
+
+_legend_pool: ThreadPoolExecutor | None = None
+
+
+class Debrief(BaseModel):
+    """
+    What a character takes away from a conversation: a memory of it, their feelings about it, and the entry they'd add to their faction's history.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    memory: str
+    feelings: str
+    faction_entry: str
+
+
+def get_legend_pool() -> ThreadPoolExecutor:
+    """
+    Lazily create the shared worker pool that legends are generated on.
+    """
+    global _legend_pool
+    if _legend_pool is None:
+        _legend_pool = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_LEGENDS, thread_name_prefix="legend"
+        )
+    return _legend_pool
+
+
+def set_max_concurrent_legends(count: int) -> None:
+    """
+    Change the cap on concurrent legend requests. Waits for any legends already running on the old pool.
+    """
+    global _legend_pool, MAX_CONCURRENT_LEGENDS
+    if count < 1:
+        raise ValueError("need at least one legend worker!")
+    MAX_CONCURRENT_LEGENDS = count
+    if _legend_pool is not None:
+        _legend_pool.shutdown(wait=True)
+        _legend_pool = None
 
 
 class History:
@@ -24,30 +79,76 @@ class History:
         self._legends: set[str] = set()
         self._summary: str = ""
         self._faction: str = faction
+        self._legend_queue: list[tuple[str, int | None]] = []
+        self._pending_legends: list[tuple[int | None, Future[str]]] = []
+        # NOTE: the year each legend's event was lost in, when lose_event was told.
+        self._legend_years: dict[str, int] = {}
 
     def add_event(self, event: str) -> None:
         self._actual_history.add(event)
-        save_json(f"{self._faction}_actual_history", self._actual_history)
+        save_json(f"faction_{self._faction}_actual_history", self._actual_history)
         self._remembered_history.add(event)
-        save_json(f"{self._faction}_remembered_history", self._remembered_history)
+        save_json(
+            f"faction_{self._faction}_remembered_history", self._remembered_history
+        )
+        queue_embedding(event)
 
-    def lose_event(self, event: str) -> None:
+    def lose_event(self, event: str, year: int | None = None) -> None:
         self._remembered_history.remove(event)
-        save_json(f"{self._faction}_remembered_history", self._remembered_history)
+        save_json(
+            f"faction_{self._faction}_remembered_history", self._remembered_history
+        )
         self._lost_history.add(event)
-        save_json(f"{self._faction}_lost_history", self._lost_history)
+        save_json(f"faction_{self._faction}_lost_history", self._lost_history)
         if random() >= LEGEND_CHANCE:
-            self.create_legend(event)
+            self._legend_queue.append((event, year))
 
     def create_legend(self, event: str) -> None:
+        """
+        Synchronously turn an event into a legend and add it to the faction's legends.
+        """
+        self._legends.add(self._generate_legend(event))
+        save_json(f"faction_{self._faction}_legends", self._legends)
+
+    def _generate_legend(self, event: str) -> str:
         legend = generate_single_response(
-            f"Turn the following event into a legend. Mutate aspects of the story to transform it from a real event into some sort of myth or legend. {event}"
+            f"Turn the following event into a legend. Mutate aspects of the story to transform it from a real event into some sort of myth or legend. {event}",
+            "legend",
         )
         print(f"new legend: {legend}")
-        self._legends.add(legend)
-        save_json(f"{self._faction}_legends", self._legends)
+        return legend
+
+    def submit_legends(self) -> list[Future[str]]:
+        """
+        Submit every event queued up by lose_event to the legend pool as one batch, returning the futures for the batch.
+        """
+        pool = get_legend_pool()
+        batch = [
+            (year, pool.submit(copy_context().run, self._generate_legend, event))
+            for event, year in self._legend_queue
+        ]
+        self._legend_queue.clear()
+        self._pending_legends.extend(batch)
+        return [future for _, future in batch]
+
+    def join_legends(self) -> None:
+        """
+        Wait on every outstanding legend and add the results to the faction's legends.
+        """
+        if len(self._legend_queue) > 0:
+            self.submit_legends()
+        if len(self._pending_legends) == 0:
+            return
+        for year, future in self._pending_legends:
+            legend = future.result()
+            self._legends.add(legend)
+            if year is not None:
+                self._legend_years[legend] = year
+        self._pending_legends.clear()
+        save_json(f"faction_{self._faction}_legends", self._legends)
 
     def generate_summary(self) -> str:
+        self.join_legends()
         history = "\n".join(self._remembered_history)
         legends = ""
         if len(self._legends) > 0:
@@ -57,7 +158,7 @@ class History:
         summary = generate_summary(context)
         # del history, legends, context
         print(f"history summary: {summary}")
-        save_summary(f"{self._faction}_history", summary)
+        save_summary(f"faction_{self._faction}_history", summary)
         return summary
 
 
@@ -72,6 +173,7 @@ class Faction:
     _allies
     _enemies
     _history
+    _summary
 
     Methods:
     add_characters()
@@ -81,6 +183,8 @@ class Faction:
     add_enemies()
     remove_enemies()
     get_character()
+    summary_context()
+    fingerprint()
     generate_summary()
     """
 
@@ -88,14 +192,16 @@ class Faction:
         self,
         name: str,
         description: str,
-        characters: dict[str, Character] = {},
+        characters: dict[str, Character] | None = None,
     ) -> None:
         self.name = name
         self.description = description
-        self.characters = characters
+        self.characters = characters if characters is not None else {}
         self._allies: set[Faction] = set()
         self._enemies: set[Faction] = set()
         self._history = History(self.name)
+        # NOTE: the last summary and the fingerprint of what it was generated from, so it's only regenerated when the faction changes.
+        self._summary: tuple[str, str] | None = None
 
     def __str__(self) -> str:
         return f"Name: {self.name}\nDescription: {self.description}"
@@ -163,7 +269,7 @@ class Faction:
             self._enemies.remove(enemies)
         # save_json(f"{self.name}_enemies", self._enemies)
 
-    def generate_summary(self) -> str:
+    def summary_context(self) -> str:
         context = (
             f"Faction Name: {self.name}. Description: {self.description}\nCharacters:"
         )
@@ -173,16 +279,32 @@ class Faction:
         context += "\n" + characters
         # del characters
         if len(self._allies) > 0:
-            allies = "\n".join([ally.name for ally in self._allies])
+            allies = "\n".join(sorted([ally.name for ally in self._allies]))
             context += "\n" + allies
             # del allies
         if len(self._enemies) > 0:
-            enemies = "\n".join([enemy.name for enemy in self._enemies])
+            enemies = "\n".join(sorted([enemy.name for enemy in self._enemies]))
             context += "\n" + enemies
             # del enemies
+        return context
+
+    def fingerprint(self) -> str:
+        """
+        A hash of everything the faction's summary is generated from, which changes whenever the faction is edited.
+        """
+        return content_hash(self.summary_context())
+
+    def generate_summary(self) -> str:
+        context = self.summary_context()
+        fingerprint = content_hash(context)
+        if self._summary is not None and self._summary[0] == fingerprint:
+            TELEMETRY.count("faction_summary_hits")
+            return self._summary[1]
+        TELEMETRY.count("faction_summary_misses")
         response = generate_summary(context)
         print(f"faction summary: {response}")
-        save_summary(f"{self.name}_summary", response)
+        save_summary(f"faction_{self.name}_summary", response)
+        self._summary = (fingerprint, response)
         return response
 
 
@@ -205,9 +327,11 @@ class Character:
         feel()
         speak()
         listen()
-        add_to_memories()
-        add_to_feelings()
+        add_memory()
+        debrief()
         remember_conversation()
+        lose_memory()
+        relationships()
     """
 
     def __init__(
@@ -227,8 +351,18 @@ class Character:
         self.faction: str = faction
         self._conversations: dict[frozenset[Character], list[LLM]] = {}
         # TODO: get these set up for embeddings. see remember/feel for more docs
-        self._memories: LLM = LLMFactory.get_llm()
-        self._feelings: LLM = LLMFactory.get_llm()
+        self._memories: LLM = LLMFactory.get_llm("memory-retrieval")
+        self._feelings: LLM = LLMFactory.get_llm("memory-retrieval")
+        # NOTE: turned off by the Governor when a run is projected to go over budget.
+        self._feelings_enabled: bool = True
+        # NOTE: remember/feel answers are memoized per query until the memories or feelings change.
+        self._memory_version: int = 0
+        self._feeling_version: int = 0
+        self._remembered: dict[tuple[str, int], str] = {}
+        self._felt: dict[tuple[str, int], str] = {}
+        # NOTE: what this character remembers of each character it has talked to, by name, kept up to date as conversations end.
+        self._relationships: dict[str, list[str]] = {}
+        self._last_debrief: Debrief | None = None
         self.__descriptor: str = f"You are {self.name} ({self.pronouns} pronouns). You are a {self.age} year old {self.description}. Your personality is: {self.personality}. You are part of the following faction: {self.faction}."
 
     def __repr__(self) -> str:
@@ -238,10 +372,14 @@ class Character:
         """
         Create a new conversation between your character and one or more other characters. To track the conversation, the index is returned for future use.
         """
+        conversation = LLMFactory.get_llm("dialogue")
+        conversation.enable_context_window(
+            CONVERSATION_WINDOW_TURNS, CONVERSATION_WINDOW_TOKENS
+        )
         if characters not in self._conversations:
-            self._conversations[characters] = [LLMFactory.get_llm()]
+            self._conversations[characters] = [conversation]
         else:
-            self._conversations[characters].append(LLMFactory.get_llm())
+            self._conversations[characters].append(conversation)
         conversation_index = len(self._conversations[characters])
         match conversation_index:
             case 0:
@@ -264,9 +402,9 @@ class Character:
         ])
         list_of_characters += f", and {last_character}"
         # del last_character, all_characters
-        memory_of_characters = self.remember(
-            f"What do you remember about these people? {list_of_characters}"
-        )
+        if len(self._memories._messages) > 0:
+            TELEMETRY.count("remember_calls_saved")
+        memory_of_characters = self.relationships(characters)
         self._conversations[characters][conversation_index].add_message({
             "role": "system",
             "content": f"{self.__descriptor} You're having your {conversation_count} conversation with {list_of_characters}. You know this about them: {memory_of_characters}. Reply in character based on the conversation history and the context provided by the user. Only respond with dialogue, and keep your responses between one word and one paragraph in length. Make sure every participant has had a chance to speak, but if the conversation has gone on long enough, end your message with the string </SCENE>. Prefix all your messages with your name like so: {self.name}: [TEXT]",
@@ -278,11 +416,12 @@ class Character:
         # )
         return conversation_index
 
+    @traced("character.think")
     def think(self, context: str) -> str:
         """
         taking in the context as a prompt string, create an ephemeral LLM instance to generate a conclusion about the context - including relevant memories and feelings
         """
-        current_thoughts = LLMFactory.get_llm()
+        current_thoughts = LLMFactory.get_llm("dialogue")
         current_thoughts.add_message({
             "role": "system",
             "content": f"{self.__descriptor}. You are about to be given a new piece of information by the user. Think about the information, reflect on your memories and feelings, and come to a conclusion about the information in a way that reflects who you are, describing any justifications, rationale, or emotional response that is appropriate. Respond with a single sentence.",
@@ -304,6 +443,7 @@ class Character:
 
     # TODO: wrap think, feel, and remember in "access_brain" methods
 
+    @traced("character.remember")
     def remember(self, context: str) -> str:
         """
         This function queries the _memories message history and pulls out information that's important, then returns a prompt completion that gets fed into later calls of the model.
@@ -319,7 +459,18 @@ class Character:
         2. execute another LLM call that takes the input, rewords it, and re-embeds it.
         3. i could have a really small long term memory size and constantly summarize and re-embed the information.
         """
-        indexer = LLMFactory.get_llm()
+        # NOTE: a character with no memories yet (like everyone in the first year) would only ever be told to say 'nothing', so there's no need to ask.
+        if len(self._memories._messages) == 0:
+            TELEMETRY.count("remember_hits")
+            annotate(cached=True)
+            return "nothing"
+        key = (context, self._memory_version)
+        if key in self._remembered:
+            TELEMETRY.count("remember_hits")
+            annotate(cached=True)
+            return self._remembered[key]
+        TELEMETRY.count("remember_misses")
+        indexer = LLMFactory.get_llm("memory-retrieval")
         indexer.add_message({
             "role": "system",
             "content": f"{self.__descriptor}. Below is a list of memories that you have. Answer the user's questions based on the memories. If there are no messages between this message and the context, respond with 'nothing'.",
@@ -331,8 +482,10 @@ class Character:
         )
         # del indexer
         print(f"memories: {response["content"]}")
+        self._remembered[key] = response["content"]
         return response["content"]
 
+    @traced("character.feel")
     def feel(self, context: str) -> str:
         """
         This function queries the _feelings message history and pulls out information that's important, then returns a prompt completion that gets fed into later calls of the model.
@@ -346,20 +499,34 @@ class Character:
         - maybe there's some sum-and-averaging of the embedding
         - i could do some weird mutations
         """
-        indexer = LLMFactory.get_llm()
+        if not self._feelings_enabled:
+            return "nothing"
+        if len(self._feelings._messages) == 0:
+            TELEMETRY.count("feel_hits")
+            annotate(cached=True)
+            return "nothing"
+        key = (context, self._feeling_version)
+        if key in self._felt:
+            TELEMETRY.count("feel_hits")
+            annotate(cached=True)
+            return self._felt[key]
+        TELEMETRY.count("feel_misses")
+        indexer = LLMFactory.get_llm("memory-retrieval")
         indexer.add_message({
             "role": "system",
             "content": f"{self.__descriptor}. Below is a list of feelings that you have. Answer the user's questions based on the feelings. If there are no messages between this message and the context, respond with 'nothing'.",
         })
-        for message in self._memories._messages:
+        for message in self._feelings._messages:
             indexer.add_message(message)
         response = indexer.generate_completion(
             f"What feelings are relevant to the context listed below? Do not quote them directly, only summarize and highlight key points. Limit your response to one short paragraph or less. Context: {context}"
         )
         # del indexer
         print(f"feelings: {response["content"]}")
+        self._felt[key] = response["content"]
         return response["content"]
 
+    @traced("character.speak")
     def speak(
         self,
         characters: frozenset[Character],
@@ -400,46 +567,105 @@ class Character:
         for message in messages:
             self._conversations[characters][conversation_index].add_message(message)
 
-    def add_to_memories(self, conversation: list[dict[str, str]]) -> None:
-        summary = LLMFactory.get_llm()
-        summary.add_message({
-            "role": "system",
-            "content": f"{self.__descriptor}. Below is a conversation between two characters, one of whom is you.",
-        })
-        for message in conversation:
-            summary.add_message(message)
-        response = summary.generate_completion(
-            "Summarize the conversation above. Limit your response to one short paragraph, and only include the most essential information."
-        )["content"]
-        print(f"adding to memories: {response}")
-        self._memories.add_message({"role": "user", "content": response})
-        save_json(f"{self.name}_memories", self._memories._messages)
-
-    def add_to_feelings(self, conversation: list[dict[str, str]]) -> None:
-        summary = LLMFactory.get_llm()
-        summary.add_message({
-            "role": "system",
-            "content": f"{self.__descriptor}. Below is a conversation between two characters, one of whom is you.",
-        })
-        for message in conversation:
-            summary.add_message(message)
-        response = summary.generate_completion(
-            "Summarize your feelings about the conversation above. Use abstract associations, connecting specific people or events with specific emotions. Use single words, avoid complete sentences."
-        )["content"]
-        print(f"adding to feelings: {response}")
-        self._feelings.add_message({"role": "user", "content": response})
-        save_json(f"{self.name}_feelings", self._feelings._messages)
+    def relationships(self, characters: frozenset[Character]) -> str:
+        """
+        What this character knows about the given characters, looked up from its relationships instead of asking the LLM to search its memories.
+        """
+        known = [
+            f"{character.name}: {" ".join(self._relationships[character.name])}"
+            for character in characters
+            if character is not self and self._relationships.get(character.name)
+        ]
+        return "\n".join(known) if len(known) > 0 else "nothing"
+
+    def _add_to_relationships(
+        self, characters: frozenset[Character], memory: str
+    ) -> None:
+        for character in characters:
+            if character is self:
+                continue
+            memories = self._relationships.setdefault(character.name, [])
+            memories.append(memory)
+            del memories[:-RELATIONSHIP_MEMORIES]
+        save_json(f"character_{self.name}_relationships", self._relationships)
+
+    def add_memory(self, memory: str) -> None:
+        print(f"adding to memories: {memory}")
+        self._memories.add_message({"role": "user", "content": memory})
+        queue_embedding(memory)
+        self._forget_recalls()
+        save_json(f"character_{self.name}_memories", self._memories._messages)
+
+    def _add_feeling(self, feeling: str) -> None:
+        print(f"adding to feelings: {feeling}")
+        self._feelings.add_message({"role": "user", "content": feeling})
+        queue_embedding(feeling)
+        self._feeling_version += 1
+        self._felt.clear()
+        save_json(f"character_{self.name}_feelings", self._feelings._messages)
+
+    @traced("character.debrief")
+    def debrief(self, conversation: list[dict[str, str]]) -> Debrief:
+        """
+        Summarize a conversation into a memory, feelings, and an entry for the faction's history in a single structured call, instead of a separate call for each (and a think call for the faction entry).
+        The memory and feelings are kept, and the whole debrief is returned.
+        """
+        debrief = generate_structured_response(
+            "\n".join([
+                "Reflect on the conversation above.",
+                "memory: summarize the conversation. Limit it to one short paragraph, and only include the most essential information.",
+                "feelings: summarize your feelings about the conversation. Use abstract associations, connecting specific people or events with specific emotions. Use single words, avoid complete sentences.",
+                "faction_entry: you are telling your faction about the conversation. Write a third person summary that your faction would add to their history, in a way that reflects who you are. Keep it between one and three sentences.",
+            ]),
+            Debrief,
+            "summary",
+            [
+                {
+                    "role": "system",
+                    "content": f"{self.__descriptor}. Below is a conversation between two characters, one of whom is you.",
+                },
+                *conversation,
+            ],
+        )
+        self.add_memory(debrief.memory)
+        self._add_feeling(debrief.feelings)
+        return debrief
+
+    def lose_memory(self, content: str) -> bool:
+        """
+        Remove every memory matching the given content, returning whether anything was lost.
+        """
+        remaining = [
+            memory
+            for memory in self._memories._messages
+            if memory["content"] != content
+        ]
+        if len(remaining) == len(self._memories._messages):
+            return False
+        self._memories._messages = remaining
+        save_json(f"character_{self.name}_memories", self._memories._messages)
+        self._relationships = {
+            name: [memory for memory in memories if memory != content]
+            for name, memories in self._relationships.items()
+        }
+        save_json(f"character_{self.name}_relationships", self._relationships)
+        self._forget_recalls()
+        return True
+
+    def _forget_recalls(self) -> None:
+        self._memory_version += 1
+        self._remembered.clear()
 
     def end_conversation(
         self, characters: frozenset[Character], conversation_index: int
     ) -> None:
         convo = self._conversations[characters][conversation_index]._messages
         save_json(
-            f"{self.name}_conversation_{"_".join([character.name for character in characters])}",
+            f"character_{self.name}_conversation_{"_".join(sorted([character.name for character in characters]))}_{conversation_index}",
             convo,
         )
-        self.add_to_memories(convo)
-        self.add_to_feelings(convo)
+        self._last_debrief = self.debrief(convo)
+        self._add_to_relationships(characters, self._last_debrief.memory)
 
     def get_description(self) -> str:
         return self.__descriptor
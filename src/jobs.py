@@ -0,0 +1,433 @@
+from __future__ import annotations
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event as ProcessEvent
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Any, Callable
+from uuid import uuid4
+from utils import (
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_PER_SECOND,
+    content_hash,
+    openai_headers,
+    request_key,
+    send_json,
+    set_rate_limit,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS rate_limit (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+# NOTE: a claimed job that isn't finished within the lease is handed to another worker, so a worker that dies (or a machine that drops off the shared filesystem) doesn't strand its jobs.
+LEASE_SECONDS: float = 300
+MAX_ATTEMPTS: int = 3
+# NOTE: how often a waiting process checks whether anyone else wrote to the file. the check only reads a counter, so results and new jobs are picked up within this long of being written.
+POLL_SECONDS: float = 0.01
+# NOTE: waiters look again at least this often anyway, since leases running out and rate limit tokens refilling don't write anything.
+MAX_POLL_SECONDS: float = 1.0
+# NOTE: workers only send requests (everything else still happens in the process running the anthology), so more of them than the rate limit can keep busy doesn't make a run any faster, however many cores there are.
+WORKERS: int = 8
+
+
+@dataclass
+class Job:
+    key: str
+    url: str
+    body: dict[str, Any]
+    attempts: int
+
+
+class JobQueue:
+    """
+    A durable queue of LLM requests in a single SQLite file, consumed by worker processes (see run_worker) on this machine or any machine that can see the file.
+    Jobs are keyed by the request's canonical hash within a scope, so submitting the same request twice is one job, and results are written back only by the worker that holds the job,
+    so a worker finishing late after its lease expired can't clobber (or duplicate) a result.
+    Each queue gets a fresh scope unless it's given one, so a run never gets answers (sampled completions included) that were made for an earlier run; sharing a scope between runs makes the queue a cache.
+    Claims take tokens from a single token bucket kept in the file, so the rate limit holds across every worker on every machine, however many there are.
+
+    Attributes:
+        path
+        shared
+        scope
+
+    Methods:
+        submit()
+        claim()
+        complete()
+        fail()
+        result()
+        post()
+        requeue()
+        counts()
+        changes()
+        wait_for_change()
+    """
+
+    def __init__(
+        self, path: str | Path, shared: bool = False, scope: str | None = None
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.shared = shared
+        self.scope = scope if scope is not None else uuid4().hex
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._lock = Lock()
+        # NOTE: WAL is much faster, but it needs shared memory, which network filesystems don't have. shared queues fall back to a rollback journal.
+        mode = "DELETE" if shared else "WAL"
+        self._connection.execute(f"PRAGMA journal_mode = {mode}")
+        self._connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def submit(self, url: str, body: dict[str, Any]) -> str:
+        """
+        Add a request to the queue (if it isn't there already), returning its key. Submitting a request whose job failed puts it back in the queue.
+        """
+        key = content_hash(f"{self.scope}:{request_key(url, body)}")
+        with self._lock:
+            self._connection.execute(
+                """
+INSERT INTO jobs (key, url, body, created_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET status = 'pending', attempts = 0, worker = NULL, created_at = excluded.created_at
+WHERE status = 'failed'
+""",
+                (key, url, json.dumps(body), time()),
+            )
+        return key
+
+    def claim(
+        self,
+        worker: str,
+        lease: float = LEASE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+        rate: float = RATE_LIMIT_PER_SECOND,
+        burst: int = RATE_LIMIT_BURST,
+    ) -> Job | None:
+        """
+        Take the oldest pending job (or one whose lease has run out), or None if there's nothing to do or the queue's bucket is out of tokens.
+        Tokens refill at rate per second (shared by every worker) up to burst; a rate of 0 turns limiting off.
+        A job whose lease ran out after max_attempts tries is marked failed instead, so a job that keeps killing (or hanging) its worker can't go around forever.
+        """
+        now = time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    """
+UPDATE jobs SET status = 'failed', error = 'lease expired on the last attempt', finished_at = ?
+WHERE status = 'running' AND claimed_at < ? AND attempts >= ?
+""",
+                    (now, now - lease, max_attempts),
+                )
+                row = self._connection.execute(
+                    """
+SELECT key, url, body, attempts FROM jobs
+WHERE status = 'pending' OR (status = 'running' AND claimed_at < ?)
+ORDER BY created_at LIMIT 1
+""",
+                    (now - lease,),
+                ).fetchone()
+                if row is not None and not self._take_token(now, rate, burst):
+                    row = None
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE key = ?",
+                        (worker, now, row["key"]),
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return Job(row["key"], row["url"], json.loads(row["body"]), row["attempts"] + 1)
+
+    def _take_token(self, now: float, rate: float, burst: int) -> bool:
+        if rate <= 0:
+            return True
+        bucket = self._connection.execute(
+            "SELECT tokens, updated_at FROM rate_limit WHERE id = 0"
+        ).fetchone()
+        tokens: float = burst
+        if bucket is not None:
+            # NOTE: machines' clocks can disagree, so time never runs backwards for the bucket
+            elapsed = max(0.0, now - bucket["updated_at"])
+            tokens = min(burst, bucket["tokens"] + elapsed * rate)
+        if tokens < 1:
+            return False
+        self._connection.execute(
+            """
+INSERT INTO rate_limit (id, tokens, updated_at) VALUES (0, ?, ?)
+ON CONFLICT (id) DO UPDATE SET tokens = excluded.tokens, updated_at = max(updated_at, excluded.updated_at)
+""",
+            (tokens - 1, now),
+        )
+        return True
+
+    def complete(self, key: str, worker: str, result: dict[str, Any]) -> bool:
+        """
+        Write a job's result back, returning False if the job had already been taken over by another worker.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE key = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result), time(), key, worker),
+            )
+        return cursor.rowcount == 1
+
+    def fail(
+        self, key: str, worker: str, error: str, max_attempts: int = MAX_ATTEMPTS
+    ) -> bool:
+        """
+        Put a job back in the queue to be retried, or mark it failed once it's been tried max_attempts times.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                """
+UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, finished_at = ?
+WHERE key = ? AND worker = ? AND status = 'running'
+""",
+                (max_attempts, error, time(), key, worker),
+            )
+        return cursor.rowcount == 1
+
+    def result(self, key: str, timeout: float | None = None) -> dict[str, Any]:
+        """
+        Wait for a job to finish and return its result, raising RuntimeError if it failed and TimeoutError if it takes longer than timeout seconds.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            # NOTE: read before looking at the job, so a result written in between still counts as a change
+            version = self.changes()
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT status, result, error FROM jobs WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None:
+                raise KeyError(f"no job {key}!")
+            if row["status"] == "done":
+                return json.loads(row["result"])
+            if row["status"] == "failed":
+                raise RuntimeError(f"job {key} failed: {row['error']}")
+            wait = MAX_POLL_SECONDS
+            if deadline is not None:
+                if monotonic() > deadline:
+                    raise TimeoutError(f"job {key} is still {row['status']}!")
+                wait = min(wait, deadline - monotonic())
+            self.wait_for_change(version, wait)
+
+    def post(
+        self, url: str, body: dict[str, Any], headers: dict[str, str] | None = None
+    ) -> dict[str, Any]:
+        """
+        A transport for utils.set_transport: queue the request and wait for a worker to send it. Headers aren't stored, since they hold the API key; workers use their own.
+        """
+        return self.result(self.submit(url, body))
+
+    def requeue(self, failed_only: bool = True) -> int:
+        """
+        Reset failed jobs (or every unfinished job) so they're tried again, returning how many were reset.
+        """
+        statuses = "('failed')" if failed_only else "('failed', 'running')"
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL WHERE status IN {statuses}"
+            )
+        return cursor.rowcount
+
+    def changes(self) -> int:
+        """
+        A counter that goes up whenever another connection (in this process or any other) writes to the queue.
+        """
+        with self._lock:
+            return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def wait_for_change(self, version: int, timeout: float) -> bool:
+        """
+        Wait until the queue has changed since changes() returned version, or timeout seconds have passed, returning whether it changed.
+        """
+        deadline = monotonic() + timeout
+        while self.changes() == version:
+            if monotonic() >= deadline:
+                return False
+            sleep(POLL_SECONDS)
+        return True
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, count(*) AS count FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+def execute(job: Job) -> dict[str, Any]:
+    """
+    Send a job's request from this process. An error from the API raises (see utils.send_json), so the job is retried instead of storing the error as its result.
+    """
+    return send_json(job.url, job.body, openai_headers())
+
+
+def run_worker(
+    path: str | Path,
+    name: str = "",
+    shared: bool = False,
+    stop: ProcessEvent | None = None,
+    idle_timeout: float | None = None,
+    function: Callable[[Job], dict[str, Any]] = execute,
+    rate_limit: float = RATE_LIMIT_PER_SECOND,
+) -> int:
+    """
+    Take jobs off the queue and run them until stop is set (or nothing has come in for idle_timeout seconds), returning how many were completed.
+    rate_limit is requests per second across every worker on the queue, not for this worker alone, so adding workers never adds to it.
+    """
+    # NOTE: the queue's bucket is what limits the workers together; this worker's own limiter is only there so it can't go over the shared rate on its own
+    previous = set_rate_limit(rate_limit)
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(path, shared)
+    completed = 0
+    idle_since = monotonic()
+    # NOTE: a worker that finds the bucket empty looks again about when the next token is due
+    wait = (
+        MAX_POLL_SECONDS if rate_limit <= 0 else min(MAX_POLL_SECONDS, 1 / rate_limit)
+    )
+    try:
+        while stop is None or not stop.is_set():
+            version = queue.changes()
+            job = queue.claim(name, rate=rate_limit)
+            if job is None:
+                if idle_timeout is not None and monotonic() - idle_since > idle_timeout:
+                    break
+                queue.wait_for_change(version, wait)
+                continue
+            try:
+                result = function(job)
+            except Exception as error:
+                queue.fail(job.key, name, f"{type(error).__name__}: {error}")
+            else:
+                if queue.complete(job.key, name, result):
+                    completed += 1
+            idle_since = monotonic()
+    finally:
+        queue.close()
+        set_rate_limit(previous)
+    return completed
+
+
+def start_workers(
+    path: str | Path,
+    count: int,
+    shared: bool = False,
+    rate_limit: float = RATE_LIMIT_PER_SECOND,
+) -> tuple[list[BaseProcess], ProcessEvent]:
+    """
+    Start a pool of worker processes on this machine, returning them along with the event that stops them.
+    """
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    workers: list[BaseProcess] = [
+        context.Process(
+            target=run_worker,
+            args=(path, f"{socket.gethostname()}:worker-{index}", shared, stop),
+            kwargs={"rate_limit": rate_limit},
+            name=f"worker-{index}",
+            daemon=True,
+        )
+        for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers, stop
+
+
+def stop_workers(
+    workers: list[BaseProcess], stop: ProcessEvent, timeout: float = 10
+) -> None:
+    stop.set()
+    for worker in workers:
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.terminate()
+
+
+def main(argv: list[str]) -> None:
+    parser = ArgumentParser(description="Work on or inspect a job queue.")
+    parser.add_argument("command", choices=["work", "status", "requeue"])
+    parser.add_argument("queue", help="path to the queue, like logs/jobs.db")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="how many worker processes to run (work only)",
+    )
+    parser.add_argument(
+        "--shared",
+        action="store_true",
+        help="the queue is on a network filesystem shared with other machines",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=RATE_LIMIT_PER_SECOND,
+        help="requests per second across every worker on the queue, on this machine or any other (work only)",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="also requeue running jobs, not just failed ones (requeue only)",
+    )
+    args = parser.parse_args(argv)
+    match args.command:
+        case "work":
+            workers, stop = start_workers(
+                args.queue, args.workers, args.shared, args.rate_limit
+            )
+            print(f"started {len(workers)} workers on {args.queue}")
+            try:
+                for worker in workers:
+                    worker.join()
+            except KeyboardInterrupt:
+                stop_workers(workers, stop)
+        case "status":
+            queue = JobQueue(args.queue, args.shared)
+            print(json.dumps(queue.counts()))
+            queue.close()
+        case "requeue":
+            queue = JobQueue(args.queue, args.shared)
+            print(f"requeued {queue.requeue(not args.all)} jobs")
+            queue.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
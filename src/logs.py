@@ -0,0 +1,252 @@
+from __future__ import annotations
+import atexit
+import gzip
+import io
+import json
+import re
+import sys
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import IO, Any, Iterator
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS: tuple[str, ...] = ("zstd", "gzip", "none")
+SUFFIXES: dict[str, str] = {"zstd": ".jsonl.zst", "gzip": ".jsonl.gz", "none": ".jsonl"}
+# NOTE: zstd is only used when the zstandard package is installed.
+COMPRESSION: str = "zstd" if zstandard is not None else "gzip"
+# NOTE: a stream moves on to a new part once its current part takes up this many bytes on disk.
+ROTATE_BYTES: int = 16 * 1024 * 1024
+
+
+def set_compression(compression: str) -> str:
+    """
+    Change how new log parts are compressed, returning the previous setting so it can be restored.
+    """
+    global COMPRESSION
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}!")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package!")
+    previous = COMPRESSION
+    COMPRESSION = compression
+    return previous
+
+
+def set_rotate_bytes(size: int) -> int:
+    global ROTATE_BYTES
+    previous = ROTATE_BYTES
+    ROTATE_BYTES = size
+    return previous
+
+
+def path_part(name: str) -> str:
+    """
+    Make a name (of an anthology, era, and so on) safe to use as a directory name.
+    """
+    return re.sub(r"[^\w\-. ]", "_", name).strip(" .") or "_"
+
+
+class LogStream:
+    """
+    An append-only, compressed stream of JSON records for one log directory, split into parts (log-00000.jsonl.gz, log-00001.jsonl.gz, ...) that rotate by size.
+    Every save is a record, so nothing is ever overwritten. Lists that only grew since they were last saved are written as just the new items,
+    and sets as what was added and removed, so saving a long memory after every conversation doesn't write the whole thing again.
+    Each part starts over with full values, so it can be read without the parts before it. Records are flushed as they're written, so a crash loses nothing already saved.
+
+    Attributes:
+        directory
+        compression
+        rotate_bytes
+
+    Methods:
+        write()
+        close()
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        compression: str | None = None,
+        rotate_bytes: int | None = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.compression = compression or COMPRESSION
+        self.rotate_bytes = rotate_bytes or ROTATE_BYTES
+        self._raw: IO[bytes] | None = None
+        self._file: Any = None
+        self._last: dict[str, Any] = {}
+        self._lock = Lock()
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        part = len(list(self.directory.glob("log-*.jsonl*")))
+        path = self.directory / f"log-{part:05}{SUFFIXES[self.compression]}"
+        self._raw = open(path, "xb")
+        match self.compression:
+            case "zstd":
+                self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+            case "gzip":
+                self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+            case _:
+                self._file = self._raw
+        self._last.clear()
+
+    def _record(self, name: str, kind: str, contents: Any) -> dict[str, Any]:
+        record: dict[str, Any] = {"name": name, "kind": kind, "time": time()}
+        last = self._last.get(name)
+        if isinstance(contents, (set, frozenset)):
+            if isinstance(last, frozenset):
+                record["add"] = sorted(contents - last, key=str)
+                record["remove"] = sorted(last - contents, key=str)
+            else:
+                record["value"] = sorted(contents, key=str)
+            self._last[name] = frozenset(contents)
+        elif isinstance(contents, list):
+            if (
+                isinstance(last, list)
+                and len(last) <= len(contents)
+                and contents[: len(last)] == last
+            ):
+                record["append"] = contents[len(last) :]
+            else:
+                record["value"] = contents
+            self._last[name] = list(contents)
+        else:
+            record["value"] = contents
+            self._last.pop(name, None)
+        return record
+
+    def write(self, name: str, kind: str, contents: Any) -> None:
+        with self._lock:
+            if self._file is None:
+                self._open()
+            line = json.dumps(self._record(name, kind, contents)) + "\n"
+            self._file.write(line.encode())
+            self._file.flush()
+            if self._raw is not None and self._raw.tell() >= self.rotate_bytes:
+                self._close()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        if self._raw is not None and not self._raw.closed:
+            self._raw.close()
+        self._file = None
+        self._raw = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+_streams: dict[Path, LogStream] = {}
+_streams_lock = Lock()
+
+
+def write_record(directory: str | Path, name: str, kind: str, contents: Any) -> None:
+    """
+    Add a record to the stream for directory, opening it if it isn't open yet.
+    """
+    key = Path(directory).resolve()
+    with _streams_lock:
+        stream = _streams.get(key)
+        if stream is None:
+            stream = _streams[key] = LogStream(key)
+    stream.write(name, kind, contents)
+
+
+def close_streams(directory: str | Path | None = None) -> None:
+    """
+    Close the stream for directory (or every open stream), finishing its current part. Writing to it again starts a new part.
+    """
+    with _streams_lock:
+        if directory is None:
+            streams = list(_streams.values())
+            _streams.clear()
+        else:
+            stream = _streams.pop(Path(directory).resolve(), None)
+            streams = [stream] if stream is not None else []
+    for stream in streams:
+        stream.close()
+
+
+atexit.register(close_streams)
+
+
+# NOTE: what reading a part raises when it was cut off partway through.
+TRUNCATED: tuple[type[Exception], ...] = (EOFError, OSError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+def _read_part(path: Path) -> Iterator[str]:
+    raw = open(path, "rb")
+    if path.name.endswith(SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise ValueError(f"reading {path} needs the zstandard package!")
+        stream: Any = zstandard.ZstdDecompressor().stream_reader(raw)
+    elif path.name.endswith(SUFFIXES["gzip"]):
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    else:
+        stream = raw
+    with raw, io.TextIOWrapper(stream) as lines:
+        try:
+            for line in lines:
+                if line.endswith("\n"):
+                    yield line
+        except TRUNCATED:
+            # NOTE: a part that was still open when the process died ends early, but everything flushed before that is there
+            return
+
+
+def read_records(directory: str | Path) -> Iterator[dict[str, Any]]:
+    """
+    Yield every record written to directory, in order.
+    """
+    for path in sorted(Path(directory).glob("log-*.jsonl*")):
+        for line in _read_part(path):
+            yield json.loads(line)
+
+
+def load_logs(directory: str | Path) -> dict[str, Any]:
+    """
+    Replay the records in directory into the latest value saved under each name.
+    """
+    values: dict[str, Any] = {}
+    for record in read_records(directory):
+        name = record["name"]
+        if "value" in record:
+            values[name] = record["value"]
+        elif "append" in record:
+            values[name] = values.get(name, []) + record["append"]
+        else:
+            remove = set(map(json.dumps, record["remove"]))
+            values[name] = [
+                item for item in values.get(name, []) if json.dumps(item) not in remove
+            ] + record["add"]
+    return values
+
+
+def main(argv: list[str]) -> None:
+    """
+    List what was saved in a log directory, or print the latest value of one name, e.g.
+    python logs.py logs/Tides/First/year_3 era_events
+    """
+    if len(argv) == 0:
+        print("usage: python logs.py DIRECTORY [NAME]")
+        return
+    values = load_logs(argv[0])
+    if len(argv) == 1:
+        print("\n".join(sorted(values)))
+        return
+    value = values[argv[1]]
+    print(value if isinstance(value, str) else json.dumps(value, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
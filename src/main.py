@@ -1,6 +1,38 @@
+from argparse import ArgumentParser
+from concurrent.futures import Future, wait
+from copy import deepcopy
+from os import getenv
+from time import perf_counter
+from typing import Any
 from dotenv import load_dotenv
-from anthology import Anthology, Era
+from anthology import (
+    TIME_STEPS,
+    Anthology,
+    Era,
+    FixedStep,
+    Governor,
+    NextEra,
+    TimeStep,
+)
+from cassette import REPLAY_LATENCIES, Cassette
 from entities import Faction, Character
+from jobs import WORKERS, JobQueue, start_workers, stop_workers
+from logs import COMPRESSIONS, set_compression
+from planner import format_plan, plan_era
+from profiling import Profiler
+from store import AnthologyStore
+from tracing import TRACER
+from utils import (
+    TELEMETRY,
+    Calibration,
+    EmbeddingService,
+    EmbeddingStore,
+    Prewarmer,
+    load_model_routes,
+    save_report,
+    set_embedding_service,
+    set_transport,
+)
 
 
 def generate_setting() -> str:
@@ -71,7 +103,166 @@ def generate_characters(faction: str) -> Character:
     )
 
 
-def main(interactive: bool = True) -> None:
+def build_island() -> tuple[Anthology, Era]:
+    """
+    The built-in scenario used when running non-interactively.
+    """
+    anthology = Anthology("The Island", "Fantasy", "Island Nation")
+    era = Era("First", 1, "Betrayal")
+    north = Faction(
+        "North Islanders", "A stocky tribal group that live in the high mountains."
+    )
+    jarric = Character(
+        "Jarric Cloakstorm",
+        "45",
+        "He/Him",
+        "A cold and calculating leader with a fierce loyalty to his tribe and a caring demeanor underneath.",
+        "Tall, with long brown hair and blue eyes. He has multiple scars across his face.",
+        north.name,
+    )
+    wyndham = Character(
+        "Wyndham Cloakstorm",
+        "20",
+        "He/Him",
+        "A friendly and naive heir to the throne, untainted by the corruption of the world.",
+        "Tall, with long brown hair and blue eyes.",
+        north.name,
+    )
+    north.add_characters([jarric, wyndham])
+    era.add_faction(north)
+    south = Faction(
+        "South Islanders",
+        "A democratic group that inhabits the tropical coastline.",
+    )
+    moreen = Character(
+        "Moreen D'Archon",
+        "37",
+        "She/Her",
+        "A proud and noble Premier who would do anything to protect her people.",
+        "Short, dark-skinned, with curly brown hair and dark grey eyes.",
+        south.name,
+    )
+    folstik = Character(
+        "Folstik Dorner",
+        "31",
+        "He/Him",
+        "A wise scholar with poor social skills, who wishes to help whenever he can but often acts too cold for his own good.",
+        "Tall, lanky and red-haired with large spectacles and a disheveled-but-not-dirty appearance.",
+        south.name,
+    )
+    south.add_characters([moreen, folstik])
+    era.add_faction(south)
+    return anthology, era
+
+
+def present_suggestion(suggestion: NextEra) -> None:
+    print(
+        f"suggested next era: {suggestion.name}, {suggestion.duration} years of {suggestion.theme}"
+    )
+    for faction in suggestion.factions:
+        print(f"- {faction.name}: {faction.description}")
+        for character in suggestion.characters:
+            if character.faction == faction.name:
+                print(
+                    f"  - {character.name} ({character.age}, {character.pronouns}): {character.personality}. {character.description}"
+                )
+
+
+def build_suggested_era(suggestion: NextEra) -> Era:
+    era = Era(suggestion.name, suggestion.duration, suggestion.theme)
+    for suggested in suggestion.factions:
+        faction = Faction(suggested.name, suggested.description)
+        faction.add_characters([
+            Character(
+                character.name,
+                character.age,
+                character.pronouns,
+                character.personality,
+                character.description,
+                faction.name,
+            )
+            for character in suggestion.characters
+            if character.faction == faction.name
+        ])
+        era.add_faction(faction)
+    return era
+
+
+def first_step(era: Era, time_step: TimeStep | None) -> int:
+    return 1 if time_step is None else time_step.next_step(era, era.duration)
+
+
+def prewarm_summary(prewarmer: Prewarmer, era: Era, faction: Faction) -> Future[Any]:
+    return prewarmer.submit(
+        f"summary:{era.name}:{faction.name}",
+        faction.fingerprint(),
+        faction.generate_summary,
+    )
+
+
+def prewarm_era(prewarmer: Prewarmer, era: Era, time_step: TimeStep | None) -> None:
+    """
+    Start an era's faction summaries and its first step's events in the background, so the first year can start as soon as the user is done.
+    Anything the user changes afterwards changes the fingerprints, so the stale work is cancelled (or ignored) and started again.
+    """
+    summaries = [
+        prewarm_summary(prewarmer, era, faction) for faction in era.factions.values()
+    ]
+    years = first_step(era, time_step)
+
+    def events() -> None:
+        # NOTE: the summaries were submitted first, so they're already running by the time this waits on them
+        wait(summaries)
+        era.prewarm_events(years)
+
+    prewarmer.submit(f"events:{era.name}", era.events_fingerprint(years), events)
+
+
+def await_prewarm(prewarmer: Prewarmer, era: Era, time_step: TimeStep | None) -> None:
+    prewarmer.get(
+        f"events:{era.name}", era.events_fingerprint(first_step(era, time_step))
+    )
+
+
+def main(
+    interactive: bool = True,
+    plan_samples: int = 0,
+    calibration_files: list[str] | None = None,
+    profiler: Profiler | None = None,
+    store_path: str = "",
+    time_step: TimeStep | None = None,
+    governor: Governor | None = None,
+) -> None:
+    # NOTE: faction summaries and the first year's events are generated in the background while the user is still typing.
+    prewarmer = Prewarmer()
+    store = AnthologyStore(store_path) if store_path else None
+    try:
+        run(
+            prewarmer,
+            interactive,
+            plan_samples,
+            calibration_files,
+            profiler,
+            store,
+            time_step,
+            governor,
+        )
+    finally:
+        prewarmer.close()
+        if store is not None:
+            store.close()
+
+
+def run(
+    prewarmer: Prewarmer,
+    interactive: bool,
+    plan_samples: int,
+    calibration_files: list[str] | None,
+    profiler: Profiler | None,
+    store: AnthologyStore | None,
+    time_step: TimeStep | None,
+    governor: Governor | None,
+) -> None:
     if interactive:
         anthology = generate_anthology()
         print(
@@ -99,58 +290,238 @@ def main(interactive: bool = True) -> None:
                     in ["", "N", "n"]
                     else True
                 )
-            print(faction.generate_summary())
+            prewarm_summary(prewarmer, era, faction)
+        prewarm_era(prewarmer, era, time_step)
+        for faction in era.factions.values():
+            print(prewarm_summary(prewarmer, era, faction).result())
     else:
-        anthology = Anthology("The Island", "Fantasy", "Island Nation")
-        era = Era("First", 1, "Betrayal")
-        north = Faction(
-            "North Islanders", "A stocky tribal group that live in the high mountains."
-        )
-        jarric = Character(
-            "Jarric Cloakstorm",
-            "45",
-            "He/Him",
-            "A cold and calculating leader with a fierce loyalty to his tribe and a caring demeanor underneath.",
-            "Tall, with long brown hair and blue eyes. He has multiple scars across his face.",
-            north.name,
-        )
-        wyndham = Character(
-            "Wyndham Cloakstorm",
-            "20",
-            "He/Him",
-            "A friendly and naive heir to the throne, untainted by the corruption of the world.",
-            "Tall, with long brown hair and blue eyes.",
-            north.name,
-        )
-        north.add_characters([jarric, wyndham])
-        era.add_faction(north)
-        south = Faction(
-            "South Islanders",
-            "A democratic group that inhabits the tropical coastline.",
-        )
-        moreen = Character(
-            "Moreen D'Archon",
-            "37",
-            "She/Her",
-            "A proud and noble Premier who would do anything to protect her people.",
-            "Short, dark-skinned, with curly brown hair and dark grey eyes.",
-            south.name,
-        )
-        folstik = Character(
-            "Folstik Dorner",
-            "31",
-            "He/Him",
-            "A wise scholar with poor social skills, who wishes to help whenever he can but often acts too cold for his own good.",
-            "Tall, lanky and red-haired with large spectacles and a disheveled-but-not-dirty appearance.",
-            south.name,
-        )
-        south.add_characters([moreen, folstik])
-        era.add_faction(south)
+        anthology, era = build_island()
     anthology.add_eras(era)
-    anthology.advance_era(era.name)
+    if plan_samples > 0:
+        # NOTE: planning tallies its samples in the process telemetry and puts the real tally back afterwards, so nothing real can be recording meanwhile
+        prewarmer.wait()
+        calibration = Calibration.from_files(calibration_files or [])
+        plan = plan_era(anthology, era.name, plan_samples, calibration, time_step)
+        print(f"plan for {era.name} over {plan_samples} samples:")
+        print(format_plan(plan))
+        # NOTE: a non-interactive run can't be asked, so it stops at the plan
+        if not interactive:
+            return
+        if input("run this era? Y/N (default: N)\n> ") in ["", "N", "n"]:
+            return
+    if profiler is not None:
+        anthology.add_year_hook(profiler.on_year)
+    if store is not None:
+        anthology.attach_store(store)
+    suggested: dict[str, Era] = {}
+
+    def on_suggestions(suggestion: NextEra) -> None:
+        present_suggestion(suggestion)
+        if interactive:
+            # NOTE: the suggested era is built and prewarmed while this era is still being summarized, and dropped if the user passes on it
+            suggested[suggestion.name] = build_suggested_era(suggestion)
+            prewarm_era(prewarmer, suggested[suggestion.name], time_step)
+
+    await_prewarm(prewarmer, era, time_step)
+    # NOTE: every era gets a fresh copy of the governor, so each one has the whole budget
+    anthology.advance_era(
+        era.name, deepcopy(governor), on_suggestions, deepcopy(time_step)
+    )
     print(anthology._summary)
+    while (
+        interactive
+        and era._suggestion is not None
+        and input("start the suggested era? Y/N (default: N)\n> ") not in ["", "N", "n"]
+    ):
+        era = suggested.get(era._suggestion.name) or build_suggested_era(
+            era._suggestion
+        )
+        anthology.add_eras(era)
+        await_prewarm(prewarmer, era, time_step)
+        anthology.advance_era(
+            era.name, deepcopy(governor), on_suggestions, deepcopy(time_step)
+        )
+        print(anthology._summary)
+    print(f"llm usage by role:\n{TELEMETRY.report()}")
+    save_report(f"{anthology.name}_telemetry", TELEMETRY.export())
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate an anthology.")
+    parser.add_argument(
+        "--demo",
+        action="store_true",
+        help="use the built-in scenario instead of entering one",
+    )
+    parser.add_argument(
+        "--plan",
+        type=int,
+        default=0,
+        metavar="SAMPLES",
+        help="dry run the era this many times and report the expected calls, tokens, cost, and wall time before running it (with --demo, just report and stop)",
+    )
+    parser.add_argument(
+        "--calibration",
+        nargs="*",
+        default=[],
+        metavar="TELEMETRY_JSON",
+        help="telemetry saved by earlier runs, used to calibrate --plan",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="record nested timing spans and write them to PATH as a Chrome trace (open with Perfetto or chrome://tracing)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile CPU time with cProfile and write cumulative-time tables to logs/profile",
+    )
+    parser.add_argument(
+        "--trace-malloc",
+        action="store_true",
+        help="snapshot memory with tracemalloc at every year boundary and write the top allocation sites and structure growth to logs/profile",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="PATH",
+        default="",
+        help="record everything generated in a SQLite database at PATH, searchable with `python store.py PATH conversations QUERY`",
+    )
+    parser.add_argument(
+        "--queue",
+        metavar="PATH",
+        default="",
+        help="send LLM requests through a durable job queue at PATH, worked by local processes and/or `python jobs.py work PATH` on other machines",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="how many local worker processes to start for --queue (0 to rely on other machines). they only send requests, so more of them than the rate limit keeps busy won't speed a run up",
+    )
+    parser.add_argument(
+        "--embeddings",
+        metavar="DIR",
+        default="",
+        help="embed memories, feelings, and history events in micro-batches, storing the vectors in DIR so they're never embedded twice",
+    )
+    parser.add_argument(
+        "--time-step",
+        choices=list(TIME_STEPS),
+        help="cover several years per step instead of one, with fewer but more significant events per year (compare them with `python planner.py SCENARIO`)",
+    )
+    parser.add_argument(
+        "--step-years",
+        type=int,
+        default=5,
+        help="how many years each step covers with --time-step fixed",
+    )
+    parser.add_argument(
+        "--budget-tokens",
+        type=int,
+        help="keep each era within this many tokens, scaling the simulation back as it's projected to go over",
+    )
+    parser.add_argument(
+        "--budget-cost",
+        type=float,
+        metavar="USD",
+        help="keep each era within this estimated spend",
+    )
+    parser.add_argument(
+        "--budget-seconds",
+        type=float,
+        help="keep each era within this much wall-clock time",
+    )
+    cassette_options = parser.add_mutually_exclusive_group()
+    cassette_options.add_argument(
+        "--record",
+        metavar="PATH",
+        default="",
+        help="record every request and response (and the random seed) to a cassette at PATH",
+    )
+    cassette_options.add_argument(
+        "--replay",
+        metavar="PATH",
+        default="",
+        help="answer every request from the cassette at PATH instead of the API, failing on any request it doesn't have",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        choices=REPLAY_LATENCIES,
+        default="recorded",
+        help="wait out each response's recorded latency, or answer immediately to measure engine overhead alone",
+    )
+    parser.add_argument(
+        "--log-compression",
+        choices=COMPRESSIONS,
+        help="how to compress the logs (default: zstd if the zstandard package is installed, otherwise gzip)",
+    )
+    args = parser.parse_args()
     load_dotenv()
-    main()
+    routes = getenv("ANTHOLOGY_MODEL_ROUTES")
+    if routes:
+        load_model_routes(routes)
+    if args.log_compression is not None:
+        set_compression(args.log_compression)
+    if args.trace:
+        TRACER.enable()
+    pool = None
+    if args.queue:
+        set_transport(JobQueue(args.queue).post)
+        pool = start_workers(args.queue, args.workers)
+    cassette = None
+    if args.record or args.replay:
+        cassette = Cassette(
+            args.record or args.replay,
+            "record" if args.record else "replay",
+            args.replay_latency,
+        )
+        cassette.start()
+    embeddings = None
+    if args.embeddings:
+        embeddings = EmbeddingService(EmbeddingStore(args.embeddings))
+        set_embedding_service(embeddings)
+    time_step: TimeStep | None = None
+    if args.time_step == "fixed":
+        time_step = FixedStep(args.step_years)
+    elif args.time_step is not None:
+        time_step = TIME_STEPS[args.time_step]()
+    governor = None
+    budget = (args.budget_tokens, args.budget_cost, args.budget_seconds)
+    if any(limit is not None for limit in budget):
+        governor = Governor(*budget)
+    profiler = None
+    if args.profile or args.trace_malloc:
+        profiler = Profiler(cpu=args.profile, memory=args.trace_malloc)
+        profiler.start()
+    start = perf_counter()
+    try:
+        main(
+            not args.demo,
+            args.plan,
+            args.calibration,
+            profiler,
+            args.store,
+            time_step,
+            governor,
+        )
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_report()
+        if args.trace:
+            TRACER.export(args.trace)
+        if embeddings is not None:
+            embeddings.close()
+        if cassette is not None:
+            cassette.stop()
+            report = cassette.report()
+            seconds = perf_counter() - start
+            print(
+                f"cassette: {report['requests']} requests {report['mode']}ed (seed {report['seed']}), {report['api_seconds']:.1f}s of API time recorded, {seconds:.1f}s total"
+            )
+            if args.replay and args.replay_latency == "zero":
+                print(f"engine overhead: {seconds:.2f}s")
+        if pool is not None:
+            stop_workers(*pool)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import io
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from copy import deepcopy
+from random import getstate, seed, setstate
+from statistics import mean, quantiles
+from tempfile import TemporaryDirectory
+from anthology import TIME_STEPS, Anthology, TimeStep
+from batch import Scenario
+from utils import (
+    RATE_LIMITER,
+    TELEMETRY,
+    Calibration,
+    DryRun,
+    set_embedding_service,
+    use_backend_override,
+    use_log_dir,
+)
+
+METRICS: tuple[str, ...] = (
+    "calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "cost",
+    "seconds",
+)
+
+
+def plan_era(
+    anthology: Anthology,
+    era: str,
+    samples: int = 20,
+    calibration: Calibration | None = None,
+    time_step: TimeStep | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Walk through advance_era on copies of the anthology with the dry run backend, once per sample, and return the distribution of each metric across samples.
+    Every sample uses a different random seed, so the spread reflects the random choices made along the way (characters, speakers, lost events).
+    Wall time is the calibrated latency of every call plus the time the rate limiter spaces them out over, so it's an upper bound when calls run concurrently.
+    The dry run backend and the log directory only apply to this thread (and the tasks it starts); the telemetry, the dry run calibration, and the random state are put back afterwards.
+    """
+    previous_calibration = DryRun.calibration
+    DryRun.calibration = calibration if calibration is not None else Calibration()
+    # NOTE: dry run vectors are random, so they must never reach a real embedding store
+    previous_embeddings = set_embedding_service(None)
+    # NOTE: every sample reseeds the random module and tallies its calls from zero, so the caller's random state and telemetry are put back afterwards
+    previous_random = getstate()
+    previous_telemetry = TELEMETRY.save()
+    results: dict[str, list[float]] = {metric: [] for metric in METRICS}
+    try:
+        with (
+            use_backend_override("dryrun"),
+            TemporaryDirectory() as logs,
+            use_log_dir(logs),
+        ):
+            for sample in range(samples):
+                seed(sample)
+                DryRun._rng.seed(sample)
+                TELEMETRY.reset()
+                trial = deepcopy(anthology)
+                with redirect_stdout(io.StringIO()):
+                    trial.advance_era(era, time_step=deepcopy(time_step))
+                snapshot = TELEMETRY.snapshot()
+                if RATE_LIMITER.rate > 0:
+                    snapshot["seconds"] += snapshot["calls"] / RATE_LIMITER.rate
+                for metric in METRICS:
+                    results[metric].append(snapshot[metric])
+    finally:
+        DryRun.calibration = previous_calibration
+        set_embedding_service(previous_embeddings)
+        setstate(previous_random)
+        TELEMETRY.restore(previous_telemetry)
+    return {metric: summarize(values) for metric, values in results.items()}
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    if len(values) == 1:
+        return {
+            "mean": values[0],
+            "min": values[0],
+            "p10": values[0],
+            "p50": values[0],
+            "p90": values[0],
+            "max": values[0],
+        }
+    deciles = quantiles(values, n=10, method="inclusive")
+    return {
+        "mean": mean(values),
+        "min": min(values),
+        "p10": deciles[0],
+        "p50": deciles[4],
+        "p90": deciles[8],
+        "max": max(values),
+    }
+
+
+def format_plan(plan: dict[str, dict[str, float]]) -> str:
+    lines = [f"{'':<18}{'mean':>12}{'p10':>12}{'p50':>12}{'p90':>12}{'max':>12}"]
+    for metric, stats in plan.items():
+        lines.append(
+            f"{metric:<18}"
+            + "".join([
+                f"{stats[key]:>12.2f}" for key in ("mean", "p10", "p50", "p90", "max")
+            ])
+        )
+    return "\n".join(lines)
+
+
+def compare_time_steps(
+    anthology: Anthology,
+    era: str,
+    time_steps: dict[str, TimeStep],
+    samples: int = 5,
+    calibration: Calibration | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Plan the same era once per time step policy, returning each one's mean calls, tokens, cost, and seconds per simulated century.
+    """
+    per_century = 100 / anthology._eras[era].duration
+    return {
+        name: {
+            metric: stats["mean"] * per_century
+            for metric, stats in plan_era(
+                anthology, era, samples, calibration, time_step
+            ).items()
+        }
+        for name, time_step in time_steps.items()
+    }
+
+
+def format_comparison(comparison: dict[str, dict[str, float]]) -> str:
+    lines = [f"{'per century':<18}" + "".join([f"{metric:>18}" for metric in METRICS])]
+    for name, metrics in comparison.items():
+        lines.append(
+            f"{name:<18}" + "".join([f"{metrics[metric]:>18.2f}" for metric in METRICS])
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> None:
+    parser = ArgumentParser(
+        description="Benchmark the time step policies on a scenario's first era with the dry run backend."
+    )
+    parser.add_argument("scenario", help="a scenario *.json file")
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument(
+        "--duration",
+        type=int,
+        default=100,
+        help="how many years to run the era for, overriding the scenario",
+    )
+    parser.add_argument(
+        "--calibration",
+        nargs="*",
+        default=[],
+        metavar="TELEMETRY_JSON",
+        help="telemetry saved by earlier runs",
+    )
+    args = parser.parse_args(argv)
+    with open(args.scenario) as f:
+        anthology = Scenario.model_validate_json(f.read()).build()
+    era = next(iter(anthology._eras.values()))
+    era.duration = args.duration
+    comparison = compare_time_steps(
+        anthology,
+        era.name,
+        {"yearly": TimeStep()}
+        | {name: time_step() for name, time_step in TIME_STEPS.items()},
+        args.samples,
+        Calibration.from_files(args.calibration),
+    )
+    print(format_comparison(comparison))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
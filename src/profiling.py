@@ -0,0 +1,147 @@
+from __future__ import annotations
+import cProfile
+import io
+import json
+import pstats
+import tracemalloc
+from pathlib import Path
+from anthology import Anthology, Era
+
+
+class Profiler:
+    """
+    Wraps a run with cProfile and/or tracemalloc. At every year boundary (see Anthology.add_year_hook) it takes a memory snapshot and counts the structures that grow with simulated years,
+    so it's easy to see whether _conversations, _memories, or the History sets are what's growing.
+
+    Attributes:
+        output_dir
+        top
+        cpu
+        memory
+        _growth
+
+    Methods:
+        start()
+        stop()
+        on_year()
+        write_report()
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path = "./logs/profile",
+        top: int = 25,
+        cpu: bool = True,
+        memory: bool = True,
+    ) -> None:
+        self.output_dir = Path(output_dir)
+        self.top = top
+        self.cpu = cpu
+        self.memory = memory
+        self._profile: cProfile.Profile | None = None
+        self._snapshots: list[tracemalloc.Snapshot] = []
+        self._growth: list[dict[str, int | str]] = []
+        self._allocations: list[str] = []
+
+    def __enter__(self) -> Profiler:
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+        self.write_report()
+
+    def start(self) -> None:
+        if self.memory:
+            tracemalloc.start()
+        if self.cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def on_year(self, anthology: Anthology, era: Era) -> None:
+        """
+        Record how big everything has gotten as of the end of the current year.
+        """
+        growth: dict[str, int | str] = {"era": era.name, "year": anthology._year}
+        growth.update(count_structures(era))
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            growth["traced_bytes"] = current
+            growth["peak_bytes"] = peak
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            if len(self._snapshots) > 0:
+                title = f"year {anthology._year}: top {self.top} allocation sites by growth since last year"
+                stats = [
+                    str(stat)
+                    for stat in snapshot.compare_to(self._snapshots[-1], "lineno")
+                ]
+            else:
+                title = f"year {anthology._year}: top {self.top} allocation sites"
+                stats = [str(stat) for stat in snapshot.statistics("lineno")]
+            self._allocations.append("\n".join([title] + stats[: self.top]))
+            self._snapshots = [snapshot]
+        self._growth.append(growth)
+
+    def write_report(self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self._profile is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            (self.output_dir / "cpu_cumulative.txt").write_text(stream.getvalue())
+            self._profile.dump_stats(self.output_dir / "cpu.prof")
+        if len(self._allocations) > 0:
+            (self.output_dir / "allocations.txt").write_text(
+                "\n\n".join(self._allocations)
+            )
+        if len(self._growth) > 0:
+            (self.output_dir / "growth.json").write_text(json.dumps(self._growth))
+            (self.output_dir / "growth.txt").write_text(format_growth(self._growth))
+        print(f"profile written to {self.output_dir}")
+
+
+def count_structures(era: Era) -> dict[str, int]:
+    """
+    Count the entries in every structure that's expected to grow as more years are simulated.
+    """
+    counts = {
+        "conversations": 0,
+        "conversation_messages": 0,
+        "memories": 0,
+        "feelings": 0,
+        "actual_history": 0,
+        "remembered_history": 0,
+        "lost_history": 0,
+        "legends": 0,
+    }
+    for faction in era.factions.values():
+        counts["actual_history"] += len(faction._history._actual_history)
+        counts["remembered_history"] += len(faction._history._remembered_history)
+        counts["lost_history"] += len(faction._history._lost_history)
+        counts["legends"] += len(faction._history._legends)
+        for character in faction.characters.values():
+            for conversations in character._conversations.values():
+                counts["conversations"] += len(conversations)
+                counts["conversation_messages"] += sum([
+                    len(conversation._messages) for conversation in conversations
+                ])
+            counts["memories"] += len(character._memories._messages)
+            counts["feelings"] += len(character._feelings._messages)
+    return counts
+
+
+def format_growth(growth: list[dict[str, int | str]]) -> str:
+    columns = list(growth[0].keys())
+    lines = ["".join([f"{column:>22}" for column in columns])]
+    for row in growth:
+        lines.append("".join([f"{row.get(column, ''):>22}" for column in columns]))
+    return "\n".join(lines) + "\n"
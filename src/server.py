@@ -0,0 +1,383 @@
+from __future__ import annotations
+import json
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from threading import Condition, Lock
+from time import monotonic, time
+from typing import Any, Iterator
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from anthology import Anthology, Era
+from batch import MAX_CONCURRENT_ANTHOLOGIES, Scenario, run_scenario
+from store import AnthologyStore
+from utils import TELEMETRY, set_backend_override, set_rate_limit
+
+# NOTE: how long an idle event stream waits before sending a comment to keep the connection open.
+HEARTBEAT_SECONDS: float = 15
+# NOTE: a run keeps only its latest events (a stream resuming from further back starts at the oldest one kept), and the service only keeps its latest finished runs.
+MAX_RUN_EVENTS: int = 1000
+MAX_FINISHED_RUNS: int = 100
+
+
+class Run:
+    """
+    One submitted scenario: its status, its result once it's finished, and the last MAX_RUN_EVENTS progress events published while it ran, kept so a stream can start (or resume) from any of them.
+    Events are numbered from the start of the run, so dropping old ones doesn't change the number of any event that's kept.
+
+    Attributes:
+        id
+        scenario
+        status
+        result
+        events
+
+    Methods:
+        publish()
+        finish()
+        stream()
+        describe()
+    """
+
+    def __init__(self, id: str, scenario: Scenario) -> None:
+        self.id = id
+        self.scenario = scenario
+        self.status: str = "queued"
+        self.result: dict[str, Any] | None = None
+        self.events: list[tuple[str, dict[str, Any]]] = []
+        self.submitted_at: float = time()
+        self._dropped: int = 0
+        self._condition = Condition()
+
+    def publish(self, event: str, data: dict[str, Any]) -> None:
+        with self._condition:
+            self._append(event, data)
+            self._condition.notify_all()
+
+    def finish(self, result: dict[str, Any]) -> None:
+        with self._condition:
+            self.result = result
+            self.status = "failed" if result["error"] else "done"
+            self._append(self.status, result)
+            self._condition.notify_all()
+
+    def _append(self, event: str, data: dict[str, Any]) -> None:
+        self.events.append((event, data))
+        if len(self.events) > MAX_RUN_EVENTS:
+            del self.events[0]
+            self._dropped += 1
+
+    def stream(
+        self, start: int = 0, heartbeat: float = HEARTBEAT_SECONDS
+    ) -> Iterator[tuple[int, str, dict[str, Any]] | None]:
+        """
+        Yield (index, event, data) for every event from start on, waiting for new ones until the run finishes. None is yielded whenever heartbeat seconds pass without one.
+        """
+        index = start
+        while True:
+            with self._condition:
+                if index >= self._dropped + len(self.events) and self.result is None:
+                    self._condition.wait(heartbeat)
+                index = max(index, self._dropped)
+                events = self.events[index - self._dropped :]
+                finished = self.result is not None
+                total = self._dropped + len(self.events)
+            if len(events) == 0 and not finished:
+                yield None
+            for event, data in events:
+                yield index, event, data
+                index += 1
+            if finished and index >= total:
+                return
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.scenario.name,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "events": self._dropped + len(self.events),
+            "result": self.result,
+        }
+
+
+class AnthologyService:
+    """
+    Runs submitted scenarios on a bounded pool of threads in one long-lived process, so the HTTP connection pool, rate limiter, embedding and summary caches, and any local models stay warm between anthologies.
+    Every conversation turn and finished year is published on the run, to be streamed to clients. Only the latest MAX_FINISHED_RUNS finished runs are kept, so the service doesn't grow for as long as it's up.
+
+    Attributes:
+        output_dir
+        workers
+        store
+        runs
+
+    Methods:
+        submit()
+        get()
+        list_runs()
+        metrics()
+        close()
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path = "./logs/server",
+        workers: int = MAX_CONCURRENT_ANTHOLOGIES,
+        store: AnthologyStore | None = None,
+    ) -> None:
+        self.output_dir = Path(output_dir)
+        self.workers = workers
+        self.store = store
+        self.runs: dict[str, Run] = {}
+        self._ids = count(1)
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="anthology")
+        self._started_at = monotonic()
+        self._start = TELEMETRY.snapshot()
+        self._finished: dict[str, int] = {"done": 0, "failed": 0}
+        self._years: int = 0
+
+    def submit(self, scenario: Scenario) -> Run:
+        with self._lock:
+            run = Run(str(next(self._ids)), scenario)
+            self.runs[run.id] = run
+        self._pool.submit(copy_context().run, self._run, run)
+        return run
+
+    def get(self, id: str) -> Run | None:
+        with self._lock:
+            return self.runs.get(id)
+
+    def list_runs(self) -> list[Run]:
+        with self._lock:
+            return list(self.runs.values())
+
+    def _run(self, run: Run) -> None:
+        run.status = "running"
+        run.publish("started", {"name": run.scenario.name})
+
+        def on_year(anthology: Anthology, era: Era) -> None:
+            run.publish(
+                "year",
+                {"era": era.name, "year": anthology._year, "duration": era.duration},
+            )
+
+        def on_turn(anthology: Anthology, era: Era, message: dict[str, str]) -> None:
+            run.publish(
+                "turn",
+                {
+                    "era": era.name,
+                    "year": anthology._year,
+                    "content": message["content"],
+                },
+            )
+
+        def on_build(anthology: Anthology) -> None:
+            anthology.add_year_hook(on_year)
+            anthology.add_turn_hook(on_turn)
+
+        run.finish(
+            run_scenario(run.scenario, self.output_dir / run.id, self.store, on_build)
+        )
+        with self._lock:
+            self._finished[run.status] += 1
+            self._years += run.result["years"] if run.result is not None else 0
+            finished = [
+                id for id, other in self.runs.items() if other.result is not None
+            ]
+            for id in finished[: len(finished) - MAX_FINISHED_RUNS]:
+                del self.runs[id]
+
+    def metrics(self) -> dict[str, Any]:
+        """
+        Queue depth, how many anthologies have finished, and throughput (anthologies, years, calls, and tokens) since the service started.
+        """
+        runs = self.list_runs()
+        statuses = {
+            status: len([run for run in runs if run.status == status])
+            for status in ("queued", "running")
+        }
+        with self._lock:
+            statuses.update(self._finished)
+            years = self._years
+        usage = TELEMETRY.snapshot()
+        calls = usage["calls"] - self._start["calls"]
+        tokens = usage["tokens"] - self._start["tokens"]
+        seconds = monotonic() - self._started_at
+        return {
+            "queue_depth": statuses["queued"],
+            "running": statuses["running"],
+            "completed": statuses["done"],
+            "failed": statuses["failed"],
+            "workers": self.workers,
+            "uptime_seconds": seconds,
+            "years": years,
+            "calls": calls,
+            "tokens": tokens,
+            "cost": usage["cost"] - self._start["cost"],
+            "conversations": TELEMETRY.counter("conversations"),
+            "anthologies_per_hour": statuses["done"] * 3600 / seconds,
+            "years_per_minute": years * 60 / seconds,
+            "calls_per_second": calls / seconds,
+            "tokens_per_second": tokens / seconds,
+        }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    POST /anthologies with a scenario (see batch.Scenario) to queue it, GET /anthologies/<id> for its status,
+    GET /anthologies/<id>/events for a server-sent event stream of its progress (resumable with Last-Event-ID), and GET /metrics.
+    """
+
+    service: AnthologyService
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        match parts:
+            case ["metrics"]:
+                self.send_json(200, self.service.metrics())
+            case ["anthologies"]:
+                self.send_json(
+                    200, [run.describe() for run in self.service.list_runs()]
+                )
+            case ["anthologies", id]:
+                run = self.service.get(id)
+                if run is None:
+                    self.send_json(404, {"error": f"no anthology {id}"})
+                    return
+                self.send_json(200, run.describe())
+            case ["anthologies", id, "events"]:
+                run = self.service.get(id)
+                if run is None:
+                    self.send_json(404, {"error": f"no anthology {id}"})
+                    return
+                self.stream_events(run)
+            case _:
+                self.send_json(404, {"error": f"no route for {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path.strip("/") != "anthologies":
+            self.send_json(404, {"error": f"no route for {self.path}"})
+            return
+        length = self.headers.get("Content-Length", "0")
+        if not length.isdecimal():
+            self.send_json(400, {"error": f"bad Content-Length {length!r}"})
+            return
+        body = self.rfile.read(int(length))
+        try:
+            scenario = Scenario.model_validate_json(body)
+        except ValidationError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        run = self.service.submit(scenario)
+        self.send_json(
+            202,
+            {
+                "id": run.id,
+                "status": run.status,
+                "events": f"/anthologies/{run.id}/events",
+            },
+        )
+
+    def send_json(self, status: int, body: Any) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def stream_events(self, run: Run) -> None:
+        last_event = self.headers.get("Last-Event-ID")
+        if last_event is not None and not last_event.isdecimal():
+            self.send_json(400, {"error": f"bad Last-Event-ID {last_event!r}"})
+            return
+        start = int(last_event) + 1 if last_event is not None else 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for item in run.stream(start):
+                if item is None:
+                    self.wfile.write(b": heartbeat\n\n")
+                else:
+                    index, event, data = item
+                    self.wfile.write(
+                        f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                    )
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # NOTE: the client went away; the run carries on without it
+            pass
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(
+    service: AnthologyService, host: str = "127.0.0.1", port: int = 8000
+) -> ThreadingHTTPServer:
+    handler = type("BoundHandler", (Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: list[str]) -> None:
+    parser = ArgumentParser(description="Run anthologies as a local HTTP service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=MAX_CONCURRENT_ANTHOLOGIES,
+        help="how many anthologies to run at once; the rest wait in a queue",
+    )
+    parser.add_argument(
+        "--output",
+        default="./logs/server",
+        help="each anthology's logs go in a subdirectory named after its id",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="requests per second (0 for no limit), shared by every anthology",
+    )
+    parser.add_argument("--store", default="", help="record everything in a store")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="use the dry run backend instead of calling any LLM",
+    )
+    args = parser.parse_args(argv)
+    if args.rate_limit is not None:
+        set_rate_limit(args.rate_limit)
+    if args.dry_run:
+        set_backend_override("dryrun")
+    store = AnthologyStore(args.store) if args.store else None
+    service = AnthologyService(args.output, args.workers, store)
+    server = serve(service, args.host, args.port)
+    print(f"serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main(sys.argv[1:])
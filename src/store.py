@@ -0,0 +1,421 @@
+from __future__ import annotations
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from anthology import Anthology, Era
+    from entities import Character
+
+SCHEMA = """
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS anthologies (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    setting TEXT NOT NULL,
+    anthology_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS eras (
+    id INTEGER PRIMARY KEY,
+    anthology_id INTEGER NOT NULL REFERENCES anthologies(id),
+    name TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    UNIQUE (anthology_id, name)
+);
+CREATE TABLE IF NOT EXISTS characters (
+    id INTEGER PRIMARY KEY,
+    anthology_id INTEGER NOT NULL REFERENCES anthologies(id),
+    name TEXT NOT NULL,
+    faction TEXT NOT NULL,
+    description TEXT NOT NULL,
+    UNIQUE (anthology_id, name)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    era_id INTEGER NOT NULL REFERENCES eras(id),
+    year INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    faction TEXT,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    era_id INTEGER NOT NULL REFERENCES eras(id),
+    year INTEGER NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS participants (
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+    character_id INTEGER NOT NULL REFERENCES characters(id),
+    PRIMARY KEY (conversation_id, character_id)
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+    position INTEGER NOT NULL,
+    character_id INTEGER REFERENCES characters(id),
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS legends (
+    id INTEGER PRIMARY KEY,
+    era_id INTEGER NOT NULL REFERENCES eras(id),
+    year INTEGER NOT NULL,
+    faction TEXT NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (era_id, faction, content)
+);
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    era_id INTEGER NOT NULL REFERENCES eras(id),
+    year INTEGER NOT NULL,
+    character_id INTEGER NOT NULL REFERENCES characters(id),
+    kind TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    id INTEGER PRIMARY KEY,
+    anthology_id INTEGER NOT NULL REFERENCES anthologies(id),
+    era_id INTEGER REFERENCES eras(id),
+    year INTEGER,
+    subject TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_era ON events (era_id, year);
+CREATE INDEX IF NOT EXISTS conversations_era ON conversations (era_id, year);
+CREATE INDEX IF NOT EXISTS participants_character ON participants (character_id);
+CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, position);
+CREATE INDEX IF NOT EXISTS memories_character ON memories (character_id, year);
+"""
+
+# NOTE: every searchable table gets an external-content FTS5 index kept in sync by an insert trigger (rows are never updated or deleted).
+SEARCHABLE: tuple[str, ...] = ("events", "turns", "legends", "memories", "summaries")
+FTS_SCHEMA = "\n".join([
+    f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(content, content='{table}', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO {table}_fts (rowid, content) VALUES (new.id, new.content);
+END;"""
+    for table in SEARCHABLE
+])
+
+
+class AnthologyStore:
+    """
+    A single-file SQLite store for everything an anthology generates (events, conversations and their turns, legends, memories, and summaries),
+    with foreign keys to the era, year, and characters involved and a full-text index over the text.
+
+    Attributes:
+        path
+        _connection
+
+    Methods:
+        add_anthology()
+        add_era()
+        add_characters()
+        add_event()
+        add_conversation()
+        add_legend()
+        add_memory()
+        add_summary()
+        search_conversations()
+        search()
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA + FTS_SCHEMA)
+        self._anthologies: dict[str, int] = {}
+        self._eras: dict[tuple[str, str], int] = {}
+        self._characters: dict[tuple[str, str], int] = {}
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _insert(self, sql: str, parameters: tuple[Any, ...]) -> int:
+        with self._lock, self._connection:
+            cursor = self._connection.execute(sql, parameters)
+            return cursor.lastrowid or 0
+
+    def _id(self, sql: str, parameters: tuple[Any, ...]) -> int:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchone()["id"]
+
+    def add_anthology(self, anthology: Anthology) -> int:
+        if anthology.name not in self._anthologies:
+            self._insert(
+                "INSERT OR IGNORE INTO anthologies (name, setting, anthology_type) VALUES (?, ?, ?)",
+                (anthology.name, anthology.setting, anthology.anthology_type),
+            )
+            self._anthologies[anthology.name] = self._id(
+                "SELECT id FROM anthologies WHERE name = ?", (anthology.name,)
+            )
+        return self._anthologies[anthology.name]
+
+    def add_era(self, anthology: Anthology, era: Era) -> int:
+        """
+        Record an era along with all of its characters, returning the era's id.
+        """
+        key = (anthology.name, era.name)
+        if key not in self._eras:
+            anthology_id = self.add_anthology(anthology)
+            self._insert(
+                "INSERT OR IGNORE INTO eras (anthology_id, name, theme, duration) VALUES (?, ?, ?, ?)",
+                (anthology_id, era.name, era.theme, era.duration),
+            )
+            self._eras[key] = self._id(
+                "SELECT id FROM eras WHERE anthology_id = ? AND name = ?",
+                (anthology_id, era.name),
+            )
+        self.add_characters(anthology, era)
+        return self._eras[key]
+
+    def add_characters(self, anthology: Anthology, era: Era) -> None:
+        anthology_id = self.add_anthology(anthology)
+        for faction in era.factions.values():
+            for character in faction.characters.values():
+                key = (anthology.name, character.name)
+                if key in self._characters:
+                    continue
+                self._insert(
+                    "INSERT OR IGNORE INTO characters (anthology_id, name, faction, description) VALUES (?, ?, ?, ?)",
+                    (
+                        anthology_id,
+                        character.name,
+                        character.faction,
+                        character.get_description(),
+                    ),
+                )
+                self._characters[key] = self._id(
+                    "SELECT id FROM characters WHERE anthology_id = ? AND name = ?",
+                    (anthology_id, character.name),
+                )
+
+    def add_event(
+        self,
+        anthology: Anthology,
+        era: Era,
+        content: str,
+        kind: str = "actual",
+        faction: str | None = None,
+    ) -> int:
+        """
+        Record an event. kind is one of "possible" (generated for the era), "actual" (added to a faction's history), or "lost".
+        """
+        return self._insert(
+            "INSERT INTO events (era_id, year, kind, faction, content) VALUES (?, ?, ?, ?, ?)",
+            (self.add_era(anthology, era), era._year, kind, faction, content),
+        )
+
+    def add_conversation(
+        self,
+        anthology: Anthology,
+        era: Era,
+        characters: set[Character],
+        event: str,
+        conversation: list[dict[str, str]],
+    ) -> int:
+        era_id = self.add_era(anthology, era)
+        with self._lock, self._connection:
+            conversation_id = (
+                self._connection.execute(
+                    "INSERT INTO conversations (era_id, year, event) VALUES (?, ?, ?)",
+                    (era_id, era._year, event),
+                ).lastrowid
+                or 0
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO participants (conversation_id, character_id) VALUES (?, ?)",
+                [
+                    (
+                        conversation_id,
+                        self._characters[(anthology.name, character.name)],
+                    )
+                    for character in characters
+                ],
+            )
+            self._connection.executemany(
+                "INSERT INTO turns (conversation_id, position, character_id, content) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        conversation_id,
+                        position,
+                        self._speaker(anthology, characters, message["content"]),
+                        message["content"],
+                    )
+                    for position, message in enumerate(conversation)
+                ],
+            )
+        return conversation_id
+
+    def _speaker(
+        self, anthology: Anthology, characters: set[Character], content: str
+    ) -> int | None:
+        # NOTE: characters are told to prefix every message with their name
+        for character in characters:
+            if content.startswith(f"{character.name}:"):
+                return self._characters[(anthology.name, character.name)]
+        return None
+
+    def add_legend(
+        self,
+        anthology: Anthology,
+        era: Era,
+        faction: str,
+        content: str,
+        year: int | None = None,
+    ) -> int:
+        """
+        Record a legend under the year its event was lost in (the era's current year if that isn't known).
+        """
+        return self._insert(
+            "INSERT OR IGNORE INTO legends (era_id, year, faction, content) VALUES (?, ?, ?, ?)",
+            (
+                self.add_era(anthology, era),
+                era._year if year is None else year,
+                faction,
+                content,
+            ),
+        )
+
+    def add_memory(
+        self,
+        anthology: Anthology,
+        era: Era,
+        character: Character,
+        content: str,
+        kind: str = "memory",
+    ) -> int:
+        """
+        Record a memory, or a feeling if kind is "feeling".
+        """
+        era_id = self.add_era(anthology, era)
+        return self._insert(
+            "INSERT INTO memories (era_id, year, character_id, kind, content) VALUES (?, ?, ?, ?, ?)",
+            (
+                era_id,
+                era._year,
+                self._characters[(anthology.name, character.name)],
+                kind,
+                content,
+            ),
+        )
+
+    def add_summary(
+        self,
+        anthology: Anthology,
+        subject: str,
+        content: str,
+        era: Era | None = None,
+    ) -> int:
+        """
+        Record a summary. subject says what was summarized, like "faction:North Islanders", "era", or "anthology".
+        """
+        anthology_id = self.add_anthology(anthology)
+        era_id = None if era is None else self.add_era(anthology, era)
+        year = None if era is None else era._year
+        return self._insert(
+            "INSERT INTO summaries (anthology_id, era_id, year, subject, content) VALUES (?, ?, ?, ?, ?)",
+            (anthology_id, era_id, year, subject, content),
+        )
+
+    def search_conversations(
+        self, query: str, character: str = "", limit: int = 50
+    ) -> list[sqlite3.Row]:
+        """
+        Find conversations with at least one turn matching the full-text query, optionally only ones a character (matched by name prefix) took part in.
+        """
+        # NOTE: snippet() can't be used in an aggregate query, so matching turns are materialized first
+        sql = """
+WITH matches AS MATERIALIZED (
+    SELECT turns.conversation_id, snippet(turns_fts, 0, '[', ']', '...', 12) AS snippet
+    FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid
+    WHERE turns_fts MATCH ?
+)
+SELECT conversations.id, eras.name AS era, conversations.year, conversations.event,
+    (
+        SELECT group_concat(characters.name, ', ') FROM participants
+        JOIN characters ON characters.id = participants.character_id
+        WHERE participants.conversation_id = conversations.id
+    ) AS participants,
+    min(matches.snippet) AS snippet
+FROM matches
+JOIN conversations ON conversations.id = matches.conversation_id
+JOIN eras ON eras.id = conversations.era_id
+"""
+        parameters: list[Any] = [query]
+        if character:
+            sql += """WHERE conversations.id IN (
+    SELECT participants.conversation_id FROM participants
+    JOIN characters ON characters.id = participants.character_id
+    WHERE characters.name LIKE ? || '%'
+)
+"""
+            parameters.append(character)
+        sql += "GROUP BY conversations.id ORDER BY conversations.id LIMIT ?"
+        parameters.append(limit)
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def search(
+        self, table: str, query: str, character: str = "", limit: int = 50
+    ) -> list[sqlite3.Row]:
+        """
+        Full-text search over events, legends, memories, or summaries. character only applies to memories.
+        """
+        if table not in SEARCHABLE or table == "turns":
+            raise ValueError(f"can't search {table}!")
+        sql = f"""
+SELECT {table}.*, snippet({table}_fts, 0, '[', ']', '...', 12) AS snippet
+FROM {table}_fts JOIN {table} ON {table}.id = {table}_fts.rowid
+"""
+        parameters: list[Any] = [query]
+        if table == "memories" and character:
+            sql += "JOIN characters ON characters.id = memories.character_id WHERE memories_fts MATCH ? AND characters.name LIKE ? || '%'"
+            parameters.append(character)
+        else:
+            sql += f"WHERE {table}_fts MATCH ?"
+        sql += f" ORDER BY {table}.id LIMIT ?"
+        parameters.append(limit)
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+
+def main(argv: list[str]) -> None:
+    parser = ArgumentParser(description="Search an anthology store.")
+    parser.add_argument("database", help="path to the store, like logs/anthology.db")
+    parser.add_argument(
+        "table",
+        choices=["conversations", "events", "legends", "memories", "summaries"],
+    )
+    parser.add_argument("query", help="an FTS5 query, like 'betrayal OR treason'")
+    parser.add_argument(
+        "--character", default="", help="only include results involving this character"
+    )
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+    store = AnthologyStore(args.database)
+    start = perf_counter()
+    if args.table == "conversations":
+        rows = store.search_conversations(args.query, args.character, args.limit)
+    else:
+        rows = store.search(args.table, args.query, args.character, args.limit)
+    elapsed = (perf_counter() - start) * 1000
+    for row in rows:
+        print(" | ".join([f"{key}={row[key]}" for key in row.keys()]))
+    print(f"{len(rows)} results in {elapsed:.1f}ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,236 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from anthology import (
+    AdaptiveStep,
+    Anthology,
+    Era,
+    ExponentialStep,
+    FixedStep,
+    Event,
+    Governor,
+    NextEra,
+    PossibleEvents,
+)
+from entities import Character, Faction
+
+
+class EraTest(unittest.TestCase):
+    def test_advance_time(self):
+        era = Era("foo", 3, "bar", {})
+        self.assertEqual(era.advance_time(), 1)
+        self.assertEqual(era.advance_time(2), 2)
+        self.assertEqual(era._year, 3)
+        era = Era("foo", 3, "bar", {})
+        self.assertEqual(era.advance_time(5), 3)
+        self.assertEqual(era._year, 3)
+
+    @patch("anthology.save_json")
+    @patch("anthology.save_summary")
+    @patch("entities.save_json")
+    @patch("entities.save_summary")
+    @patch("entities.generate_summary", side_effect=lambda context: f"<{context}>")
+    @patch("anthology.generate_summary", side_effect=lambda context: f"<{context}>")
+    @patch("anthology.generate_structured_response")
+    def test_finish_era(self, suggest, *_):
+        suggest.return_value = NextEra(
+            name="Second", theme="Peace", duration=3, factions=[], characters=[]
+        )
+        anthology = Anthology("foo", "bar", "baz")
+        era = Era("First", 2, "Betrayal")
+        for name in ["Foo", "Bar"]:
+            faction = Faction(name, name.lower())
+            faction.add_characters(
+                Character("John", "20", "He/Him", "Bubbly", "man", faction.name)
+            )
+            faction._history._remembered_history.add(f"{name} was founded")
+            era.add_faction(faction)
+        anthology.add_eras(era)
+        suggestions = []
+        results = anthology.finish_era(era, suggestions.append)
+        self.assertEqual(suggestions, [suggest.return_value])
+        self.assertEqual(era._suggestion, suggest.return_value)
+        self.assertEqual(results["history:Foo"], "<Foo was founded>")
+        self.assertEqual(era._summary, "<<Foo was founded>\n<Bar was founded>>")
+        self.assertEqual(anthology._summary, f"<{era._summary}>")
+        self.assertIn("Foo remembers: Foo was founded", suggest.call_args.args[0])
+
+
+class ClusterTest(unittest.TestCase):
+    def setUp(self):
+        # a chain of six allies, a pair of enemies, and two loners
+        self.era = Era("First", 2, "Betrayal")
+        for name in ["A1", "A2", "A3", "A4", "A5", "A6", "B1", "B2", "C1", "C2"]:
+            faction = Faction(name, name.lower())
+            faction.add_characters(
+                Character(f"{name}-John", "20", "He/Him", "Bubbly", "man", name)
+            )
+            self.era.add_faction(faction)
+        factions = self.era.factions
+        for a, b in zip(["A1", "A2", "A3", "A4", "A5"], ["A2", "A3", "A4", "A5", "A6"]):
+            factions[a].add_allies(factions[b])
+        factions["B2"].add_enemies(factions["B1"])
+
+    def test_faction_clusters(self):
+        clusters = [
+            [faction.name for faction in cluster]
+            for cluster in self.era.faction_clusters()
+        ]
+        self.assertEqual(
+            clusters,
+            [["A1", "A2", "A3", "A4"], ["A5", "A6", "B1", "B2"], ["C1", "C2"]],
+        )
+        # small enough worlds stay in a single prompt
+        self.assertEqual(len(self.era.faction_clusters(max_size=10)), 1)
+
+    @patch("anthology.save_json")
+    @patch("entities.save_summary")
+    @patch(
+        "entities.generate_summary",
+        side_effect=lambda context: context.split(".")[0],
+    )
+    @patch("anthology.generate_structured_response")
+    def test_clustered_events(self, generate, *_):
+        prompts = []
+
+        def respond(prompt, *_):
+            prompts.append(prompt)
+            return PossibleEvents(
+                events=[
+                    Event(description=f"event {len(prompts)} happens", participants=[])
+                ]
+            )
+
+        generate.side_effect = respond
+        with (
+            patch.object(self.era, "deduplicate_events", side_effect=lambda e: e),
+            redirect_stdout(io.StringIO()),
+        ):
+            self.era.generate_possible_events()
+        # one prompt per cluster, then one for events between two of them
+        self.assertEqual(len(prompts), 4)
+        self.assertEqual(len(self.era._events), 4)
+        for prompt in prompts:
+            self.assertLessEqual(prompt.count("Faction Name:"), 8)
+        self.assertIn("These events are already planned", prompts[-1])
+
+
+class PrewarmTest(unittest.TestCase):
+    @patch("anthology.save_json")
+    @patch("entities.save_summary")
+    @patch("entities.generate_summary", side_effect=lambda context: "summary")
+    @patch("anthology.generate_structured_response")
+    def test_prewarm_events(self, generate, summarize, *_):
+        generate.side_effect = lambda *_: PossibleEvents(
+            events=[
+                Event(
+                    description=f"event {generate.call_count} happens",
+                    participants=[],
+                )
+            ]
+        )
+        era = Era("First", 2, "Betrayal")
+        faction = Faction("Foo", "foo")
+        faction.add_characters(
+            Character("John", "20", "He/Him", "Bubbly", "man", faction.name)
+        )
+        era.add_faction(faction)
+        with (
+            patch.object(era, "deduplicate_events", side_effect=lambda e: e),
+            redirect_stdout(io.StringIO()),
+        ):
+            era.prewarm_events()
+            era.generate_possible_events()
+            self.assertEqual(generate.call_count, 1)
+            self.assertEqual(era._events[0].description, "event 1 happens")
+            # an edit after prewarming makes it stale
+            era.prewarm_events()
+            faction.add_characters(
+                Character("Sarah", "21", "She/Her", "Logical", "woman", faction.name)
+            )
+            era.generate_possible_events()
+            self.assertEqual(generate.call_count, 3)
+            self.assertEqual(era._events[-1].description, "event 3 happens")
+        # the faction's summary was only regenerated once it changed
+        self.assertEqual(summarize.call_count, 2)
+
+
+class TimeStepTest(unittest.TestCase):
+    def steps(self, time_step, duration, events=5):
+        era = Era("foo", duration, "bar", {})
+        steps = []
+        while era._year < duration:
+            years = era.advance_time(time_step.next_step(era, duration - era._year))
+            time_step.record(era, years, events)
+            steps.append(years)
+        return steps
+
+    def test_fixed(self):
+        self.assertEqual(self.steps(FixedStep(5), 12), [5, 5, 2])
+
+    def test_exponential(self):
+        self.assertEqual(self.steps(ExponentialStep(max_years=4), 15), [1, 2, 4, 4, 4])
+
+    def test_adaptive(self):
+        self.assertEqual(
+            self.steps(AdaptiveStep(max_years=4), 10, events=2), [1, 2, 4, 3]
+        )
+        self.assertEqual(self.steps(AdaptiveStep(), 3, events=10), [1, 1, 1])
+        time_step = AdaptiveStep()
+        self.steps(time_step, 7, events=0)
+        self.assertEqual(time_step._years, 8)
+        time_step.record(Era("foo", 1, "bar", {}), 8, 10)
+        self.assertEqual(time_step._years, 4)
+
+
+class GovernorTest(unittest.TestCase):
+    @patch(
+        "anthology.set_route",
+        return_value={"backend": "openai", "model": "gpt-4o-mini"},
+    )
+    def test_degrades_when_projected_over_budget(self, set_model):
+        faction = Faction("Foo", "foo")
+        john = Character("John", "20", "He/Him", "Bubbly", "man", "Foo")
+        faction.add_characters(john)
+        era = Era("foo", 10, "bar", {"Foo": faction})
+        governor = Governor(max_tokens=1000, cheap_model="foo-mini")
+        governor.start()
+        with patch.object(governor, "spent", return_value={"tokens": 500}):
+            governor.check(era, 2)
+            self.assertEqual(era.max_events, Governor.EVENTS_PER_YEAR)
+            self.assertIsNone(era.max_turns)
+            for _ in range(5):
+                governor.check(era, 2)
+        self.assertEqual(era.max_turns, Governor.TURNS_PER_CONVERSATION)
+        self.assertFalse(john._feelings_enabled)
+        set_model.assert_called_once_with("summary", "foo-mini")
+        self.assertEqual(len(governor._degradations), 4)
+        governor.finish()
+        set_model.assert_called_with("summary", backend="openai", model="gpt-4o-mini")
+        self.assertTrue(john._feelings_enabled)
+
+    @patch("anthology.set_route")
+    def test_skips_a_cheap_model_summaries_already_use(self, set_model):
+        era = Era("foo", 10, "bar", {})
+        governor = Governor(max_tokens=1000, cheap_model="gpt-4o-mini")
+        governor.start()
+        with patch.object(governor, "spent", return_value={"tokens": 500}):
+            for _ in range(5):
+                governor.check(era, 2)
+        set_model.assert_not_called()
+        self.assertEqual(len(governor._degradations), 3)
+
+    def test_within_budget(self):
+        era = Era("foo", 10, "bar", {})
+        governor = Governor(max_tokens=1000)
+        governor.start()
+        with patch.object(governor, "spent", return_value={"tokens": 50}):
+            governor.check(era, 2)
+        self.assertIsNone(era.max_events)
+        self.assertIn("nothing was degraded", governor.report())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from batch import Scenario, load_scenarios, run_batch
+from logs import load_logs
+from utils import set_backend_override
+
+SCENARIO = {
+    "name": "foo",
+    "setting": "bar",
+    "anthology_type": "baz",
+    "eras": [
+        {
+            "name": "First",
+            "duration": 1,
+            "theme": "Betrayal",
+            "factions": [
+                {
+                    "name": "Foo",
+                    "description": "foo",
+                    "characters": [
+                        {
+                            "name": "John",
+                            "age": "20",
+                            "pronouns": "He/Him",
+                            "personality": "Bubbly",
+                            "description": "man",
+                        },
+                        {
+                            "name": "Sarah",
+                            "age": "21",
+                            "pronouns": "She/Her",
+                            "personality": "Logical",
+                            "description": "woman",
+                        },
+                    ],
+                    "enemies": ["Bar"],
+                },
+                {
+                    "name": "Bar",
+                    "description": "bar",
+                    "characters": [
+                        {
+                            "name": "Ann",
+                            "age": "30",
+                            "pronouns": "She/Her",
+                            "personality": "Quiet",
+                            "description": "woman",
+                        }
+                    ],
+                },
+            ],
+        }
+    ],
+}
+
+
+class BatchTest(unittest.TestCase):
+    def test_build(self):
+        anthology = Scenario.model_validate(SCENARIO).build()
+        era = anthology._eras["First"]
+        self.assertEqual(set(era.factions["Foo"].characters), {"John", "Sarah"})
+        self.assertEqual(era.factions["Foo"]._enemies, {era.factions["Bar"]})
+
+    def test_budget(self):
+        self.assertIsNone(Scenario.model_validate(SCENARIO).governor())
+        scenario = Scenario.model_validate({**SCENARIO, "budget_tokens": 1000})
+        governor = scenario.governor()
+        self.assertEqual((governor.max_tokens, governor.max_seconds), (1000, None))
+        # every era gets a governor of its own
+        self.assertIsNot(scenario.governor(), governor)
+
+    def test_load_scenarios(self):
+        with TemporaryDirectory() as directory:
+            broken = json.loads(json.dumps(SCENARIO))
+            broken["eras"][0]["factions"][0]["allies"] = ["Baz"]
+            (Path(directory) / "broken.json").write_text(json.dumps(broken))
+            with self.assertRaisesRegex(ValueError, "broken.json"):
+                load_scenarios(directory)
+            (Path(directory) / "broken.json").write_text(json.dumps(SCENARIO))
+            self.assertEqual(len(load_scenarios(directory)), 1)
+
+    def test_run_batch(self):
+        scenarios = []
+        for name in ["foo", "bar"]:
+            scenario = Scenario.model_validate(SCENARIO)
+            scenario.name = name
+            scenarios.append(scenario)
+        scenarios[0].budget_seconds = 3600
+        previous = set_backend_override("dryrun")
+        try:
+            with TemporaryDirectory() as directory:
+                with redirect_stdout(io.StringIO()):
+                    report = run_batch(scenarios, directory, concurrency=2)
+                self.assertEqual((report["anthologies"], report["failed"]), (2, 0))
+                self.assertEqual(report["years"], 2)
+                self.assertGreater(report["calls"], 0)
+                # each anthology's logs stay in its own directory, one per era and year
+                for name in ["foo", "bar"]:
+                    era = Path(directory) / name / "First"
+                    self.assertIn("era_summary", load_logs(era))
+                    self.assertIn("era_events", load_logs(era / "year_1"))
+                # only the scenario with a budget is governed
+                self.assertIn("era_governor", load_logs(Path(directory) / "foo/First"))
+                self.assertNotIn(
+                    "era_governor", load_logs(Path(directory) / "bar/First")
+                )
+                self.assertTrue((Path(directory) / "batch.json").exists())
+        finally:
+            set_backend_override(previous)
+
+
+if __name__ == "__main__":
+    unittest.main()
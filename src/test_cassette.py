@@ -0,0 +1,104 @@
+import random
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import sleep
+
+from cassette import Cassette, CassetteMiss
+from utils import TELEMETRY, _post_json, set_transport
+
+
+class CassetteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "run.jsonl"
+        self.sent = []
+
+        def api(url, body, headers):
+            self.sent.append(body)
+            return {"content": f"{body['prompt']} #{len(self.sent)}"}
+
+        self.previous = set_transport(api)
+
+    def tearDown(self):
+        set_transport(self.previous)
+        self.directory.cleanup()
+
+    def run_engine(self):
+        choices = [random.random() for _ in range(3)]
+        responses = [
+            _post_json("url", {"prompt": prompt}, {"Authorization": "secret"})[0]
+            for prompt in ["foo", "bar", "foo"]
+        ]
+        return choices, responses
+
+    def test_record_and_replay(self):
+        recorder = Cassette(self.path, "record")
+        recorder.start()
+        recorded = self.run_engine()
+        recorder.stop()
+        self.assertEqual(len(self.sent), 3)
+        self.assertNotIn("secret", self.path.read_text())
+        player = Cassette(self.path, "replay", "zero")
+        player.start()
+        try:
+            # the same random choices, and the same answers without touching the API
+            self.assertEqual(self.run_engine(), recorded)
+            self.assertEqual(len(self.sent), 3)
+            self.assertEqual(recorded[1][2]["content"], "foo #3")
+            self.assertEqual(player.report()["unused"], 0)
+            with self.assertRaises(CassetteMiss):
+                _post_json("url", {"prompt": "baz"}, {})
+            # a request made more times than it was recorded is a miss too
+            with self.assertRaises(CassetteMiss):
+                _post_json("url", {"prompt": "foo"}, {})
+        finally:
+            player.stop()
+        self.assertEqual(player.report()["requests"], 3)
+
+    def test_coalesced_calls_replay_on_their_own(self):
+        release = Event()
+
+        def slow_api(url, body, headers):
+            self.sent.append(body)
+            release.wait()
+            return {"content": "summary"}
+
+        set_transport(slow_api)
+        recorder = Cassette(self.path, "record")
+        recorder.start()
+        coalesced = TELEMETRY.counter("single_flight_coalesced")
+        results = []
+        threads = [
+            Thread(target=lambda: results.append(_post_json("url", {"prompt": ""}, {})))
+            for _ in range(2)
+        ]
+        try:
+            # the second call arrives while the first is still out, and shares its response
+            threads[0].start()
+            while len(self.sent) == 0:
+                sleep(0.001)
+            threads[1].start()
+            while TELEMETRY.counter("single_flight_coalesced") == coalesced:
+                sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            recorder.stop()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(recorder.report()["requests"], 2)
+        player = Cassette(self.path, "replay", "zero")
+        player.start()
+        try:
+            # replayed one after the other, both calls are still answered, and only one is the leader
+            replayed = [_post_json("url", {"prompt": ""}, {}) for _ in range(2)]
+        finally:
+            player.stop()
+        self.assertCountEqual(replayed, results)
+        self.assertCountEqual([leader for _, leader in replayed], [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
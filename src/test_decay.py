@@ -0,0 +1,72 @@
+import random
+import unittest
+
+import numpy as np
+
+from decay import MemoryDecay
+
+
+class MemoryDecayTest(unittest.TestCase):
+    def setUp(self):
+        self.decay = MemoryDecay()
+        self.decay.add(("faction", "Foo"), "foo", importance=1)
+        self.decay.add(("faction", "Foo"), "bar", importance=10)
+        self.decay.add(("character", "John"), "baz", importance=1)
+
+    def test_importance_and_age(self):
+        probabilities = self.decay.loss_probabilities()
+        self.assertLess(probabilities[1], probabilities[0])
+        self.decay.advance(5)
+        self.assertTrue((self.decay.loss_probabilities() > probabilities).all())
+        self.decay.reinforce(np.array([True, False, False]))
+        self.assertEqual(self.decay.recency[0], 0)
+        self.assertEqual(self.decay.age[0], 5)
+
+    def test_sample_losses_is_seeded(self):
+        self.decay.advance(3)
+        random.seed(0)
+        first = self.decay.sample_losses()
+        random.seed(0)
+        self.assertTrue((self.decay.sample_losses() == first).all())
+
+    def test_remove(self):
+        removed = self.decay.remove(np.array([True, False, True]))
+        self.assertEqual(
+            removed, [(("faction", "Foo"), "foo"), (("character", "John"), "baz")]
+        )
+        self.assertEqual(self.decay.texts, ["bar"])
+        self.assertEqual(list(self.decay.importance), [10])
+
+    def test_vectors(self):
+        vectors = {"foo": [1.0, 0.0], "bar": [0.0, 1.0], "baz": [1.0, 0.0]}
+        self.decay.attach_vectors(lambda texts: [vectors[text] for text in texts])
+        self.assertEqual(self.decay.vectors.shape, (3, 2))
+        # a new item close to one its owner remembers brings it back to mind
+        self.decay.advance(2)
+        self.decay.add(("faction", "Foo"), "qux")
+        self.decay.attach_vectors(lambda texts: [[0.0, 2.0] for text in texts])
+        self.assertEqual(list(self.decay.recency), [2, 0, 2, 0])
+        before = self.decay.vectors.copy()
+        self.decay.drift()
+        norms = np.linalg.norm(self.decay.vectors, axis=1)
+        self.assertTrue(np.allclose(norms, 1))
+        moved = np.linalg.norm(self.decay.vectors - before, axis=1)
+        # old, unimportant items drift the furthest, and brand new ones don't move at all
+        self.assertGreater(moved[0], moved[1])
+        self.assertEqual(moved[3], 0)
+
+    def test_adds_are_batched(self):
+        self.decay.attach_vectors(lambda texts: [[1.0, 0.0] for text in texts])
+        for index in range(3):
+            self.decay.add(("character", "John"), f"new {index}", importance=2)
+        # nothing is copied until the arrays are next used, and then everything queued goes in at once
+        self.assertEqual((len(self.decay), len(self.decay.importance)), (6, 3))
+        self.decay.advance()
+        self.assertEqual(list(self.decay.importance), [1, 10, 1, 2, 2, 2])
+        self.assertEqual(list(self.decay.age), [1, 1, 1, 1, 1, 1])
+        self.assertEqual(self.decay.vectors.shape, (6, 2))
+        self.assertTrue(np.isnan(self.decay.vectors[3:]).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,24 @@
+import json
 import unittest
+from unittest.mock import MagicMock, patch
 
-from entities import Character
+from entities import Character, History
+from utils import TELEMETRY
+
+
+def fake_llms(get_llm, completions):
+    """
+    Make every LLM that get_llm hands out keep its messages and answer with completions.
+    """
+
+    def fake_llm(role):
+        llm = MagicMock()
+        llm._messages = []
+        llm.add_message.side_effect = llm._messages.append
+        llm.generate_completion = completions
+        return llm
+
+    get_llm.side_effect = fake_llm
 
 
 class CharacterTest(unittest.TestCase):
@@ -144,5 +162,105 @@ class CharacterTest(unittest.TestCase):
         )
 
 
+class CharacterMemoTest(unittest.TestCase):
+    @patch("entities.save_json")
+    @patch("entities.LLMFactory.get_llm")
+    def test_remember_is_memoized_per_memory_version(self, get_llm, _save):
+        completions = MagicMock(return_value={"role": "user", "content": "a memory"})
+        fake_llms(get_llm, completions)
+        char = Character(
+            "John",
+            "20",
+            "He/Him",
+            "Bubbly and Outgoing",
+            "man with brown hair and brown eyes",
+            "Foo",
+        )
+        # nothing to remember or feel yet, so there's nothing to ask
+        self.assertEqual(char.remember("Sarah"), "nothing")
+        self.assertEqual(char.feel("Sarah"), "nothing")
+        self.assertEqual(completions.call_count, 0)
+        char._memories._messages.append({"role": "user", "content": "Sarah: hello"})
+        char._feelings._messages.append({"role": "user", "content": "Sarah: hello"})
+        self.assertEqual(char.remember("Sarah"), "a memory")
+        self.assertEqual(char.remember("Sarah"), "a memory")
+        self.assertEqual(completions.call_count, 1)
+        char.feel("Sarah")
+        char.feel("Sarah")
+        self.assertEqual(completions.call_count, 2)
+        char.add_memory("a memory")
+        char.remember("Sarah")
+        char.feel("Sarah")
+        self.assertEqual(completions.call_count, 3)
+        self.assertTrue(char.lose_memory("a memory"))
+        self.assertFalse(char.lose_memory("a memory"))
+        char.remember("Sarah")
+        self.assertEqual(completions.call_count, 4)
+
+
+class RelationshipTest(unittest.TestCase):
+    @patch("entities.save_json")
+    @patch("entities.LLMFactory.get_llm")
+    def test_relationships_replace_remember(self, get_llm, _save):
+        completions = MagicMock(
+            side_effect=[
+                {
+                    "role": "user",
+                    "content": json.dumps({
+                        "memory": f"memory {i}",
+                        "feelings": "glad",
+                        "faction_entry": f"entry {i}",
+                    }),
+                }
+                for i in range(2)
+            ]
+        )
+        fake_llms(get_llm, completions)
+        john, sarah, ann = [
+            Character(name, "20", "They/Them", "Quiet", "person", "Foo")
+            for name in ["John", "Sarah", "Ann"]
+        ]
+        self.assertEqual(john.relationships(frozenset({sarah})), "nothing")
+        for others in [frozenset({sarah}), frozenset({sarah, ann})]:
+            index = john.start_conversation(others)
+            john.end_conversation(others, index)
+        # each conversation is debriefed in one call
+        self.assertEqual(completions.call_count, 2)
+        self.assertEqual(john._last_debrief.faction_entry, "entry 1")
+        self.assertEqual(len(john._feelings._messages), 2)
+        # starting a conversation looks relationships up rather than asking the LLM
+        calls = completions.call_count
+        saved = TELEMETRY.counter("remember_calls_saved")
+        john.start_conversation(frozenset({sarah, ann}))
+        self.assertEqual(completions.call_count, calls)
+        self.assertEqual(TELEMETRY.counter("remember_calls_saved"), saved + 1)
+        self.assertEqual(john._relationships["Sarah"], ["memory 0", "memory 1"])
+        self.assertEqual(john.relationships(frozenset({ann, john})), "Ann: memory 1")
+        john.lose_memory("memory 1")
+        self.assertEqual(john.relationships(frozenset({ann})), "nothing")
+        self.assertEqual(john._relationships["Sarah"], ["memory 0"])
+
+
+class HistoryTest(unittest.TestCase):
+    @patch("entities.save_json")
+    @patch(
+        "entities.generate_single_response", side_effect=lambda prompt, role: "legend"
+    )
+    @patch("entities.LEGEND_CHANCE", 0)
+    def test_legends_join_before_summary(self, _generate, _save):
+        history = History("foo")
+        history.add_event("event a")
+        history.add_event("event b")
+        history.lose_event("event a", 3)
+        history.lose_event("event b", 3)
+        self.assertEqual(history._legends, set())
+        futures = history.submit_legends()
+        self.assertEqual(len(futures), 2)
+        history.join_legends()
+        self.assertEqual(history._legends, {"legend"})
+        self.assertEqual(history._legend_years, {"legend": 3})
+        self.assertEqual(history._pending_legends, [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+import utils
+from jobs import Job, JobQueue, execute, run_worker
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "jobs.db"
+        self.queue = JobQueue(self.path)
+
+    def tearDown(self):
+        self.queue.close()
+        self.directory.cleanup()
+
+    def test_submit_is_idempotent(self):
+        a = self.queue.submit("url", {"model": "foo", "messages": []})
+        b = self.queue.submit("url", {"messages": [], "model": "foo"})
+        self.assertEqual(a, b)
+        self.assertEqual(self.queue.counts(), {"pending": 1})
+
+    def test_lease(self):
+        key = self.queue.submit("url", {"model": "foo"})
+        job = self.queue.claim("a")
+        self.assertEqual((job.key, job.attempts), (key, 1))
+        self.assertIsNone(self.queue.claim("b"))
+        # a's lease runs out, so b takes over and a's late result is dropped
+        job = self.queue.claim("b", lease=-1)
+        self.assertEqual(job.attempts, 2)
+        self.assertFalse(self.queue.complete(key, "a", {"content": "late"}))
+        self.assertTrue(self.queue.complete(key, "b", {"content": "foo"}))
+        self.assertFalse(self.queue.complete(key, "b", {"content": "again"}))
+        self.assertEqual(self.queue.result(key), {"content": "foo"})
+
+    def test_fail(self):
+        key = self.queue.submit("url", {"model": "foo"})
+        for attempt in range(3):
+            self.queue.claim("a")
+            self.queue.fail(key, "a", "boom", max_attempts=2)
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+        with self.assertRaises(RuntimeError):
+            self.queue.result(key)
+        self.assertEqual(self.queue.requeue(), 1)
+        self.assertEqual(self.queue.counts(), {"pending": 1})
+
+    def test_lease_runs_out_on_the_last_attempt(self):
+        key = self.queue.submit("url", {"model": "foo"})
+        self.assertEqual(self.queue.claim("a", max_attempts=2).attempts, 1)
+        self.assertEqual(self.queue.claim("b", lease=-1, max_attempts=2).attempts, 2)
+        # b never finished either, so the job fails instead of being handed out a third time
+        self.assertIsNone(self.queue.claim("c", lease=-1, max_attempts=2))
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+        with self.assertRaises(RuntimeError):
+            self.queue.result(key)
+
+    def test_rate_limit_is_shared(self):
+        for index in range(4):
+            self.queue.submit("url", {"prompt": str(index)})
+        other = JobQueue(self.path)
+        try:
+            # two workers on two connections draw from the same bucket of 3
+            claims = [
+                queue.claim(name, rate=0.001, burst=3)
+                for queue, name in [(self.queue, "a"), (other, "b")] * 2
+            ]
+        finally:
+            other.close()
+        self.assertEqual(sum(claim is not None for claim in claims), 3)
+        self.assertIsNotNone(self.queue.claim("c", rate=0))
+
+    def test_resubmit_failed(self):
+        key = self.queue.submit("url", {"model": "foo"})
+        self.queue.claim("a")
+        self.queue.fail(key, "a", "boom", max_attempts=1)
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+        self.assertEqual(self.queue.submit("url", {"model": "foo"}), key)
+        self.assertEqual(self.queue.counts(), {"pending": 1})
+        self.assertEqual(self.queue.claim("a").attempts, 1)
+
+    def test_scope(self):
+        other = JobQueue(self.path)
+        cache = [JobQueue(self.path, scope="cache") for _ in range(2)]
+        try:
+            # a new run never picks up an earlier run's answers, unless they share a cache
+            body = {"model": "foo"}
+            self.assertNotEqual(
+                self.queue.submit("url", body), other.submit("url", body)
+            )
+            self.assertEqual(cache[0].submit("url", body), cache[1].submit("url", body))
+        finally:
+            other.close()
+            for queue in cache:
+                queue.close()
+
+    def test_wait_for_change(self):
+        other = JobQueue(self.path)
+        try:
+            version = self.queue.changes()
+            self.assertFalse(self.queue.wait_for_change(version, 0.05))
+            # a write from another connection wakes the waiter, but its own writes don't
+            self.queue.submit("url", {"model": "foo"})
+            self.assertFalse(self.queue.wait_for_change(version, 0.05))
+            other.submit("url", {"model": "bar"})
+            self.assertTrue(self.queue.wait_for_change(version, 1))
+        finally:
+            other.close()
+
+    def test_execute_raises_on_error(self):
+        response = MagicMock(ok=False, status_code=429)
+        response.json.return_value = {"error": {"message": "Rate limit reached"}}
+        with patch.object(utils.SESSION, "post", return_value=response):
+            with self.assertRaises(utils.RequestError):
+                execute(Job("key", "url", {"model": "foo"}, 1))
+            # an error body is an error even with a 200
+            response.ok, response.status_code = True, 200
+            with self.assertRaises(utils.RequestError):
+                execute(Job("key", "url", {"model": "foo"}, 1))
+
+    def test_workers(self):
+        def echo(job):
+            return {"content": job.body["prompt"]}
+
+        workers = [
+            Thread(
+                target=run_worker,
+                kwargs={
+                    "path": self.path,
+                    "name": f"worker-{index}",
+                    "idle_timeout": 0.2,
+                    "function": echo,
+                },
+            )
+            for index in range(2)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [self.queue.post("url", {"prompt": str(index)}) for index in range(5)]
+        for worker in workers:
+            worker.join()
+        self.assertEqual(
+            [result["content"] for result in results], ["0", "1", "2", "3", "4"]
+        )
+        self.assertEqual(self.queue.counts(), {"done": 5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import gzip
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from logs import LogStream, load_logs, path_part, read_records
+
+
+class LogStreamTest(unittest.TestCase):
+    def test_deltas(self):
+        with TemporaryDirectory() as directory:
+            stream = LogStream(directory, "gzip")
+            stream.write("memories", "json", ["foo"])
+            stream.write("memories", "json", ["foo", "bar"])
+            stream.write("memories", "json", ["bar"])
+            stream.write("allies", "json", {"Foo", "Bar"})
+            stream.write("allies", "json", {"Foo", "Baz"})
+            stream.write("summary", "summary", "foo")
+            stream.write("summary", "summary", "bar")
+            stream.close()
+            records = list(read_records(directory))
+            self.assertEqual(records[1]["append"], ["bar"])
+            self.assertEqual(records[2]["value"], ["bar"])
+            self.assertEqual(
+                (records[4]["add"], records[4]["remove"]), (["Baz"], ["Bar"])
+            )
+            values = load_logs(directory)
+            self.assertEqual(values["memories"], ["bar"])
+            self.assertEqual(set(values["allies"]), {"Foo", "Baz"})
+            self.assertEqual(values["summary"], "bar")
+
+    def test_rotation(self):
+        with TemporaryDirectory() as directory:
+            stream = LogStream(directory, "gzip", rotate_bytes=1)
+            stream.write("memories", "json", ["foo"])
+            stream.write("memories", "json", ["foo", "bar"])
+            stream.close()
+            self.assertEqual(len(list(Path(directory).glob("log-*.jsonl.gz"))), 2)
+            # every part starts over with full values
+            self.assertEqual(list(read_records(directory))[1]["value"], ["foo", "bar"])
+            self.assertEqual(load_logs(directory)["memories"], ["foo", "bar"])
+
+    def test_unfinished_part(self):
+        with TemporaryDirectory() as directory:
+            stream = LogStream(directory, "gzip")
+            stream.write("summary", "summary", "foo")
+            stream.write("summary", "summary", "bar")
+            # a crash leaves the part without its end, but every flushed record is readable
+            path = next(Path(directory).glob("log-*"))
+            self.assertEqual(load_logs(directory)["summary"], "bar")
+            stream.close()
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+    def test_path_part(self):
+        self.assertEqual(path_part("../Foo/Bar"), "_Foo_Bar")
+        self.assertEqual(path_part("The Age of Foo"), "The Age of Foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
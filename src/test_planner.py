@@ -0,0 +1,62 @@
+import random
+import unittest
+
+from anthology import Anthology, Era, FixedStep, TimeStep
+from entities import Character, Faction
+from planner import compare_time_steps, plan_era
+import utils
+from utils import TELEMETRY, Calibration, DryRun
+
+
+class PlannerTest(unittest.TestCase):
+    def test_plan_era(self):
+        anthology = Anthology("foo", "bar", "baz")
+        era = Era("First", 2, "Betrayal")
+        faction = Faction("Foo", "foo")
+        faction.add_characters([
+            Character("John", "20", "He/Him", "Bubbly", "man", faction.name),
+            Character("Sarah", "21", "She/Her", "Logical", "woman", faction.name),
+        ])
+        era.add_faction(faction)
+        anthology.add_eras(era)
+        state = random.getstate()
+        calibration = DryRun.calibration
+        TELEMETRY.record("foo-345", 10, 20, 1.5, "dialogue")
+        TELEMETRY.count("foo")
+        telemetry = TELEMETRY.export()
+        self.addCleanup(TELEMETRY.reset)
+        plan = plan_era(anthology, era.name, 3, Calibration(turns_per_conversation=2))
+        self.assertGreater(plan["calls"]["min"], 0)
+        self.assertLessEqual(plan["calls"]["min"], plan["calls"]["max"])
+        self.assertGreater(plan["seconds"]["mean"], plan["calls"]["mean"])
+        # the original anthology is untouched, and nothing leaks out of the dry run
+        self.assertEqual(anthology._year, 0)
+        self.assertEqual(era._events, [])
+        self.assertEqual(TELEMETRY.export(), telemetry)
+        self.assertIs(DryRun.calibration, calibration)
+        self.assertEqual(utils.current_backend_override(), "")
+        self.assertEqual(random.getstate(), state)
+
+    def test_compare_time_steps(self):
+        anthology = Anthology("foo", "bar", "baz")
+        era = Era("First", 4, "Betrayal")
+        faction = Faction("Foo", "foo")
+        faction.add_characters([
+            Character("John", "20", "He/Him", "Bubbly", "man", faction.name),
+            Character("Sarah", "21", "She/Her", "Logical", "woman", faction.name),
+        ])
+        era.add_faction(faction)
+        anthology.add_eras(era)
+        comparison = compare_time_steps(
+            anthology,
+            era.name,
+            {"yearly": TimeStep(), "fixed": FixedStep(4)},
+            2,
+            Calibration(turns_per_conversation=2),
+        )
+        # one step covering the whole era costs much less than four
+        self.assertLess(comparison["fixed"]["calls"], comparison["yearly"]["calls"] / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
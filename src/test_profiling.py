@@ -0,0 +1,34 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from anthology import Anthology, Era
+from entities import Character, Faction
+from profiling import Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_year_growth(self):
+        anthology = Anthology("foo", "bar", "baz")
+        era = Era("First", 2, "Betrayal")
+        faction = Faction("Foo", "foo")
+        faction.add_characters(
+            Character("John", "20", "He/Him", "Bubbly", "man", faction.name)
+        )
+        era.add_faction(faction)
+        faction._history._actual_history.add("event a")
+        with TemporaryDirectory() as directory:
+            with Profiler(directory, top=3) as profiler:
+                profiler.on_year(anthology, era)
+                faction._history._actual_history.add("event b")
+                profiler.on_year(anthology, era)
+            self.assertEqual(
+                [row["actual_history"] for row in profiler._growth], [1, 2]
+            )
+            self.assertEqual(len(profiler._allocations), 2)
+            for name in ["cpu_cumulative.txt", "allocations.txt", "growth.txt"]:
+                self.assertTrue((Path(directory) / name).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
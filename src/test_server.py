@@ -0,0 +1,109 @@
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from batch import Scenario
+from server import AnthologyService, Run, serve
+from test_batch import SCENARIO
+from utils import set_backend_override
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.previous = set_backend_override("dryrun")
+        self.directory = TemporaryDirectory()
+        self.service = AnthologyService(self.directory.name, workers=1)
+        self.server = serve(self.service, port=0)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        self.directory.cleanup()
+        set_backend_override(self.previous)
+
+    def request(self, path, body=None, headers=None):
+        data = None if body is None else json.dumps(body).encode()
+        return urlopen(Request(self.url + path, data, headers or {}), timeout=30)
+
+    def events(self, path, headers=None):
+        events = []
+        with self.request(path, headers=headers) as response:
+            for line in response:
+                line = line.decode().strip()
+                if line.startswith("event: "):
+                    events.append(line[len("event: ") :])
+        return events
+
+    def test_run(self):
+        with redirect_stdout(io.StringIO()):
+            with self.request("/anthologies", SCENARIO) as response:
+                self.assertEqual(response.status, 202)
+                id = json.load(response)["id"]
+            events = self.events(f"/anthologies/{id}/events")
+        self.assertEqual(events[0], "started")
+        self.assertIn("turn", events)
+        self.assertEqual(events[-2:], ["year", "done"])
+        # a stream can pick up where another left off
+        resumed = self.events(
+            f"/anthologies/{id}/events", {"Last-Event-ID": str(len(events) - 3)}
+        )
+        self.assertEqual(resumed, ["year", "done"])
+        with self.request(f"/anthologies/{id}") as response:
+            self.assertEqual(json.load(response)["result"]["years"], 1)
+        with self.request("/metrics") as response:
+            metrics = json.load(response)
+        self.assertEqual((metrics["queue_depth"], metrics["completed"]), (0, 1))
+        self.assertGreater(metrics["tokens_per_second"], 0)
+
+    def test_errors(self):
+        with self.assertRaises(HTTPError) as error:
+            self.request("/anthologies", {"name": "foo"})
+        self.assertEqual(error.exception.code, 400)
+        with self.assertRaises(HTTPError) as error:
+            self.request("/anthologies/missing/events")
+        self.assertEqual(error.exception.code, 404)
+        self.service.runs["queued"] = Run("queued", Scenario.model_validate(SCENARIO))
+        with self.assertRaises(HTTPError) as error:
+            self.request("/anthologies/queued/events", headers={"Last-Event-ID": "foo"})
+        self.assertEqual(error.exception.code, 400)
+        with self.assertRaises(HTTPError) as error:
+            self.request("/anthologies", SCENARIO, {"Content-Length": "-1"})
+        self.assertEqual(error.exception.code, 400)
+
+    @patch("server.MAX_RUN_EVENTS", 3)
+    def test_run_keeps_latest_events(self):
+        run = Run("1", Scenario.model_validate(SCENARIO))
+        for index in range(5):
+            run.publish("turn", {"index": index})
+        run.finish({"error": "", "years": 1})
+        self.assertEqual(run.describe()["events"], 6)
+        # a stream from before the oldest kept event starts at it, numbered as before
+        self.assertEqual([index for index, event, data in run.stream(0)], [3, 4, 5])
+        self.assertEqual([index for index, event, data in run.stream(5)], [5])
+
+    @patch("server.MAX_FINISHED_RUNS", 1)
+    def test_evicts_finished_runs(self):
+        with redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                with self.request("/anthologies", SCENARIO) as response:
+                    id = json.load(response)["id"]
+                self.events(f"/anthologies/{id}/events")
+        # the run is finished before the service evicts the one before it
+        self.service.close()
+        self.service._pool.shutdown(wait=True)
+        self.assertEqual([run.id for run in self.service.list_runs()], ["2"])
+        with self.request("/metrics") as response:
+            self.assertEqual(json.load(response)["completed"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
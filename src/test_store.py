@@ -0,0 +1,67 @@
+import unittest
+
+from anthology import Anthology, Era
+from entities import Character, Faction
+from store import AnthologyStore
+
+
+class AnthologyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.anthology = Anthology("foo", "bar", "baz")
+        self.era = Era("First", 2, "Betrayal")
+        faction = Faction("Foo", "foo")
+        self.moreen = Character("Moreen", "20", "She/Her", "Sly", "woman", "Foo")
+        self.john = Character("John", "20", "He/Him", "Bubbly", "man", "Foo")
+        faction.add_characters([self.moreen, self.john])
+        self.era.add_faction(faction)
+        self.store = AnthologyStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_search_conversations(self):
+        self.store.add_conversation(
+            self.anthology,
+            self.era,
+            {self.moreen, self.john},
+            "the vault is emptied",
+            [
+                {"role": "user", "content": "Moreen: I know about your betrayal."},
+                {"role": "user", "content": "John: It was not me!"},
+            ],
+        )
+        self.store.add_conversation(
+            self.anthology,
+            self.era,
+            {self.john},
+            "a quiet harvest",
+            [{"role": "user", "content": "John: The betrayal haunts me."}],
+        )
+        rows = self.store.search_conversations("betrayal", "Moreen")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["event"], "the vault is emptied")
+        self.assertEqual(len(self.store.search_conversations("betrayal")), 2)
+        self.assertEqual(len(self.store.search_conversations("harvest")), 0)
+
+    def test_search(self):
+        self.era._year = 1
+        self.store.add_event(self.anthology, self.era, "the bridge burns", "lost")
+        self.store.add_legend(self.anthology, self.era, "Foo", "the bridge of fire")
+        self.store.add_legend(self.anthology, self.era, "Foo", "the bridge of fire")
+        # a legend is kept under the year its event was lost, not the year it was stored
+        self.era._year = 2
+        self.store.add_legend(self.anthology, self.era, "Foo", "the ford of ash", 1)
+        self.store.add_memory(self.anthology, self.era, self.john, "I saw the bridge")
+        events = self.store.search("events", "bridge")
+        self.assertEqual([(row["kind"], row["year"]) for row in events], [("lost", 1)])
+        self.assertEqual(len(self.store.search("legends", "bridge")), 1)
+        legends = self.store.search("legends", "ford")
+        self.assertEqual([row["year"] for row in legends], [1])
+        self.assertEqual(len(self.store.search("memories", "bridge", "John")), 1)
+        self.assertEqual(len(self.store.search("memories", "bridge", "Moreen")), 0)
+        with self.assertRaises(ValueError):
+            self.store.search("turns", "bridge")
+
+
+if __name__ == "__main__":
+    unittest.main()
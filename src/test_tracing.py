@@ -0,0 +1,39 @@
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from tracing import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span("foo", bar=1) as attributes:
+            tracer.annotate(baz=2)
+        self.assertEqual(attributes, {"bar": 1})
+        self.assertEqual(tracer._events, [])
+
+    def test_nested_spans(self):
+        tracer = Tracer()
+        tracer.enable()
+        with tracer.span("year", year=1):
+            with tracer.span("conversation"):
+                tracer.annotate(prompt_tokens=10)
+        spans = [event for event in tracer._events if event["ph"] == "X"]
+        self.assertEqual([event["name"] for event in spans], ["conversation", "year"])
+        inner, outer = spans
+        self.assertEqual(inner["args"], {"prompt_tokens": 10})
+        self.assertEqual(outer["args"], {"year": 1})
+        self.assertGreaterEqual(inner["ts"], outer["ts"])
+        self.assertLessEqual(inner["ts"] + inner["dur"], outer["ts"] + outer["dur"])
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "trace.json"
+            tracer.export(path)
+            with path.open() as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace["traceEvents"]), len(tracer._events))
+
+
+if __name__ == "__main__":
+    unittest.main()
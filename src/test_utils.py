@@ -1,6 +1,28 @@
 import unittest
 from json import load
-from utils import LLM, OpenAI
+from tempfile import TemporaryDirectory
+from threading import Barrier, Event, Thread
+from time import monotonic, sleep
+from unittest.mock import patch
+from utils import (
+    LLM,
+    EmbeddingService,
+    EmbeddingStore,
+    LLMFactory,
+    OpenAI,
+    Prewarmer,
+    RateLimiter,
+    SingleFlight,
+    TaskGraph,
+    Telemetry,
+    content_hash,
+    cosine_similarity,
+    use_backend_override,
+    estimate_similarity,
+    minhash_signature,
+    request_key,
+    shingles,
+)
 
 
 class LLMTest(unittest.TestCase):
@@ -36,6 +58,38 @@ class LLMTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             llm.adjust_setting("top_p", 0.8)
 
+    @patch("utils.generate_summary", return_value="earlier")
+    def test_context_window(self, summarize):
+        llm = LLM("foo", "http://www.example.com", {"header1": "foo", "header2": "bar"})
+        self.assertIs(llm._pack_messages(), llm._messages)
+        llm.enable_context_window(turns=2, max_tokens=10_000)
+        llm.add_message({"role": "system", "content": "system"})
+        for i in range(4):
+            llm.add_message({"role": "user", "content": f"turn {i}"})
+        self.assertEqual(len(llm._pack_messages()), 5)
+        summarize.assert_not_called()
+        llm.add_message({"role": "user", "content": "turn 4"})
+        packed = llm._pack_messages()
+        summarize.assert_called_once()
+        self.assertEqual(
+            [message["content"] for message in packed][-2:], ["turn 3", "turn 4"]
+        )
+        self.assertIn("earlier", packed[1]["content"])
+        self.assertEqual(len(packed), 4)
+        self.assertEqual(len(llm._messages), 6)
+
+    def test_set_response_format(self):
+        llm = LLM("foo", "http://www.example.com", {"header1": "foo", "header2": "bar"})
+        schema = {"type": "object", "properties": {}, "additionalProperties": False}
+        llm.set_response_format("foo", schema)
+        self.assertEqual(
+            llm._settings["response_format"],
+            {
+                "type": "json_schema",
+                "json_schema": {"name": "foo", "schema": schema, "strict": True},
+            },
+        )
+
 
 class OpenAITest(unittest.TestCase):
     def test_init(self):
@@ -51,6 +105,24 @@ class OpenAITest(unittest.TestCase):
         response = open_ai.generate_completion("Are you ChatGPT?")
         self.assertIn("ChatGPT", response["content"])
 
+    def test_role_routing(self):
+        llm = LLMFactory.get_llm("memory-retrieval")
+        self.assertEqual(llm.role, "memory-retrieval")
+        self.assertEqual(llm._settings["model"], "gpt-4o-mini")
+        with self.assertRaises(ValueError):
+            LLMFactory.get_llm("foo")
+
+    def test_backend_override_stays_in_its_thread(self):
+        elsewhere = []
+        with use_backend_override("dryrun"):
+            self.assertEqual(LLMFactory.get_llm("summary").source, "DryRun")
+            thread = Thread(
+                target=lambda: elsewhere.append(LLMFactory.get_llm("summary"))
+            )
+            thread.start()
+            thread.join()
+        self.assertEqual(elsewhere[0].source, "OpenAI")
+
     # TODO: find a better way to test this
 
     # def test_generate_embeddings(self):
@@ -63,5 +135,208 @@ class OpenAITest(unittest.TestCase):
     #
 
 
+class TelemetryTest(unittest.TestCase):
+    def test_role_stats(self):
+        telemetry = Telemetry()
+        telemetry.record("gpt-4o", 100, 20, 1.0, "dialogue")
+        telemetry.record("gpt-4o", 300, 40, 3.0, "dialogue")
+        telemetry.record("gpt-4o-mini", 1_000_000, 0, 0.5, "summary")
+        stats = telemetry.role_stats()
+        self.assertEqual(stats["dialogue"]["calls"], 2)
+        self.assertEqual(stats["dialogue"]["mean_latency"], 2.0)
+        self.assertEqual(stats["dialogue"]["mean_completion_tokens"], 30)
+        self.assertEqual(telemetry.snapshot()["tokens"], 1_000_460)
+        self.assertAlmostEqual(telemetry.cost(), 0.15 + (400 * 2.5 + 60 * 10) / 1e6)
+
+
+class TransportTest(unittest.TestCase):
+    def test_single_flight(self):
+        flight = SingleFlight()
+        barrier = Barrier(4)
+        calls = []
+
+        def slow():
+            calls.append(1)
+            sleep(0.1)
+            return {"content": "foo"}
+
+        def call():
+            barrier.wait()
+            results.append(flight.do("key", slow))
+
+        results = []
+        threads = [Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], [{"content": "foo"}] * 4)
+        self.assertEqual(
+            sorted([leader for _, leader in results]), [False] * 3 + [True]
+        )
+        results[0][0]["content"] = "bar"
+        self.assertEqual(results[1][0]["content"], "foo")
+        self.assertEqual(flight.do("key", lambda: 1), (1, True))
+
+    def test_single_flight_error(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", lambda: int("foo"))
+        self.assertEqual(flight._calls, {})
+
+    def test_request_key(self):
+        self.assertEqual(
+            request_key("url", {"model": "foo", "messages": []}),
+            request_key("url", {"messages": [], "model": "foo"}),
+        )
+        self.assertNotEqual(
+            request_key("url", {"model": "foo"}), request_key("url", {"model": "bar"})
+        )
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(20, burst=1)
+        start = monotonic()
+        for _ in range(3):
+            limiter.wait()
+        self.assertGreaterEqual(monotonic() - start, 0.1)
+        # a full bucket lets a burst through at once
+        limiter = RateLimiter(1, burst=3)
+        start = monotonic()
+        for _ in range(3):
+            limiter.wait()
+        self.assertLess(monotonic() - start, 0.5)
+
+
+class TaskGraphTest(unittest.TestCase):
+    def test_run(self):
+        graph = TaskGraph(2)
+        order = []
+
+        def task(name, value):
+            def run():
+                order.append(name)
+                return value
+
+            return run
+
+        graph.add("slow", lambda: sleep(0.1) or order.append("slow") or 1)
+        graph.add("fast", task("fast", 2))
+        graph.add("after_fast", lambda: graph.results["fast"] * 10, ["fast"])
+        graph.add(
+            "both",
+            lambda: graph.results["slow"] + graph.results["fast"],
+            ["slow", "fast"],
+        )
+        results = graph.run()
+        self.assertEqual(results, {"slow": 1, "fast": 2, "after_fast": 20, "both": 3})
+        # the fast branch doesn't wait for the slow one
+        self.assertEqual(order, ["fast", "slow"])
+        with self.assertRaises(ValueError):
+            graph.add("late", task("late", 0), ["missing"])
+
+    def test_error(self):
+        graph = TaskGraph()
+        graph.add("broken", lambda: int("foo"))
+        graph.add("after", lambda: 1, ["broken"])
+        with self.assertRaises(ValueError):
+            graph.run()
+        self.assertNotIn("after", graph.results)
+
+
+class PrewarmerTest(unittest.TestCase):
+    def test_fingerprints(self):
+        prewarmer = Prewarmer(1)
+        release = Event()
+        calls = []
+
+        def work(value):
+            def run():
+                calls.append(value)
+                release.wait()
+                return value
+
+            return run
+
+        first = prewarmer.submit("summary", "a", work("a"))
+        # the same inputs again don't start anything new
+        self.assertIs(prewarmer.submit("summary", "a", work("a")), first)
+        queued = prewarmer.submit("events", "a", work("events"))
+        # an edit to what hasn't started yet cancels it
+        prewarmer.submit("events", "b", work("edited"))
+        self.assertTrue(queued.cancelled())
+        # an edit to what's already running lets it finish, but its result is ignored
+        prewarmer.submit("summary", "b", work("b"))
+        release.set()
+        self.assertEqual(prewarmer.get("summary", "b"), "b")
+        self.assertIsNone(prewarmer.get("summary", "a"))
+        self.assertEqual(prewarmer.get("events", "b"), "edited")
+        self.assertEqual(calls, ["a", "edited", "b"])
+        prewarmer.close()
+
+
+class EmbeddingTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def test_store_resumes(self):
+        with TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory)
+            store.INITIAL_ROWS = 2
+            keys = [content_hash(str(index)) for index in range(5)]
+            store.put(keys, [[index, 0.5] for index in range(5)])
+            self.assertEqual(len(store), 5)
+            del store
+            store = EmbeddingStore(directory)
+            self.assertEqual(store.get(keys[3]).tolist(), [3.0, 0.5])
+            self.assertIsNone(store.get(content_hash("missing")))
+            service = EmbeddingService(store, embed=self.embed)
+            self.assertEqual(service.embed(["0", "foo"])[1].tolist(), [3.0, 1.0])
+            service.close()
+            self.assertEqual(self.batches, [["foo"]])
+
+    def test_micro_batches(self):
+        service = EmbeddingService(batch_size=3, max_delay=60, embed=self.embed)
+        futures = [service.submit(text) for text in ["a", "bb", "a", "ccc"]]
+        self.assertEqual(self.batches, [["a", "bb", "ccc"]])
+        self.assertIs(futures[0], futures[2])
+        self.assertEqual(futures[3].result().tolist(), [3.0, 1.0])
+        service.submit("bb")
+        service.close()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_deadline(self):
+        service = EmbeddingService(batch_size=100, max_delay=0.05, embed=self.embed)
+        future = service.submit("dddd")
+        self.assertEqual(future.result(timeout=5).tolist(), [4.0, 1.0])
+        service.close()
+        self.assertEqual(self.batches, [["dddd"]])
+
+
+class SimilarityTest(unittest.TestCase):
+    def test_shingles(self):
+        self.assertEqual(
+            shingles("The tide, the TIDE rises."),
+            {"the tide the", "tide the tide", "the tide rises"},
+        )
+        self.assertEqual(shingles("Storm"), {"storm"})
+
+    def test_minhash(self):
+        a = minhash_signature("The North Islanders raid the southern harbor at dawn.")
+        b = minhash_signature("The North Islanders raid the southern harbor at dawn!")
+        c = minhash_signature("A scholar discovers a map of forgotten caves.")
+        self.assertEqual(estimate_similarity(a, b), 1.0)
+        self.assertLess(estimate_similarity(a, c), 0.2)
+
+    def test_cosine_similarity(self):
+        self.assertAlmostEqual(cosine_similarity([1.0, 0.0], [2.0, 0.0]), 1.0)
+        self.assertAlmostEqual(cosine_similarity([1.0, 0.0], [0.0, 1.0]), 0.0)
+        self.assertEqual(cosine_similarity([0.0, 0.0], [1.0, 0.0]), 0.0)
+
+
 if __name__ == "__main__":
     unittest.main()
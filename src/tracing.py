@@ -0,0 +1,143 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Any, Callable, Iterator, ParamSpec, TypeVar
+
+Params = ParamSpec("Params")
+Result = TypeVar("Result")
+
+
+class Tracer:
+    """
+    Records nested, timed spans (era -> year -> event -> conversation -> turn -> llm call) and exports them in the Chrome trace event format, which chrome://tracing and Perfetto open as a flame chart.
+    Tracing is off until enable() is called, and costs almost nothing while off.
+
+    Attributes:
+        enabled
+        _events
+        _local
+
+    Methods:
+        enable()
+        span()
+        annotate()
+        export()
+    """
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self._events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin: int = perf_counter_ns()
+        self._threads: set[int] = set()
+
+    def enable(self) -> None:
+        with self._lock:
+            self.enabled = True
+            self._events = []
+            self._threads = set()
+            self._origin = perf_counter_ns()
+
+    def _stack(self) -> list[dict[str, Any]]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+        """
+        Time the body of the with block as a span nested under whatever span is currently open on this thread. The yielded dict can be filled in with more attributes.
+        """
+        if not self.enabled:
+            yield attributes
+            return
+        stack = self._stack()
+        stack.append(attributes)
+        start = perf_counter_ns()
+        try:
+            yield attributes
+        finally:
+            end = perf_counter_ns()
+            stack.pop()
+            thread = threading.current_thread()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": thread.ident,
+                "args": {key: _jsonable(value) for key, value in attributes.items()},
+            }
+            with self._lock:
+                self._events.append(event)
+                if thread.ident is not None and thread.ident not in self._threads:
+                    self._threads.add(thread.ident)
+                    self._events.append({
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    })
+
+    def annotate(self, **attributes: Any) -> None:
+        """
+        Add attributes (like token counts) to the innermost open span on this thread.
+        """
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if len(stack) > 0:
+            stack[-1].update(attributes)
+
+    def export(self, path: str | Path) -> None:
+        with self._lock:
+            events = list(self._events)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as f:
+            f.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes: Any):
+    return TRACER.span(name, **attributes)
+
+
+def annotate(**attributes: Any) -> None:
+    TRACER.annotate(**attributes)
+
+
+def traced(name: str) -> Callable[[Callable[Params, Result]], Callable[Params, Result]]:
+    """
+    Decorate a method so every call is recorded as a span. If the instance has a name (characters, factions, eras), it's added to the span.
+    """
+
+    def decorator(function: Callable[Params, Result]) -> Callable[Params, Result]:
+        @wraps(function)
+        def wrapper(*args: Params.args, **kwargs: Params.kwargs) -> Result:
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            owner = getattr(args[0], "name", None) if len(args) > 0 else None
+            attributes = {} if owner is None else {"owner": owner}
+            with TRACER.span(name, **attributes):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
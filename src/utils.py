@@ -1,24 +1,78 @@
+from __future__ import annotations
 import json
-from time import sleep
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from copy import deepcopy
+from hashlib import blake2b, sha256
+from math import sqrt
+from random import Random
+from threading import Condition, Event, Lock, Thread
+from time import monotonic, perf_counter, sleep
 from pathlib import Path
 from os import getenv
+from typing import Any, Callable, Iterator, TypeVar
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from pydantic import BaseModel
+from logs import write_record
+from tracing import annotate, span, traced
+
+
+LOG_DIR: Path = Path("./logs")
+
+
+def set_log_dir(path: str | Path) -> Path:
+    """
+    Change where save_json and save_summary write to, returning the previous directory so it can be restored.
+    """
+    global LOG_DIR
+    previous = LOG_DIR
+    LOG_DIR = Path(path)
+    return previous
+
+
+_log_dir: ContextVar[Path | None] = ContextVar("log_dir", default=None)
+
+
+def log_dir() -> Path:
+    return _log_dir.get() or LOG_DIR
+
+
+@contextmanager
+def use_log_dir(path: str | Path) -> Iterator[Path]:
+    """
+    Send save_json and save_summary output from this thread to path until the with block ends, without affecting any other thread.
+    Tasks handed to a pool pick it up too, as long as they're submitted with contextvars.copy_context().run.
+    """
+    token = _log_dir.set(Path(path))
+    try:
+        yield Path(path)
+    finally:
+        _log_dir.reset(token)
 
 
 def save_json(name: str, contents: list | dict | set | frozenset) -> None:
-    if isinstance(contents, (set, frozenset)):
-        contents = list(contents)
-    path = Path(f"./logs/{name}.json")
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w") as f:
-        f.write(json.dumps(contents))
+    """
+    Add contents to the log stream for the current log directory (see logs.LogStream), under name.
+    """
+    write_record(log_dir(), name, "json", contents)
 
 
 def save_summary(name: str, contents: str) -> None:
-    path = Path(f"./logs/{name}.summary")
+    write_record(log_dir(), name, "summary", contents)
+
+
+def save_report(name: str, contents: dict) -> None:
+    """
+    Write contents to a plain JSON file in the current log directory, for small reports read by other tools (like Calibration.from_files) rather than replayed from a log stream.
+    """
+    path = log_dir() / f"{name}.json"
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w") as f:
-        f.write(contents)
+        f.write(json.dumps(contents))
 
 
 OPENAI_API_KEY = getenv("OPENAI_API_KEY")
@@ -51,6 +105,559 @@ OPENAI_RESPONSE_SCHEMA = {
 }
 
 
+DEFAULT_MODEL: str = "gpt-4o"
+# NOTE: requests per second across every thread in the process, with bursts of up to RATE_LIMIT_BURST. OpenAI's lowest paid tier allows about 8 per second for gpt-4o.
+RATE_LIMIT_PER_SECOND: float = 4
+RATE_LIMIT_BURST: int = 8
+EMBEDDING_MODEL: str = "text-embedding-ada-002"
+# NOTE: USD per million (prompt, completion) tokens.
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+
+class Telemetry:
+    """
+    A thread-safe tally of every request sent to an LLM, used to project how much a run will cost and to compare models across call sites.
+
+    Attributes:
+        calls
+        prompt_tokens
+        completion_tokens
+        seconds
+        _models
+        _roles
+        _counters
+
+    Methods:
+        record()
+        count()
+        hit_rate()
+        cost()
+        snapshot()
+        role_stats()
+        report()
+        export()
+        reset()
+        save()
+        restore()
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls: int = 0
+            self.prompt_tokens: int = 0
+            self.completion_tokens: int = 0
+            self.seconds: float = 0.0
+            self._models: dict[str, dict[str, int]] = {}
+            self._roles: dict[str, dict[str, float]] = {}
+            self._counters: dict[str, int] = {}
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        seconds: float,
+        role: str = "",
+    ) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.seconds += seconds
+            usage = self._models.setdefault(model, {"prompt": 0, "completion": 0})
+            usage["prompt"] += prompt_tokens
+            usage["completion"] += completion_tokens
+            stats = self._roles.setdefault(
+                role or "unknown",
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0},
+            )
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["seconds"] += seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Bump a named counter for anything that isn't an LLM request, like cache hits.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def hit_rate(self, name: str) -> float:
+        """
+        The fraction of lookups that were hits, for counters recorded as {name}_hits and {name}_misses.
+        """
+        hits = self.counter(f"{name}_hits")
+        total = hits + self.counter(f"{name}_misses")
+        if total == 0:
+            return 0.0
+        return hits / total
+
+    def cost(self) -> float:
+        """
+        The estimated spend in USD so far. Models without a known price are counted at the default model's price.
+        """
+        with self._lock:
+            total = 0.0
+            for model, usage in self._models.items():
+                prompt_price, completion_price = MODEL_PRICES.get(
+                    model, MODEL_PRICES[DEFAULT_MODEL]
+                )
+                total += usage["prompt"] * prompt_price
+                total += usage["completion"] * completion_price
+            return total / 1_000_000
+
+    def snapshot(self) -> dict[str, float]:
+        cost = self.cost()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tokens": self.prompt_tokens + self.completion_tokens,
+                "seconds": self.seconds,
+                "cost": cost,
+            }
+
+    def role_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Per-role call counts, token totals, and mean latency, to justify which model each role is routed to.
+        """
+        with self._lock:
+            res = {}
+            for role, stats in self._roles.items():
+                res[role] = stats.copy()
+                res[role]["mean_latency"] = stats["seconds"] / stats["calls"]
+                res[role]["mean_completion_tokens"] = (
+                    stats["completion_tokens"] / stats["calls"]
+                )
+            return res
+
+    def report(self) -> str:
+        lines = [
+            f"{role}: {stats['calls']:.0f} calls, {stats['prompt_tokens']:.0f} prompt tokens, {stats['completion_tokens']:.0f} completion tokens, {stats['mean_latency']:.2f}s mean latency"
+            for role, stats in sorted(self.role_stats().items())
+        ]
+        with self._lock:
+            counters = sorted(self._counters.items())
+        lines += [f"{name}: {value}" for name, value in counters]
+        return "\n".join(lines)
+
+    def export(self) -> dict[str, Any]:
+        """
+        Everything needed to calibrate a dry run later on (see Calibration.from_files).
+        """
+        with self._lock:
+            counters = self._counters.copy()
+        return {"roles": self.role_stats(), "counters": counters}
+
+    def save(self) -> dict[str, Any]:
+        """
+        A copy of everything tallied so far, to put back with restore() after something (like a dry run) has used the tally for itself.
+        """
+        with self._lock:
+            return deepcopy({
+                name: value for name, value in vars(self).items() if name != "_lock"
+            })
+
+    def restore(self, saved: dict[str, Any]) -> None:
+        with self._lock:
+            vars(self).update(deepcopy(saved))
+
+
+TELEMETRY = Telemetry()
+
+ROLES: tuple[str, ...] = (
+    "dialogue",
+    "memory-retrieval",
+    "summary",
+    "legend",
+    "event-generation",
+    "suggestion",
+)
+# NOTE: which backend and model each call site uses. short extraction jobs go to the smaller model.
+MODEL_ROUTES: dict[str, dict[str, str]] = {
+    "dialogue": {"backend": "openai", "model": DEFAULT_MODEL},
+    "memory-retrieval": {"backend": "openai", "model": "gpt-4o-mini"},
+    "summary": {"backend": "openai", "model": "gpt-4o-mini"},
+    "legend": {"backend": "openai", "model": DEFAULT_MODEL},
+    "event-generation": {"backend": "openai", "model": DEFAULT_MODEL},
+    "suggestion": {"backend": "openai", "model": DEFAULT_MODEL},
+}
+
+
+def set_route(role: str, model: str = "", backend: str = "") -> dict[str, str]:
+    """
+    Change the model and/or backend a role is routed to, returning the previous route so it can be restored.
+    """
+    if role not in MODEL_ROUTES:
+        raise ValueError(f"unknown role: {role}")
+    previous = MODEL_ROUTES[role].copy()
+    if model:
+        MODEL_ROUTES[role]["model"] = model
+    if backend:
+        MODEL_ROUTES[role]["backend"] = backend
+    return previous
+
+
+def load_model_routes(path: str) -> None:
+    """
+    Override the routes from a JSON file shaped like {"summary": {"backend": "openai", "model": "gpt-4o-mini"}}.
+    """
+    with Path(path).open() as f:
+        routes = json.load(f)
+    for role, route in routes.items():
+        set_route(role, route.get("model", ""), route.get("backend", ""))
+
+
+def estimate_tokens(messages: str | list[dict[str, str]]) -> int:
+    """
+    A rough local token count (about four characters per token, plus a little overhead per message) so prompts can be sized without a tokenizer.
+    """
+    if isinstance(messages, str):
+        return len(messages) // 4 + 1
+    return sum([estimate_tokens(message["content"]) + 4 for message in messages])
+
+
+class RateLimiter:
+    """
+    A token bucket shared by every thread: requests go out immediately while there are tokens, and tokens refill at rate per second up to burst,
+    so concurrent callers get up to rate requests per second between them instead of waiting on each other. A rate of 0 turns limiting off.
+
+    Attributes:
+        rate
+        burst
+        _tokens
+
+    Methods:
+        wait()
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens: float = burst
+        self._updated: float = monotonic()
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # NOTE: a caller that finds the bucket empty takes a token anyway and waits for it to refill, so callers queue up in order
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            sleep(delay)
+
+
+Result = TypeVar("Result")
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in flight at the same time: the first caller (the leader) does the work and every caller that arrives before it finishes gets a copy of the same result (or exception).
+
+    Attributes:
+        _calls
+
+    Methods:
+        do()
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, tuple[Event, list[Any]]] = {}
+        self._lock = Lock()
+
+    def do(self, key: str, function: Callable[[], Result]) -> tuple[Result, bool]:
+        """
+        Run function once per key at a time, returning a deep copy of its result along with whether this caller was the leader.
+        """
+        with self._lock:
+            leader = key not in self._calls
+            if leader:
+                self._calls[key] = (Event(), [])
+            done, outcome = self._calls[key]
+        if leader:
+            TELEMETRY.count("single_flight_leaders")
+            try:
+                outcome.append(function())
+            except Exception as error:
+                outcome.append(error)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                done.set()
+        else:
+            TELEMETRY.count("single_flight_coalesced")
+            done.wait()
+        if isinstance(outcome[0], Exception):
+            raise outcome[0]
+        # NOTE: callers mutate what they get back (OpenAI deletes "refusal"), so nobody gets the shared object
+        return deepcopy(outcome[0]), leader
+
+
+RATE_LIMITER = RateLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+IN_FLIGHT = SingleFlight()
+# NOTE: one keep-alive connection pool for every request this process sends, however many anthologies are running.
+HTTP_POOL_SIZE: int = 16
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+SESSION.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+
+
+def set_rate_limit(per_second: float) -> float:
+    """
+    Change how many requests per second go out (0 for no limit), returning the previous rate so it can be restored.
+    """
+    previous = RATE_LIMITER.rate
+    RATE_LIMITER.rate = per_second
+    return previous
+
+
+def request_key(url: str, body: dict[str, Any]) -> str:
+    """
+    A canonical hash of a request, so two requests with the same settings and messages get the same key no matter how their dicts were built.
+    """
+    canonical = json.dumps(
+        {"url": url, "body": body}, sort_keys=True, separators=(",", ":")
+    )
+    return sha256(canonical.encode()).hexdigest()
+
+
+def openai_headers() -> dict[str, str]:
+    return {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+class RequestError(RuntimeError):
+    """
+    Raised when the API answers a request with an HTTP error status or an error body (like a 429 rate limit), so the answer is never treated as a result.
+    """
+
+
+def send_json(
+    url: str, body: dict[str, Any], headers: dict[str, str]
+) -> dict[str, Any]:
+    """
+    The default transport: wait for the rate limiter, then POST the request from this process, raising RequestError if the API answers with an error.
+    """
+    RATE_LIMITER.wait()
+    response = SESSION.post(url=url, json=body, headers=headers)
+    content = response.json()
+    if not response.ok or "error" in content:
+        raise RequestError(
+            f"{url} answered {response.status_code}: {content.get('error', content)}"
+        )
+    return content
+
+
+Transport = Callable[[str, dict[str, Any], dict[str, str]], dict[str, Any]]
+transport: Transport = send_json
+
+
+def set_transport(function: Transport) -> Transport:
+    """
+    Change how requests are actually sent (like handing them to a JobQueue's workers), returning the previous transport so it can be restored.
+    """
+    global transport
+    previous = transport
+    transport = function
+    return previous
+
+
+Post = Callable[[], tuple[dict[str, Any], bool]]
+Recorder = Callable[[str, dict[str, Any], Post], tuple[dict[str, Any], bool]]
+recorder: Recorder | None = None
+
+
+def set_recorder(function: Recorder | None) -> Recorder | None:
+    """
+    Put something (like a Cassette) in front of every call to _post_json, above the coalescing, returning the previous recorder so it can be restored.
+    It's given the url, the body, and a function that makes the call as usual, and returns what _post_json would have.
+    """
+    global recorder
+    previous = recorder
+    recorder = function
+    return previous
+
+
+def _post_json(
+    url: str, body: dict[str, Any], headers: dict[str, str]
+) -> tuple[dict[str, Any], bool]:
+    """
+    POST a JSON request, sharing the response with any identical request already in flight. Only the request that actually goes out goes through the transport (and its rate limiter).
+    Returns the response and whether this call made the request (False when it was coalesced onto another one).
+    """
+
+    def post() -> tuple[dict[str, Any], bool]:
+        return IN_FLIGHT.do(
+            request_key(url, body), lambda: transport(url, body, headers)
+        )
+
+    if recorder is None:
+        return post()
+    return recorder(url, body, post)
+
+
+class TaskGraph:
+    """
+    A small dependency graph of tasks run on a thread pool. Each task starts as soon as every task it depends on has finished, instead of waiting for a whole phase to end.
+    Tasks take no arguments; results are collected in results under the task's name, and a task's dependencies' results are always there by the time it starts.
+    Since a task can only depend on tasks added before it, the graph can't have cycles.
+
+    Attributes:
+        max_workers
+        results
+        _tasks
+
+    Methods:
+        add()
+        run()
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.max_workers = max_workers
+        self.results: dict[str, Any] = {}
+        self._tasks: dict[str, tuple[Callable[[], Any], tuple[str, ...]]] = {}
+
+    def add(
+        self,
+        name: str,
+        function: Callable[[], Any],
+        dependencies: list[str] | None = None,
+    ) -> None:
+        if name in self._tasks:
+            raise ValueError(f"{name} was already added!")
+        dependencies = dependencies or []
+        for dependency in dependencies:
+            if dependency not in self._tasks:
+                raise ValueError(
+                    f"{name} depends on {dependency}, which hasn't been added!"
+                )
+        self._tasks[name] = (function, tuple(dependencies))
+
+    def run(self) -> dict[str, Any]:
+        """
+        Run every task, returning the results. If a task raises, nothing new is started and the exception is re-raised once the running tasks finish.
+        """
+        waiting = {
+            name: set(dependencies) for name, (_, dependencies) in self._tasks.items()
+        }
+        running: dict[Future[Any], str] = {}
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="task") as pool:
+
+            def start_ready() -> None:
+                for name in [
+                    name for name, blockers in waiting.items() if len(blockers) == 0
+                ]:
+                    del waiting[name]
+                    running[pool.submit(copy_context().run, self._run, name)] = name
+
+            start_ready()
+            while len(running) > 0:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+                    for blockers in waiting.values():
+                        blockers.discard(name)
+                start_ready()
+        return self.results
+
+    def _run(self, name: str) -> Any:
+        with span("task", task=name):
+            return self._tasks[name][0]()
+
+
+class Prewarmer:
+    """
+    Runs work speculatively in the background, keyed by what it's for and fingerprinted by the inputs it was started from.
+    Submitting a key again with the same fingerprint is a no-op, and with a different one cancels the stale work (or, if it's already running, lets it finish and ignores it),
+    so callers can start work as soon as its inputs look final and just resubmit if they change.
+
+    Attributes:
+        max_workers
+        _tasks
+
+    Methods:
+        submit()
+        get()
+        wait()
+        cancel()
+        close()
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="prewarm")
+        self._tasks: dict[str, tuple[str, Future[Any]]] = {}
+        self._lock = Lock()
+
+    def submit(
+        self, key: str, fingerprint: str, function: Callable[[], Any]
+    ) -> Future[Any]:
+        with self._lock:
+            if key in self._tasks:
+                current, future = self._tasks[key]
+                if current == fingerprint:
+                    return future
+                future.cancel()
+                TELEMETRY.count("prewarm_stale")
+            future = self._pool.submit(copy_context().run, function)
+            self._tasks[key] = (fingerprint, future)
+        TELEMETRY.count("prewarm_started")
+        return future
+
+    def get(self, key: str, fingerprint: str) -> Any | None:
+        """
+        Wait for the work submitted under key and return its result, or None if there isn't any for this fingerprint (or it failed).
+        """
+        with self._lock:
+            current, future = self._tasks.get(key, ("", None))
+        if future is None or current != fingerprint or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception as error:
+            print(f"prewarming {key} failed: {error}")
+            return None
+
+    def wait(self) -> None:
+        with self._lock:
+            futures = [future for _, future in self._tasks.values()]
+        wait(futures)
+
+    def cancel(self, key: str) -> None:
+        with self._lock:
+            if key in self._tasks:
+                self._tasks.pop(key)[1].cancel()
+
+    def close(self) -> None:
+        with self._lock:
+            self._tasks.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
 class LLM:
     """
     A wrapper for a chain of interactions with a Large Language Model.
@@ -59,14 +666,21 @@ class LLM:
         source
         endpoint
         headers
+        role
         _messages
         settings
+        _window_turns
+        _window_tokens
+        _scene_summary
+        _summarized_count
 
     Methods:
         generate_completion()
         generate_embeddings()
         add_message()
+        enable_context_window()
         adjust_settings()
+        set_response_format()
     """
 
     def __init__(
@@ -74,17 +688,24 @@ class LLM:
         source: str,
         endpoint: str,
         headers: dict[str, str],
+        role: str = "",
     ) -> None:
         self.source: str = source
         self.endpoint: str = endpoint
         self.headers: dict[str, str] = headers
+        self.role: str = role
         self._messages: list[dict[str, str]] = []
-        self._settings: dict[str, str | int | float | bool] = {
+        self._settings: dict[str, Any] = {
             "model": "null",
             "temperature": 1,
             "top_p": 1,
             "stream": False,
         }
+        # NOTE: when a window is set, only the system prompt, a running summary, and the latest turns are sent.
+        self._window_turns: int | None = None
+        self._window_tokens: int | None = None
+        self._scene_summary: str = ""
+        self._summarized_count: int = 0
         # self._session: requests.Session = requests.Session()
 
     def __repr__(self) -> str:
@@ -93,14 +714,64 @@ class LLM:
     def generate_completion(self, prompt: str = ""):
         raise NotImplementedError
 
-    def generate_embeddings(self, input: str):
+    def generate_embeddings(
+        self, input: str | list[str] | list[int] | list[list[int]]
+    ) -> list[dict[str, Any]]:
         raise NotImplementedError
 
     def add_message(self, message: dict[str, str]) -> None:
         """takes a dict ({"role": "system/user/assistant", "content": "message contents"}) and appends it to self._messages,"""
         self._messages.append(message)
 
-    def adjust_setting(self, key: str, value: str | int | float | bool) -> None:
+    def enable_context_window(self, turns: int, max_tokens: int) -> None:
+        """
+        Keep prompts flat in size no matter how long the chain of messages gets. Every request sends the system messages, a running summary of older turns, and at least the last few turns.
+        Older turns are folded into the summary in batches, once there are twice as many unsummarized turns as the window holds or the prompt goes over max_tokens.
+        """
+        if turns < 1:
+            raise ValueError("the context window needs at least one turn!")
+        self._window_turns = turns
+        self._window_tokens = max_tokens
+
+    def _pack_messages(self) -> list[dict[str, str]]:
+        """
+        Build the list of messages that actually gets sent with a request. The full history in _messages is never modified.
+        """
+        if self._window_turns is None or self._window_tokens is None:
+            return self._messages
+        system = [message for message in self._messages if message["role"] == "system"]
+        turns = [message for message in self._messages if message["role"] != "system"]
+        unsummarized = turns[self._summarized_count :]
+        if len(unsummarized) > self._window_turns and (
+            len(unsummarized) > 2 * self._window_turns
+            or estimate_tokens(system + unsummarized) > self._window_tokens
+        ):
+            self._fold_turns(unsummarized[: -self._window_turns])
+            unsummarized = unsummarized[-self._window_turns :]
+        if self._scene_summary:
+            system = system + [
+                {
+                    "role": "system",
+                    "content": f"Summary of everything before the latest messages: {self._scene_summary}",
+                }
+            ]
+        return system + unsummarized
+
+    def _fold_turns(self, turns: list[dict[str, str]]) -> None:
+        context = "\n".join([self._scene_summary] + [turn["content"] for turn in turns])
+        self._scene_summary = generate_summary(context)
+        self._summarized_count += len(turns)
+
+    def set_response_format(self, name: str, schema: dict[str, Any]) -> None:
+        """
+        Switch the LLM into structured-output mode, requiring every completion to be JSON matching the given schema.
+        """
+        self._settings["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": schema, "strict": True},
+        }
+
+    def adjust_setting(self, key: str, value: Any) -> None:
         """
         takes a key/value pair and updates the relevant setting for the LLM. won't allow changes to both temp AND top_p.
         """
@@ -119,6 +790,7 @@ class OpenAI(LLM):
         source: a short name to identify where the LLM is coming from
         endpoint: the primary URL pointing towards the server that we send requests to.
         headers: Key/Value pairs that get passed in the reque
+        role: the call site this LLM serves (see ROLES), used to route it to a model and to group its telemetry.
         _messages: a list holding the interactions with this instance of the model.
         _settings: Key/Value pairs with the configuration options passed to the model.
 
@@ -127,23 +799,22 @@ class OpenAI(LLM):
         generate_embedding(): Give a string of text, a list of strings, a list of tokens (int), or a list of lists of tokens and get an embedding list in response.
     """
 
-    def __init__(self):
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json",
-        }
+    def __init__(self, model: str = DEFAULT_MODEL, role: str = ""):
+        headers = openai_headers()
         super().__init__(
-            source="OpenAI", endpoint="https://api.openai.com/v1/", headers=headers
+            source="OpenAI",
+            endpoint="https://api.openai.com/v1/",
+            headers=headers,
+            role=role,
         )
-        self._settings["model"] = "gpt-4o"
+        self._settings["model"] = model
         del headers
 
+    @traced("llm.completion")
     def generate_completion(self, prompt: str = "") -> dict[str, str]:
         """
         generate a chat completion response based on the prompt and the existing chat history for the model.
         """
-        # NOTE: sleeping to be polite with rate limits. local models don't care.
-        sleep(5)
         endpoint = self.endpoint + "chat/completions"
         request = EXAMPLE_OPENAI_COMPLETION_REQUEST_BODY.copy()
         for setting in self._settings.keys():
@@ -151,10 +822,26 @@ class OpenAI(LLM):
         if prompt:
             message = {"role": "user", "content": prompt}
             self.add_message(message)
-        request["messages"] = self._messages
-        response = requests.post(
-            url=endpoint, json=request, headers=self.headers
-        ).json()
+        request["messages"] = self._pack_messages()
+        start = perf_counter()
+        response, leader = _post_json(endpoint, request, self.headers)
+        usage = response.get("usage", {})
+        annotate(
+            role=self.role,
+            model=self._settings["model"],
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            coalesced=not leader,
+        )
+        # NOTE: a coalesced call didn't cost anything, so only the leader is billed
+        if leader:
+            TELEMETRY.record(
+                self._settings["model"],
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                perf_counter() - start,
+                self.role,
+            )
         # TODO: handle the case of a JSON error
         if "choices" not in response:
             raise ValueError(f"OpenAI failed to generate a response! JSON: {response}")
@@ -171,18 +858,26 @@ class OpenAI(LLM):
         response_message["role"] = "user"
         return response_message
 
+    @traced("llm.embeddings")
     def generate_embeddings(
-        self, input: str | list[str | int | list[int]]
-    ) -> list[dict[str, str | int | float]]:
+        self, input: str | list[str] | list[int] | list[list[int]]
+    ) -> list[dict[str, Any]]:
         """
         generate an embedding for an input string, list of strings, list of tokens, or list of list of tokens.
         """
         # TODO: implement embeddings
         endpoint = self.endpoint + "embeddings"
-        request = {"model": "text-embedding-ada-002", "input": input}
-        response = requests.post(
-            url=endpoint, json=request, headers=self.headers
-        ).json()
+        request = {"model": EMBEDDING_MODEL, "input": input}
+        start = perf_counter()
+        response, leader = _post_json(endpoint, request, self.headers)
+        if leader:
+            TELEMETRY.record(
+                EMBEDDING_MODEL,
+                response.get("usage", {}).get("prompt_tokens", 0),
+                0,
+                perf_counter() - start,
+                "embeddings",
+            )
         return response["data"]
 
 
@@ -192,26 +887,580 @@ class Ollama(LLM):
         raise NotImplementedError
 
 
+class Calibration:
+    """
+    Per-role latency and completion sizes (plus conversation lengths) taken from past runs' telemetry, used to make dry runs look like real ones.
+
+    Attributes:
+        latency
+        completion_tokens
+        turns_per_conversation
+
+    Methods:
+        from_files()
+    """
+
+    DEFAULT_LATENCY: float = 2.0
+    DEFAULT_COMPLETION_TOKENS: float = 80.0
+    DEFAULT_TURNS: float = 6.0
+
+    def __init__(
+        self,
+        latency: dict[str, float] | None = None,
+        completion_tokens: dict[str, float] | None = None,
+        turns_per_conversation: float = DEFAULT_TURNS,
+    ) -> None:
+        self.latency = latency if latency is not None else {}
+        self.completion_tokens = (
+            completion_tokens if completion_tokens is not None else {}
+        )
+        self.turns_per_conversation = turns_per_conversation
+
+    @classmethod
+    def from_files(cls, paths: list[str]) -> Calibration:
+        """
+        Average the telemetry saved by earlier runs (see Telemetry.export) into a single calibration.
+        """
+        calls: dict[str, float] = {}
+        seconds: dict[str, float] = {}
+        tokens: dict[str, float] = {}
+        conversations = 0
+        turns = 0
+        for path in paths:
+            with Path(path).open() as f:
+                telemetry = json.load(f)
+            for role, stats in telemetry.get("roles", {}).items():
+                calls[role] = calls.get(role, 0) + stats["calls"]
+                seconds[role] = seconds.get(role, 0) + stats["seconds"]
+                tokens[role] = tokens.get(role, 0) + stats["completion_tokens"]
+            counters = telemetry.get("counters", {})
+            conversations += counters.get("conversations", 0)
+            turns += counters.get("conversation_turns", 0)
+        return cls(
+            {role: seconds[role] / calls[role] for role in calls},
+            {role: tokens[role] / calls[role] for role in calls},
+            turns / conversations if conversations > 0 else cls.DEFAULT_TURNS,
+        )
+
+
+class DryRun(LLM):
+    """
+    A no-op backend that never touches the network. Responses are filler text sized from a Calibration, structured responses are generated to fit their schema, and dialogue ends a scene at the calibrated rate.
+    Every call is still recorded in TELEMETRY with estimated tokens and the calibrated latency, so a dry run can be used to plan a real one.
+    """
+
+    calibration: Calibration = Calibration()
+    _rng: Random = Random()
+
+    def __init__(self, model: str = DEFAULT_MODEL, role: str = ""):
+        super().__init__(source="DryRun", endpoint="", headers={}, role=role)
+        self._settings["model"] = model
+
+    @traced("llm.completion")
+    def generate_completion(self, prompt: str = "") -> dict[str, str]:
+        if prompt:
+            self.add_message({"role": "user", "content": prompt})
+        prompt_tokens = estimate_tokens(self._pack_messages())
+        if prompt:
+            del self._messages[-1]
+        completion_tokens = int(
+            self.calibration.completion_tokens.get(
+                self.role, Calibration.DEFAULT_COMPLETION_TOKENS
+            )
+        )
+        if "response_format" in self._settings:
+            schema = self._settings["response_format"]["json_schema"]["schema"]
+            content = json.dumps(self._fake_from_schema(schema, schema))
+        else:
+            content = self._fake_words(max(completion_tokens, 1))
+            if (
+                self.role == "dialogue"
+                and self._rng.random() < 1 / self.calibration.turns_per_conversation
+            ):
+                content += " </SCENE>"
+        annotate(
+            role=self.role,
+            model=self._settings["model"],
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+        TELEMETRY.record(
+            self._settings["model"],
+            prompt_tokens,
+            completion_tokens,
+            self.calibration.latency.get(self.role, Calibration.DEFAULT_LATENCY),
+            self.role,
+        )
+        self.add_message({"role": "assistant", "content": content})
+        return {"role": "user", "content": content}
+
+    def generate_embeddings(
+        self, input: str | list[str] | list[int] | list[list[int]]
+    ) -> list[dict[str, Any]]:
+        texts = input if isinstance(input, list) else [input]
+        TELEMETRY.record(
+            EMBEDDING_MODEL,
+            sum([estimate_tokens(str(text)) for text in texts]),
+            0,
+            Calibration.DEFAULT_LATENCY / 4,
+            "embeddings",
+        )
+        return [
+            {"index": index, "embedding": [self._rng.gauss(0, 1) for _ in range(8)]}
+            for index in range(len(texts))
+        ]
+
+    def _fake_from_schema(
+        self, schema: dict[str, Any], root: dict[str, Any], depth: int = 0
+    ) -> Any:
+        if "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+            return self._fake_from_schema(root["$defs"][name], root, depth)
+        match schema.get("type"):
+            case "object":
+                return {
+                    key: self._fake_from_schema(value, root, depth + 1)
+                    for key, value in schema.get("properties", {}).items()
+                }
+            case "array":
+                # NOTE: top-level lists (like possible events) get 5 to 10 items, nested ones (like participants) 1 to 4
+                count = (
+                    self._rng.randint(5, 10) if depth <= 1 else self._rng.randint(1, 4)
+                )
+                return [
+                    self._fake_from_schema(schema["items"], root, depth + 1)
+                    for _ in range(count)
+                ]
+            case "integer":
+                return self._rng.randint(0, 10)
+            case "number":
+                return self._rng.random()
+            case "boolean":
+                return self._rng.random() < 0.5
+            case _:
+                return self._fake_words(self._rng.randint(5, 20))
+
+    def _fake_words(self, count: int) -> str:
+        # NOTE: random words, so dry run events and memories don't all look like duplicates of each other
+        return " ".join([f"{self._rng.getrandbits(24):x}" for _ in range(count)])
+
+
+# NOTE: when set, every role uses this backend regardless of its route. used for dry runs.
+backend_override: str = ""
+
+
+def set_backend_override(backend: str) -> str:
+    global backend_override
+    previous = backend_override
+    backend_override = backend
+    return previous
+
+
+_backend_override: ContextVar[str | None] = ContextVar("backend_override", default=None)
+
+
+def current_backend_override() -> str:
+    return _backend_override.get() or backend_override
+
+
+@contextmanager
+def use_backend_override(backend: str) -> Iterator[str]:
+    """
+    Make every LLM built in this thread use backend until the with block ends, without affecting any other thread.
+    Tasks handed to a pool pick it up too, as long as they're submitted with contextvars.copy_context().run.
+    """
+    token = _backend_override.set(backend)
+    try:
+        yield backend
+    finally:
+        _backend_override.reset(token)
+
+
 class LLMFactory:
     @staticmethod
-    def get_llm(model: str = "openai") -> LLM:
-        if model == "openai":
-            return OpenAI()
-        # if model == "ollama":
+    def get_llm(role: str = "dialogue", backend: str = "") -> LLM:
+        """
+        Build an LLM for the given role, using the backend and model from MODEL_ROUTES unless a backend is given.
+        """
+        if role not in MODEL_ROUTES:
+            raise ValueError(f"unknown role: {role}")
+        route = MODEL_ROUTES[role]
+        backend = backend or current_backend_override() or route["backend"]
+        if backend == "openai":
+            return OpenAI(route["model"], role)
+        if backend == "dryrun":
+            return DryRun(route["model"], role)
+        # if backend == "ollama":
         #     return Ollama()
         raise ValueError("unkown model")
 
+    @staticmethod
+    def get_embedder() -> LLM:
+        if current_backend_override() == "dryrun":
+            return DryRun(EMBEDDING_MODEL, "embeddings")
+        return OpenAI()
+
 
-def generate_single_response(context: str) -> str:
-    llm = OpenAI()
+def generate_single_response(context: str, role: str = "dialogue") -> str:
+    llm = LLMFactory.get_llm(role)
     response = llm.generate_completion(context)["content"]
     del llm
     return response
 
 
+StructuredResponse = TypeVar("StructuredResponse", bound=BaseModel)
+
+
+def generate_structured_response(
+    context: str,
+    schema: type[StructuredResponse],
+    role: str = "dialogue",
+    messages: list[dict[str, str]] | None = None,
+) -> StructuredResponse:
+    """
+    Generate a single response constrained to the JSON schema of a pydantic model, and parse it into that model.
+    Any messages (like a system prompt and a conversation to reflect on) are sent ahead of the context.
+    """
+    llm = LLMFactory.get_llm(role)
+    llm.set_response_format(schema.__name__, schema.model_json_schema())
+    for message in messages or []:
+        llm.add_message(message)
+    response = llm.generate_completion(context)["content"]
+    del llm
+    return schema.model_validate_json(response)
+
+
+def generate_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embed a batch of texts in a single request, returning the vectors in the same order as the texts.
+    """
+    llm = LLMFactory.get_embedder()
+    data = llm.generate_embeddings(texts)
+    del llm
+    return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+
+EMBEDDING_BATCH_SIZE: int = 64
+EMBEDDING_MAX_DELAY: float = 0.5
+
+
+def content_hash(text: str) -> str:
+    return sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Embedding vectors keyed by a hash of the text they embed, kept in a memory-mapped float32 .npy file with an append-only index of which row holds which hash,
+    so a resumed run never embeds the same text twice. Rows are written (and flushed) before they're added to the index, so a crash can't index a missing vector.
+
+    Attributes:
+        directory
+        _index
+        _vectors
+        _count
+
+    Methods:
+        get()
+        put()
+    """
+
+    INITIAL_ROWS: int = 1024
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index: dict[str, int] = {}
+        self._vectors: np.memmap | None = None
+        self._count: int = 0
+        self._lock = Lock()
+        index = self.directory / "index.jsonl"
+        if index.exists():
+            for line in index.read_text().splitlines():
+                if line:
+                    entry = json.loads(line)
+                    self._index[entry["hash"]] = entry["row"]
+            self._count = max(self._index.values(), default=-1) + 1
+            self._vectors = np.load(self.directory / "vectors.npy", mmap_mode="r+")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            row = self._index.get(key)
+            if row is None or self._vectors is None:
+                return None
+            return np.array(self._vectors[row])
+
+    def put(self, keys: list[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            rows = {}
+            for key, vector in zip(keys, vectors):
+                if key in self._index or key in rows:
+                    continue
+                self._reserve(self._count + 1, len(vector))
+                assert self._vectors is not None
+                self._vectors[self._count] = vector
+                rows[key] = self._count
+                self._count += 1
+            if len(rows) == 0:
+                return
+            assert self._vectors is not None
+            self._vectors.flush()
+            with (self.directory / "index.jsonl").open("a") as f:
+                for key, row in rows.items():
+                    f.write(json.dumps({"hash": key, "row": row}) + "\n")
+            self._index.update(rows)
+
+    def _reserve(self, rows: int, dimensions: int) -> None:
+        path = self.directory / "vectors.npy"
+        if self._vectors is None:
+            self._vectors = np.lib.format.open_memmap(
+                path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(max(rows, self.INITIAL_ROWS), dimensions),
+            )
+            return
+        if self._vectors.shape[1] != dimensions:
+            raise ValueError(
+                f"expected {self._vectors.shape[1]} dimensions, got {dimensions}!"
+            )
+        if rows <= self._vectors.shape[0]:
+            return
+        # NOTE: the file doubles in size so growing it stays amortized O(1) per vector
+        grown = np.lib.format.open_memmap(
+            path.with_suffix(".tmp.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(max(rows, self._vectors.shape[0] * 2), dimensions),
+        )
+        grown[: self._count] = self._vectors[: self._count]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(path.with_suffix(".tmp.npy"), path)
+        self._vectors = np.load(path, mmap_mode="r+")
+
+
+class EmbeddingService:
+    """
+    Queues texts to be embedded and sends them in micro-batches: as soon as batch_size texts are waiting, or once the oldest has waited max_delay seconds.
+    Identical texts are only embedded once, whether they're already stored, already waiting, or in a batch that's being sent.
+
+    Attributes:
+        store
+        batch_size
+        max_delay
+        _pending
+        _in_flight
+
+    Methods:
+        submit()
+        embed()
+        flush()
+        close()
+    """
+
+    def __init__(
+        self,
+        store: EmbeddingStore | None = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_delay: float = EMBEDDING_MAX_DELAY,
+        embed: Callable[[list[str]], list[list[float]]] | None = None,
+    ) -> None:
+        self.store = store
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._embed = embed or generate_embeddings
+        self._vectors: dict[str, np.ndarray] = {}
+        self._pending: dict[str, tuple[str, Future[np.ndarray]]] = {}
+        self._in_flight: dict[str, Future[np.ndarray]] = {}
+        self._oldest: float | None = None
+        self._closed: bool = False
+        self._condition = Condition()
+        self._thread = Thread(
+            target=self._flush_when_due, name="embeddings", daemon=True
+        )
+        self._thread.start()
+
+    def _lookup(self, key: str) -> np.ndarray | None:
+        if self.store is not None:
+            return self.store.get(key)
+        return self._vectors.get(key)
+
+    def submit(self, text: str) -> Future[np.ndarray]:
+        """
+        Queue a text to be embedded, returning a future for its vector.
+        """
+        key = content_hash(text)
+        vector = self._lookup(key)
+        if vector is not None:
+            TELEMETRY.count("embedding_cache_hits")
+            future: Future[np.ndarray] = Future()
+            future.set_result(vector)
+            return future
+        with self._condition:
+            if key in self._pending:
+                TELEMETRY.count("embedding_deduplicated")
+                return self._pending[key][1]
+            if key in self._in_flight:
+                TELEMETRY.count("embedding_deduplicated")
+                return self._in_flight[key]
+            future = Future()
+            self._pending[key] = (text, future)
+            if self._oldest is None:
+                self._oldest = monotonic()
+                self._condition.notify()
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        return future
+
+    def embed(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        Embed texts right away (along with anything else waiting), returning their vectors in order.
+        """
+        futures = [self.submit(text) for text in texts]
+        self.flush()
+        return [future.result() for future in futures]
+
+    def flush(self) -> None:
+        with self._condition:
+            batch = self._pending
+            self._pending = {}
+            self._oldest = None
+            self._in_flight.update({key: future for key, (_, future) in batch.items()})
+        if len(batch) == 0:
+            return
+        try:
+            vectors = np.asarray(
+                self._embed([text for text, _ in batch.values()]), dtype=np.float32
+            )
+            TELEMETRY.count("embedding_batches")
+            TELEMETRY.count("embedding_texts", len(batch))
+            if self.store is not None:
+                self.store.put(list(batch), vectors)
+            else:
+                self._vectors.update(zip(batch, vectors))
+        except Exception as e:
+            for _, future in batch.values():
+                future.set_exception(e)
+            return
+        finally:
+            with self._condition:
+                for key in batch:
+                    del self._in_flight[key]
+        for (_, future), vector in zip(batch.values(), vectors):
+            future.set_result(vector)
+
+    def _flush_when_due(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and self._oldest is None:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                assert self._oldest is not None
+                remaining = self._oldest + self.max_delay - monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+            self.flush()
+
+    def close(self) -> None:
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+
+_embedding_service: EmbeddingService | None = None
+
+
+def set_embedding_service(service: EmbeddingService | None) -> EmbeddingService | None:
+    """
+    Start (or stop, with None) embedding memories, feelings, and history events as they're added, returning the previous service so it can be restored.
+    """
+    global _embedding_service
+    previous = _embedding_service
+    _embedding_service = service
+    return previous
+
+
+def embeddings_enabled() -> bool:
+    return _embedding_service is not None
+
+
+def queue_embedding(text: str) -> None:
+    """
+    Queue a text to be embedded in the next micro-batch, if an embedding service is running.
+    """
+    if _embedding_service is not None:
+        _embedding_service.submit(text)
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Embed texts now, through the embedding service (so they're deduplicated and stored) if one is running.
+    """
+    if _embedding_service is None:
+        return generate_embeddings(texts)
+    return [vector.tolist() for vector in _embedding_service.embed(texts)]
+
+
+MINHASH_PERMUTATIONS: int = 64
+_MINHASH_PRIME: int = (1 << 61) - 1
+_minhash_rng = Random(0x4D5352)
+_MINHASH_COEFFICIENTS: list[tuple[int, int]] = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def shingles(text: str, size: int = 3) -> set[str]:
+    """
+    Break a piece of text into overlapping word n-grams, ignoring case and punctuation.
+    """
+    words = "".join([c if c.isalnum() else " " for c in text.lower()]).split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> list[int]:
+    """
+    Compute a MinHash signature for the text's shingles. Comparing two signatures estimates the Jaccard similarity of the texts without any LLM calls.
+    """
+    hashes = [
+        int.from_bytes(blake2b(shingle.encode(), digest_size=8).digest())
+        for shingle in shingles(text)
+    ]
+    return [
+        min((a * h + b) % _MINHASH_PRIME for h in hashes)
+        for a, b in _MINHASH_COEFFICIENTS
+    ]
+
+
+def estimate_similarity(a: list[int], b: list[int]) -> float:
+    return sum([1 for x, y in zip(a, b) if x == y]) / len(a)
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum([x * y for x, y in zip(a, b)])
+    norm = sqrt(sum([x * x for x in a])) * sqrt(sum([y * y for y in b]))
+    if norm == 0:
+        return 0.0
+    return dot / norm
+
+
 def generate_summary(context: str) -> str:
     prompt = f"Summarize the following information. Only respond with the summary, keeping your response to the minimum number of words required to create the summary.\n{context}"
-    return generate_single_response(prompt)
+    return generate_single_response(prompt, "summary")
 
 
 def main():